@@ -45,6 +45,8 @@ def create_app() -> Flask:
     )
 
     _register_socketio_events()
+    _start_job_recovery()
+    _start_prompt_prefetch()
     return app
 
 
@@ -83,4 +85,18 @@ def _register_socketio_events() -> None:
     from .events import generation  # noqa: F401  (imported for side effects)
 
 
+def _start_job_recovery() -> None:
+    """Collect results of ComfyUI jobs queued before the last restart."""
+    from .services import start_job_recovery
+
+    start_job_recovery()
+
+
+def _start_prompt_prefetch() -> None:
+    """Expand preset and popular prompts into the prompt cache while idle."""
+    from .services import start_prompt_prefetch
+
+    start_prompt_prefetch()
+
+
 __all__ = ["create_app", "socketio"]
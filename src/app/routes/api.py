@@ -6,16 +6,24 @@ from __future__ import annotations
 import random
 import shutil
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 
 from flask import Blueprint, current_app, jsonify, request
 
+from src.core.comfyui.graph import FEATURES
 from src.core.history.manager import history_manager
+from src.core.prompt.generator import MAX_PROMPT_VARIANTS, default_variant_count
 
 from ..extensions import socketio
 from ..services import (
     add_more_requests,
+    clear_prompt_cache,
+    finalize_images_request,
+    get_backend_status,
+    get_llm_status,
     get_preset_prompts,
+    get_prompt_cache_stats,
+    get_scheduler_metrics,
     get_status_snapshot,
     handle_history_switch,
     remove_generated_image,
@@ -27,6 +35,37 @@ from ..services import (
 bp = Blueprint("api", __name__, url_prefix="/api")
 
 
+_TRUE_VALUES = ("1", "true", "yes", "on")
+_FALSE_VALUES = ("0", "false", "no", "off")
+
+
+def _parse_bool(name: str, value: Any) -> bool:
+    """
+    Parse a boolean request field.
+
+    Accepts JSON booleans, 0/1 and the strings understood by ``env_bool``
+    (plus their negations); anything else raises ``ValueError`` instead of
+    being truth-tested, so ``"false"`` is never read as True.
+    """
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str):
+        text = value.strip().lower()
+        if text in _TRUE_VALUES:
+            return True
+        if text in _FALSE_VALUES:
+            return False
+    raise ValueError(f"{name} 必须是布尔值")
+
+
+def _parse_features(data: Dict[str, Any]) -> Optional[Dict[str, bool]]:
+    """Collect workflow stage switches (``face_fix``, ``upscale``) from a request body."""
+    features = {name: _parse_bool(name, data[name]) for name in FEATURES if data.get(name) is not None}
+    return features or None
+
+
 @bp.route("/test_emit", methods=["POST"])
 def test_emit():
     """Test emitting a message to Socket.IO clients."""
@@ -66,18 +105,62 @@ def start_generation():
     width = int(data.get("width", 800))
     height = int(data.get("height", 1200))
     image_path = data.get("image_path")
-
-    state = start_generation_request(prompt, count, width, height, image_path)
+    seed = data.get("seed")
+    if seed is not None:
+        try:
+            seed = int(seed)
+        except (TypeError, ValueError):
+            return jsonify({"success": False, "message": "seed 必须是整数"}), 400
+    draft = data.get("draft")
+    try:
+        if draft is not None:
+            draft = _parse_bool("draft", draft)
+        features = _parse_features(data)
+    except ValueError as exc:
+        return jsonify({"success": False, "message": str(exc)}), 400
+    variants = data.get("variants")
+    if isinstance(variants, bool):
+        variants = default_variant_count() if variants else 1
+    elif variants is not None:
+        try:
+            variants = min(int(variants), MAX_PROMPT_VARIANTS)
+        except (TypeError, ValueError):
+            return jsonify({"success": False, "message": "variants 必须是整数或布尔值"}), 400
+
+    state = start_generation_request(
+        prompt, count, width, height, image_path, seed, draft, features, variants
+    )
 
     return jsonify(
         {
             "success": True,
             "current_prompt": state["current_prompt"],
             "total_count": state["total_count"],
+            "draft": state["draft"],
+            "features": state["features"],
+            "variants": state["variants"],
         }
     )
 
 
+@bp.route("/finalize", methods=["POST"])
+def finalize_images():
+    """Run the detail and upscale stages on selected draft images."""
+    data: Dict[str, Any] = request.get_json(silent=True) or {}
+    filenames = data.get("filenames")
+    if filenames is None and data.get("filename"):
+        filenames = [data["filename"]]
+
+    try:
+        accepted = finalize_images_request(
+            filenames or [], data.get("image_path"), _parse_features(data)
+        )
+    except ValueError as exc:
+        return jsonify({"success": False, "message": str(exc)}), 400
+
+    return jsonify({"success": True, "drafts": accepted})
+
+
 @bp.route("/stop", methods=["POST"])
 def stop_generation():
     """Stop the current generation worker."""
@@ -91,6 +174,31 @@ def get_status():
     return jsonify(get_status_snapshot())
 
 
+@bp.route("/backends", methods=["GET"])
+def get_backends():
+    """Return the state of every ComfyUI backend and LLM provider and scheduling metrics."""
+    return jsonify(
+        {
+            "success": True,
+            "backends": get_backend_status(),
+            "scheduler": get_scheduler_metrics(),
+            "llm": get_llm_status(),
+        }
+    )
+
+
+@bp.route("/prompt_cache", methods=["GET"])
+def get_prompt_cache():
+    """Return prompt cache hit/miss statistics."""
+    return jsonify({"success": True, "stats": get_prompt_cache_stats()})
+
+
+@bp.route("/prompt_cache", methods=["DELETE"])
+def delete_prompt_cache():
+    """Invalidate every cached prompt expansion."""
+    return jsonify({"success": True, "removed": clear_prompt_cache()})
+
+
 @bp.route("/prompts", methods=["GET"])
 def get_prompts():
     """Fetch preset prompts."""
@@ -4,7 +4,13 @@ Service layer exports.
 from .generation import (
     add_more_requests,
     add_client,
+    clear_prompt_cache,
+    finalize_images_request,
+    get_backend_status,
+    get_llm_status,
     get_preset_prompts,
+    get_prompt_cache_stats,
+    get_scheduler_metrics,
     get_status_snapshot,
     handle_history_switch,
     remove_client,
@@ -13,16 +19,26 @@ from .generation import (
     start_generation_request,
     stop_generation_request,
 )
+from .prefetch import start_prompt_prefetch
+from .recovery import start_job_recovery
 
 __all__ = [
     "add_client",
     "remove_client",
     "start_generation_request",
     "stop_generation_request",
+    "finalize_images_request",
     "get_status_snapshot",
     "get_preset_prompts",
+    "get_backend_status",
+    "get_scheduler_metrics",
+    "get_prompt_cache_stats",
+    "get_llm_status",
+    "clear_prompt_cache",
     "save_upload_file",
     "remove_generated_image",
     "add_more_requests",
     "handle_history_switch",
+    "start_job_recovery",
+    "start_prompt_prefetch",
 ]
@@ -4,21 +4,38 @@ Generation service encapsulating stateful image generation workflow.
 from __future__ import annotations
 
 import os
+import shutil
 import threading
 import time
 import uuid
+from collections import deque
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Deque, Dict, List, Optional, Tuple
 
 from flask import current_app
 from werkzeug.datastructures import FileStorage
 from werkzeug.utils import secure_filename
 
-from src.core.comfyui.client import generate_image_with_comfyui
+from src.core.comfyui.client import ComfyJob, comfyui_client, result_key
+from src.core.comfyui.progress import ProgressRelay
+from src.core.comfyui.tracker import JobCancelledError
+from src.core.comfyui.workflow import MAX_SEED, STAGE_DRAFT, STAGE_FINAL, STAGE_FULL
+from src.core.history.journal import CANCELLED, job_journal
 from src.core.history.manager import history_manager
-from src.core.prompt.generator import generate_prompt
+from src.core.prompt.generator import (
+    CancelEvent,
+    PromptCancelledError,
+    clear_cache,
+    generate_prompt,
+    generate_prompt_variants,
+    get_cache_stats,
+)
+from src.core.prompt.router import get_router
+from src.utils.env import env_float, env_int
 
 from ..extensions import socketio
+from .prefetch import prompt_prefetcher
 
 PROJECT_ROOT = Path(__file__).resolve().parents[3]
 GENERATED_DIR = PROJECT_ROOT / "static" / "generated"
@@ -41,11 +58,26 @@ _current_generation: Dict[str, Optional[object]] = {
     "generated_count": 0,
     "images": [],
     "stop_flag": False,
+    # Pinned base seed (None = random); job n of the prompt uses seed + n
+    "seed": None,
+    "seed_offset": 0,
+    # Draft mode: render only up to VAEDecode, finalize selected images later
+    "draft": False,
+    # Optional workflow stages switched on/off (see graph.FEATURES)
+    "features": {},
+    # Prompt pairs requested per LLM call (1 = off); jobs rotate through them
+    "variants": 1,
+    "variant_index": 0,
 }
 
+PromptPair = Tuple[str, str]
+
 # Synchronise access to mutable state
 _state_lock = threading.Lock()
 
+# Control handle of the most recently started worker (see ``_WorkerControl``)
+_worker_control: Optional["_WorkerControl"] = None
+
 
 def allowed_file(filename: str) -> bool:
     """Return True if the filename extension is supported."""
@@ -108,12 +140,25 @@ def start_generation_request(
     width: int,
     height: int,
     image_path: Optional[str],
+    seed: Optional[int] = None,
+    draft: Optional[bool] = None,
+    features: Optional[Dict[str, bool]] = None,
+    variants: Optional[int] = None,
 ) -> Dict[str, object]:
     """
     Update generation state and ensure the worker thread is running.
 
+    ``seed`` pins the seeds of the following jobs (``seed``, ``seed + 1``,
+    ...) so a repeated request is answered from the result cache.
+    ``draft`` switches draft mode on or off (None keeps the current mode);
+    drafts skip the detailers and the upscaler until they are finalized.
+    ``features`` replaces the stage switches (e.g. ``{"upscale": False}``).
+    ``variants`` > 1 asks the LLM for that many prompt pairs in one call and
+    rotates through them job by job (None keeps the current setting).
+
     Returns the updated state snapshot.
     """
+    global _worker_control
     with _state_lock:
         if prompt and prompt != _current_generation["current_prompt"]:
             _reset_generation_state(prompt, width, height, image_path, count)
@@ -121,26 +166,53 @@ def start_generation_request(
             _current_generation["total_count"] += count
             if image_path:
                 _current_generation["image_path"] = image_path
+        if seed is not None:
+            _current_generation["seed"] = seed
+            _current_generation["seed_offset"] = 0
+        if draft is not None:
+            _current_generation["draft"] = bool(draft)
+        if features is not None:
+            _current_generation["features"] = dict(features)
+        if variants is not None:
+            _current_generation["variants"] = max(1, int(variants))
 
         if not _current_generation["is_running"]:
             _current_generation["is_running"] = True
             _current_generation["stop_flag"] = False
+            _worker_control = _WorkerControl()
             app_obj = current_app._get_current_object()
             thread = threading.Thread(
                 target=_worker_thread,
-                args=(app_obj,),
+                args=(app_obj, _worker_control),
                 daemon=True,
             )
             thread.start()
 
+    # Real work takes priority over idle-time prompt prefetching
+    prompt_prefetcher.interrupt()
     return get_status_snapshot()
 
 
 def stop_generation_request() -> None:
-    """Signal the worker thread to stop gracefully."""
+    """
+    Stop the worker and cancel its in-flight work.
+
+    Aborts a running LLM stream, deletes our pending prompts from the
+    ComfyUI queue and interrupts the one currently rendering, so the
+    worker no longer blocks until the current image is finished.
+    """
     with _state_lock:
         _current_generation["stop_flag"] = True
         _current_generation["is_running"] = False
+        control = _worker_control
+        if control is None:
+            return
+        control.cancel_event.set()
+        jobs = [entry.job for entry in control.pending]
+        control.pending.clear()
+
+    if jobs:
+        _cancel_jobs(jobs)
 
 
 def add_more_requests(additional_count: int) -> Dict[str, object]:
@@ -166,6 +238,62 @@ def add_more_requests(additional_count: int) -> Dict[str, object]:
     return get_status_snapshot()
 
 
+def finalize_images_request(
+    filenames: List[str],
+    image_path: Optional[str] = None,
+    features: Optional[Dict[str, bool]] = None,
+) -> List[str]:
+    """
+    Run the detail and upscale stages on selected drafts in the background.
+
+    Each draft is uploaded to a backend and finalized with its own seed; the
+    result is stored next to the draft and announced with an
+    ``image_finalized`` event.
+
+    Args:
+        filenames: Prompt-relative draft paths (prompt_id/image.png).
+        image_path: Face reference image (defaults to the current one when
+            the drafts belong to the current prompt).
+        features: Stage switches, e.g. ``{"upscale": False}`` (all on if None).
+
+    Returns:
+        The accepted draft paths.
+
+    Raises:
+        ValueError: When a file is missing or is not a draft.
+    """
+    if not filenames:
+        raise ValueError("没有选择要精修的图片")
+
+    drafts: List[Tuple[str, str, int, Optional[PromptPair]]] = []
+    for filename in filenames:
+        parts = filename.split("/") if isinstance(filename, str) else []
+        if len(parts) != 2:
+            raise ValueError("文件名格式不正确")
+        prompt_id, image_name = parts
+        info = history_manager.get_image_info(prompt_id, image_name)
+        if not info or not (GENERATED_DIR / prompt_id / image_name).exists():
+            raise ValueError(f"图片不存在: {filename}")
+        if info["stage"] != STAGE_DRAFT or info["seed"] is None:
+            raise ValueError(f"只能精修草稿图片: {filename}")
+        prompts = None
+        if info["positive_prompt"] is not None:
+            prompts = (info["positive_prompt"], info["negative_prompt"] or "")
+        drafts.append((prompt_id, image_name, info["seed"], prompts))
+
+    with _state_lock:
+        if image_path is None and _current_generation["prompt_id"] == drafts[0][0]:
+            image_path = _current_generation["image_path"]
+
+    app_obj = current_app._get_current_object()
+    threading.Thread(
+        target=_finalize_thread,
+        args=(app_obj, drafts, image_path, features),
+        daemon=True,
+    ).start()
+    return [f"{prompt_id}/{image_name}" for prompt_id, image_name, _, _ in drafts]
+
+
 def get_status_snapshot() -> Dict[str, object]:
     """Return a copy of the current generation state."""
     with _state_lock:
@@ -178,9 +306,49 @@ def get_status_snapshot() -> Dict[str, object]:
             "total_count": _current_generation["total_count"],
             "generated_count": _current_generation["generated_count"],
             "images": list(_current_generation["images"]),
+            "seed": _current_generation["seed"],
+            "draft": _current_generation["draft"],
+            "features": dict(_current_generation["features"]),
+            "variants": _current_generation["variants"],
         }
 
 
+def get_backend_status() -> List[Dict[str, object]]:
+    """Return health and queue depth of every configured ComfyUI backend."""
+    return comfyui_client.pool.snapshot()
+
+
+def get_scheduler_metrics() -> Dict[str, int]:
+    """
+    Return how often cache-aware scheduling let ComfyUI reuse loaded models.
+
+    ``avoided_reloads`` counts jobs routed to a backend that already had
+    their model stack loaded plus reloads saved by reordering batches.
+    """
+    metrics = comfyui_client.scheduler.metrics()
+    affinity_picks = sum(backend["affinity_picks"] for backend in comfyui_client.pool.snapshot())
+    metrics["affinity_picks"] = affinity_picks
+    metrics["avoided_reloads"] = affinity_picks + metrics["reorder_avoided_reloads"]
+    return metrics
+
+
+def get_llm_status() -> List[Dict[str, object]]:
+    """Return latency averages and circuit-breaker state of every LLM endpoint."""
+    return get_router().snapshot()
+
+
+def get_prompt_cache_stats() -> Dict[str, object]:
+    """Return hit/miss counters and sizes of the LLM prompt cache and prefetcher."""
+    stats: Dict[str, object] = dict(get_cache_stats())
+    stats["prefetch"] = prompt_prefetcher.snapshot()
+    return stats
+
+
+def clear_prompt_cache() -> int:
+    """Drop every cached prompt expansion (memory and SQLite)."""
+    return clear_cache()
+
+
 def get_preset_prompts() -> List[str]:
     """Read preset prompts from environment variables."""
     prompts: List[str] = []
@@ -280,86 +448,594 @@ def _reset_generation_state(
             "prompt_id": None,
             "positive_prompt": None,
             "negative_prompt": None,
+            "seed": None,
+            "seed_offset": 0,
+            "variant_index": 0,
         }
     )
 
 
-def _worker_thread(app) -> None:
-    """Continuously process generation requests while state is active."""
-    with app.app_context():
-        while _current_generation["is_running"]:
-            if _current_generation["stop_flag"]:
-                break
+@dataclass
+class _PendingJob:
+    """A ComfyUI job queued by the worker but not yet collected."""
 
-            _emit_progress("generating_prompt")
+    user_prompt: str
+    prompt_id: str
+    job: ComfyJob
+    prompts: Optional[PromptPair] = None
 
-            def log_callback(message: str) -> None:
-                socketio.emit("log", {"message": message}, room="generation")
 
-            try:
-                positive_prompt, negative_prompt = generate_prompt(
-                    _current_generation["current_prompt"],
-                    stream=True,
-                    log_callback=log_callback,
-                )
-            except Exception as exc:
-                _handle_worker_error(exc)
-                break
-
-            _current_generation["positive_prompt"] = positive_prompt
-            _current_generation["negative_prompt"] = negative_prompt
-
-            prompt_id = history_manager.add_record(
-                _current_generation["current_prompt"],
-                positive_prompt,
-                negative_prompt,
-                _current_generation["width"],
-                _current_generation["height"],
-            )
-            _current_generation["prompt_id"] = prompt_id
+@dataclass
+class _WorkerControl:
+    """
+    State shared between a worker thread and ``stop_generation_request``.
 
-            _emit_progress("generating_image")
+    ``pending`` holds every job the worker has queued and not yet finished
+    (the one being collected stays at the head); it is only mutated under
+    ``_state_lock``.
+    """
 
-            try:
-                images = generate_image_with_comfyui(
-                    positive_prompt,
-                    negative_prompt,
-                    width=_current_generation["width"],
-                    height=_current_generation["height"],
-                    image_path=_current_generation["image_path"],
-                )
-            except Exception as exc:
-                _handle_worker_error(exc)
-                break
+    # Stopping closes an LLM request that has not produced its first token yet
+    cancel_event: CancelEvent = field(default_factory=CancelEvent)
+    pending: Deque[_PendingJob] = field(default_factory=deque)
 
-            for image_data in images:
-                _persist_image(prompt_id, image_data)
 
+def _worker_thread(app, control: _WorkerControl) -> None:
+    """
+    Continuously process generation requests while state is active.
+
+    Up to ``COMFYUI_INFLIGHT`` jobs are kept queued in ComfyUI so the GPU
+    keeps rendering while earlier results are downloaded and saved.
+    """
+    with app.app_context():
+        pending = control.pending
+        try:
+            while _current_generation["is_running"]:
                 if _current_generation["stop_flag"]:
                     break
 
-            if _current_generation["generated_count"] >= _current_generation["total_count"]:
-                _current_generation["is_running"] = False
-                socketio.emit(
-                    "generation_complete",
-                    {"total": _current_generation["generated_count"]},
-                    room="generation",
+                _drop_stale_jobs(pending)
+                if not _fill_pipeline(control):
+                    break
+                if not pending:
+                    # The remaining images were served from the result cache
+                    _complete_if_done()
+                    break
+
+                entry = pending[0]
+                try:
+                    image_refs = comfyui_client.collect_outputs(entry.job)
+                except JobCancelledError:
+                    break
+                except Exception as exc:
+                    _handle_worker_error(exc)
+                    break
+                finally:
+                    with _state_lock:
+                        if pending and pending[0] is entry:
+                            pending.popleft()
+
+                if entry.user_prompt != _current_generation["current_prompt"]:
+                    job_journal.finish([entry.job.prompt_id], CANCELLED)
+                    continue
+
+                saved: List[str] = []
+                try:
+                    for image_ref in image_refs:
+                        if (
+                            _current_generation["stop_flag"]
+                            or _current_generation["generated_count"] >= _current_generation["total_count"]
+                        ):
+                            break
+                        saved.append(
+                            _persist_image(entry.prompt_id, entry.job, image_ref, entry.prompts)
+                        )
+                except Exception as exc:
+                    _handle_worker_error(exc)
+                    break
+
+                job_journal.finish([entry.job.prompt_id])
+                if saved and len(saved) == len(image_refs):
+                    history_manager.save_cached_result(
+                        entry.job.cache_key, entry.prompt_id, saved, entry.job.seed
+                    )
+
+                if _complete_if_done():
+                    break
+        finally:
+            # Results of jobs still queued would never be used
+            with _state_lock:
+                leftover = [entry.job for entry in pending]
+                pending.clear()
+            if leftover:
+                _cancel_jobs(leftover)
+            prompt_prefetcher.notify_idle()
+
+
+def _fill_pipeline(control: _WorkerControl) -> bool:
+    """
+    Queue jobs until the in-flight window is full or every image is planned.
+
+    The free slots are planned first and submitted together, so jobs with
+    different prompts (variant mode) are ordered for ComfyUI cache reuse.
+
+    Returns:
+        False when prompt generation or submission failed or was cancelled.
+    """
+    pending = control.pending
+    window = max(1, env_int("COMFYUI_INFLIGHT", 2))
+
+    def log_callback(message: str) -> None:
+        socketio.emit("log", {"message": message}, room="generation")
+
+    def retract_callback(discarded: str) -> None:
+        # The LLM failed over mid-stream: drop its partial output from the log
+        socketio.emit("log_retract", {"message": discarded}, room="generation")
+
+    batch: List[Tuple[str, PromptPair, Dict[str, object]]] = []
+    user_prompt = _current_generation["current_prompt"]
+    while len(pending) + len(batch) < window and not _current_generation["stop_flag"]:
+        planned = _current_generation["generated_count"] + sum(
+            entry.job.batch_size for entry in pending
+        ) + sum(options["batch_size"] for _, _, options in batch)
+        remaining = _current_generation["total_count"] - planned
+        if remaining <= 0:
+            break
+
+        _emit_progress("generating_prompt")
+
+        try:
+            positive_prompt, negative_prompt = _next_prompt(
+                user_prompt, log_callback, retract_callback, control.cancel_event
+            )
+        except PromptCancelledError:
+            return False
+        except Exception as exc:
+            _handle_worker_error(exc)
+            return False
+
+        _current_generation["positive_prompt"] = positive_prompt
+        _current_generation["negative_prompt"] = negative_prompt
+
+        prompt_id = history_manager.add_record(
+            user_prompt,
+            positive_prompt,
+            negative_prompt,
+            _current_generation["width"],
+            _current_generation["height"],
+        )
+        _current_generation["prompt_id"] = prompt_id
+
+        seed = _next_seed()
+        batch_size = _next_batch_size(remaining)
+        stage = STAGE_DRAFT if _current_generation["draft"] else STAGE_FULL
+        features = dict(_current_generation["features"])
+        if seed is not None and _serve_cached_result(
+            prompt_id, positive_prompt, negative_prompt, seed, batch_size, stage, features
+        ):
+            continue
+
+        batch.append((
+            prompt_id,
+            (positive_prompt, negative_prompt),
+            dict(
+                positive_prompt=positive_prompt,
+                negative_prompt=negative_prompt,
+                width=_current_generation["width"],
+                height=_current_generation["height"],
+                image_path=_current_generation["image_path"],
+                batch_size=batch_size,
+                on_progress=_progress_relay(),
+                seed=seed,
+                stage=stage,
+                features=features,
+            ),
+        ))
+
+    return _submit_batch(control, user_prompt, batch)
+
+
+def _submit_batch(
+    control: _WorkerControl,
+    user_prompt: str,
+    batch: List[Tuple[str, PromptPair, Dict[str, object]]],
+) -> bool:
+    """
+    Queue planned jobs and add them to the worker's pending window.
+
+    Several jobs go through ``submit_many``, which orders them so jobs
+    sharing a model stack and prompt text run back to back.
+    """
+    if not batch:
+        return True
+    _emit_progress("generating_image")
+
+    journaled: List[str] = []
+    options = [
+        dict(job_options, on_queue=_journal_hook(prompt_id, prompts, journaled))
+        for prompt_id, prompts, job_options in batch
+    ]
+    try:
+        if len(batch) == 1:
+            jobs = [comfyui_client.submit_image(**options[0])]
+        else:
+            jobs = comfyui_client.submit_many(options)
+    except Exception as exc:
+        # Nothing of this batch will be collected (submit_many cancels what it queued)
+        _close_journal(journaled)
+        _handle_worker_error(exc)
+        return False
+
+    with _state_lock:
+        cancelled = control.cancel_event.is_set()
+        if not cancelled:
+            control.pending.extend(
+                _PendingJob(user_prompt, prompt_id, job, prompts)
+                for (prompt_id, prompts, _), job in zip(batch, jobs)
+            )
+    if cancelled:
+        # Stop was requested while the jobs were being submitted
+        _cancel_jobs(jobs)
+        return False
+    return True
+
+
+def _next_prompt(
+    user_prompt: str, log_callback, retract_callback, cancel_event: CancelEvent
+) -> PromptPair:
+    """
+    Return the prompt pair for the next job.
+
+    In variant mode one LLM call (cached like a single expansion) yields
+    several pairs and consecutive jobs take them in turn; images of one
+    batch share a pair.
+    """
+    count = _current_generation["variants"] or 1
+    if count <= 1:
+        return generate_prompt(
+            user_prompt,
+            stream=True,
+            log_callback=log_callback,
+            cancel_event=cancel_event,
+            reset_callback=retract_callback,
+        )
+
+    variants = generate_prompt_variants(
+        user_prompt,
+        count,
+        stream=True,
+        log_callback=log_callback,
+        cancel_event=cancel_event,
+        reset_callback=retract_callback,
+    )
+    with _state_lock:
+        index = _current_generation["variant_index"]
+        _current_generation["variant_index"] = index + 1
+    return variants[index % len(variants)]
+
+
+def _drop_stale_jobs(pending: Deque[_PendingJob]) -> None:
+    """Cancel queued jobs that belong to a prompt the user switched away from."""
+    current = _current_generation["current_prompt"]
+    with _state_lock:
+        stale = [entry for entry in pending if entry.user_prompt != current]
+        for entry in stale:
+            pending.remove(entry)
+    if stale:
+        _cancel_jobs([entry.job for entry in stale])
+
+
+def _journal_hook(prompt_id: str, prompts: Optional[PromptPair], journaled: List[str]):
+    """
+    Build the ``on_queue`` callback of one job: journal it before it is POSTed.
+
+    A crash between the POST and its response then still leaves a journal
+    entry that recovery can match against ComfyUI's history and queue. The
+    client calls the hook again when ComfyUI assigned its own prompt id
+    (older versions ignore client-supplied ids); the entry then moves to the
+    new id. Every recorded id is appended to ``journaled``.
+    """
+    recorded: List[str] = []
+
+    def on_queue(job: ComfyJob) -> None:
+        _close_journal(recorded)
+        _journal_job(prompt_id, job, prompts)
+        recorded.append(job.prompt_id)
+        journaled.append(job.prompt_id)
+
+    return on_queue
+
+
+def _close_journal(job_ids: List[str]) -> None:
+    """Mark journal entries of jobs that were never queued as cancelled."""
+    try:
+        job_journal.finish(job_ids, CANCELLED)
+    except Exception as exc:
+        print(f"⚠️ 写入任务日志失败: {exc}", flush=True)
+
+
+def _journal_job(prompt_id: str, job: ComfyJob, prompts: Optional[PromptPair] = None) -> None:
+    """
+    Record a job so its results can be collected after a restart.
+
+    Journal failures are logged and never stop generation.
+    """
+    try:
+        job_journal.record(
+            job.prompt_id,
+            job.server_address,
+            prompt_id,
+            output_nodes=job.output_nodes,
+            batch_size=job.batch_size,
+            seed=job.seed,
+            stage=job.stage,
+            cache_key=job.cache_key,
+            positive_prompt=prompts[0] if prompts else None,
+            negative_prompt=prompts[1] if prompts else None,
+        )
+    except Exception as exc:
+        print(f"⚠️ 写入任务日志失败: {exc}", flush=True)
+
+
+def _cancel_jobs(jobs: List[ComfyJob]) -> None:
+    """Cancel jobs on ComfyUI and close their journal entries."""
+    comfyui_client.cancel(jobs)
+    job_journal.finish([job.prompt_id for job in jobs], CANCELLED)
+
+
+def _finalize_thread(
+    app,
+    drafts: List[Tuple[str, str, int, Optional[PromptPair]]],
+    image_path: Optional[str],
+    features: Optional[Dict[str, bool]],
+) -> None:
+    """
+    Finalize drafts: queue every job first so the backends stay busy, then
+    collect and store the results in order. Each draft is refined with the
+    prompt pair it was rendered with (the record's pair for older images).
+    """
+    with app.app_context():
+        jobs: List[Tuple[str, str, ComfyJob, PromptPair]] = []
+        try:
+            planned: List[Tuple[str, str, PromptPair, Dict[str, object]]] = []
+            for prompt_id, image_name, seed, prompts in drafts:
+                record = history_manager.get_record_by_id(prompt_id)
+                if not record:
+                    continue
+                prompts = prompts or (record["positive_prompt"], record["negative_prompt"])
+                draft_path = GENERATED_DIR / prompt_id / image_name
+                options = dict(
+                    width=record.get("width") or 800,
+                    height=record.get("height") or 1200,
+                    image_path=image_path,
+                    seed=seed,
+                    stage=STAGE_FINAL,
+                    draft_path=draft_path,
+                    features=features,
+                )
+                cache_key = result_key(*prompts, **options)
+                cached = _link_cached_result(cache_key, prompt_id)
+                if cached:
+                    print(f"♻️ 命中精修缓存（种子 {seed}），跳过生成", flush=True)
+                    _record_final_image(prompt_id, image_name, cached[0], seed, prompts)
+                    continue
+                options.update(
+                    positive_prompt=prompts[0],
+                    negative_prompt=prompts[1],
+                    on_progress=_progress_relay(),
                 )
-                break
+                planned.append((prompt_id, image_name, prompts, options))
+
+            # Drafts of different prompts are ordered for ComfyUI cache reuse
+            journaled: List[str] = []
+            try:
+                submitted = comfyui_client.submit_many([
+                    dict(options, on_queue=_journal_hook(prompt_id, prompts, journaled))
+                    for prompt_id, _, prompts, options in planned
+                ])
+            except Exception:
+                _close_journal(journaled)
+                raise
+            for (prompt_id, image_name, prompts, _), job in zip(planned, submitted):
+                jobs.append((prompt_id, image_name, job, prompts))
+
+            while jobs:
+                prompt_id, image_name, job, prompts = jobs[0]
+                image_refs = comfyui_client.collect_outputs(job)
+                jobs.pop(0)
+                filenames = []
+                for image_ref in image_refs:
+                    filename = f"{uuid.uuid4().hex}.png"
+                    comfyui_client.download_image(
+                        image_ref, GENERATED_DIR / prompt_id / filename, job.server_address
+                    )
+                    filenames.append(filename)
+                job_journal.finish([job.prompt_id])
+                if filenames:
+                    history_manager.save_cached_result(job.cache_key, prompt_id, filenames, job.seed)
+                    _record_final_image(prompt_id, image_name, filenames[0], job.seed, prompts)
+        except Exception as exc:
+            _handle_worker_error(exc)
+        finally:
+            if jobs:
+                _cancel_jobs([job for _, _, job, _ in jobs])
+
+
+def _record_final_image(
+    prompt_id: str,
+    draft_name: str,
+    filename: str,
+    seed: int,
+    prompts: Optional[PromptPair] = None,
+) -> None:
+    """
+    Register a finalized draft and notify clients.
+
+    The image joins the current session's list (when it belongs to the
+    current prompt) without counting towards the requested total.
+    """
+    relative_path = f"{prompt_id}/{filename}"
+    positive_prompt, negative_prompt = prompts or (None, None)
+    history_manager.update_images(prompt_id, filename, seed, STAGE_FINAL, positive_prompt, negative_prompt)
+
+    with _state_lock:
+        if _current_generation["prompt_id"] == prompt_id:
+            _current_generation["images"].append(relative_path)
+
+    socketio.emit(
+        "image_finalized",
+        {
+            "draft": f"{prompt_id}/{draft_name}",
+            "filename": relative_path,
+            "seed": seed,
+        },
+        room="generation",
+    )
 
 
-def _persist_image(prompt_id: str, image_data: bytes) -> None:
-    """Save generated image to disk and update state/history."""
+def _next_batch_size(remaining: int) -> int:
+    """
+    Pick how many images the next ComfyUI prompt should produce.
+
+    Bounded by the remaining (not yet queued) count and
+    ``COMFYUI_MAX_BATCH_SIZE`` (the largest batch that fits in VRAM for the
+    configured workflows).
+    """
+    max_batch = max(1, env_int("COMFYUI_MAX_BATCH_SIZE", 1))
+    return max(1, min(remaining, max_batch))
+
+
+def _next_seed() -> Optional[int]:
+    """Return the pinned seed of the next job, or None for a random seed."""
+    with _state_lock:
+        base = _current_generation["seed"]
+        if base is None:
+            return None
+        offset = _current_generation["seed_offset"]
+        _current_generation["seed_offset"] = offset + 1
+    return (base + offset) % (MAX_SEED + 1)
+
+
+def _serve_cached_result(
+    prompt_id: str,
+    positive_prompt: str,
+    negative_prompt: str,
+    seed: int,
+    batch_size: int,
+    stage: str = STAGE_FULL,
+    features: Optional[Dict[str, bool]] = None,
+) -> bool:
+    """
+    Reuse stored images of an identical earlier job instead of rendering.
+
+    Returns:
+        True when the job was served from the cache.
+    """
+    try:
+        cache_key = result_key(
+            positive_prompt,
+            negative_prompt,
+            width=_current_generation["width"],
+            height=_current_generation["height"],
+            seed=seed,
+            image_path=_current_generation["image_path"],
+            batch_size=batch_size,
+            stage=stage,
+            features=features,
+        )
+    except Exception as exc:
+        print(f"⚠️ 读取结果缓存失败: {exc}", flush=True)
+        return False
+
+    filenames = _link_cached_result(cache_key, prompt_id)
+    if filenames is None:
+        return False
+
+    print(f"♻️ 命中结果缓存（种子 {seed}），跳过生成", flush=True)
+    for filename in filenames:
+        _record_image(prompt_id, filename, seed, stage, (positive_prompt, negative_prompt))
+    return True
+
+
+def _link_cached_result(cache_key: str, prompt_id: str) -> Optional[List[str]]:
+    """
+    Place the stored images of ``cache_key`` in the ``prompt_id`` folder.
+
+    Cached files are hard-linked (copied when linking is not possible) so
+    deleting either copy leaves the other intact. Entries whose files are
+    gone are dropped.
+
+    Returns:
+        The new file names, or None on a cache miss.
+    """
+    try:
+        cached = history_manager.get_cached_result(cache_key)
+    except Exception as exc:
+        print(f"⚠️ 读取结果缓存失败: {exc}", flush=True)
+        return None
+    if not cached:
+        return None
+
+    sources = [GENERATED_DIR / cached["prompt_id"] / name for name in cached["filenames"]]
+    if not all(source.exists() for source in sources):
+        history_manager.invalidate_cached_result(cache_key)
+        return None
+
+    target_dir = GENERATED_DIR / prompt_id
+    target_dir.mkdir(parents=True, exist_ok=True)
+    filenames = []
+    for source in sources:
+        filename = f"{uuid.uuid4().hex}.png"
+        try:
+            os.link(source, target_dir / filename)
+        except OSError:
+            shutil.copy2(source, target_dir / filename)
+        filenames.append(filename)
+    return filenames
+
+
+def _complete_if_done() -> bool:
+    """Finish the session once every requested image exists."""
+    if _current_generation["generated_count"] < _current_generation["total_count"]:
+        return False
+    _current_generation["is_running"] = False
+    socketio.emit(
+        "generation_complete",
+        {"total": _current_generation["generated_count"]},
+        room="generation",
+    )
+    return True
+
+
+def _persist_image(
+    prompt_id: str,
+    job: ComfyJob,
+    image_ref: Dict[str, str],
+    prompts: Optional[PromptPair] = None,
+) -> str:
+    """
+    Stream a generated image to disk and update state/history.
+
+    Returns:
+        The stored file name (relative to the prompt folder).
+    """
     filename = f"{uuid.uuid4().hex}.png"
-    prompt_dir = GENERATED_DIR / prompt_id
-    prompt_dir.mkdir(parents=True, exist_ok=True)
+    comfyui_client.download_image(image_ref, GENERATED_DIR / prompt_id / filename, job.server_address)
+    _record_image(prompt_id, filename, job.seed, job.stage, prompts)
+    return filename
 
-    filepath = prompt_dir / filename
-    with open(filepath, "wb") as fh:
-        fh.write(image_data)
 
+def _record_image(
+    prompt_id: str,
+    filename: str,
+    seed: Optional[int],
+    stage: str = STAGE_FULL,
+    prompts: Optional[PromptPair] = None,
+) -> None:
+    """Register a stored image in history/state and notify clients."""
     relative_path = f"{prompt_id}/{filename}"
-    history_manager.update_images(prompt_id, filename)
+    positive_prompt, negative_prompt = prompts or (None, None)
+    history_manager.update_images(prompt_id, filename, seed, stage, positive_prompt, negative_prompt)
 
     with _state_lock:
         _current_generation["images"].append(relative_path)
@@ -371,6 +1047,8 @@ def _persist_image(prompt_id: str, image_data: bytes) -> None:
             "filename": relative_path,
             "current": _current_generation["generated_count"],
             "total": _current_generation["total_count"],
+            "seed": seed,
+            "stage": stage,
         },
         room="generation",
     )
@@ -378,6 +1056,23 @@ def _persist_image(prompt_id: str, image_data: bytes) -> None:
     _emit_progress("generating")
 
 
+def _progress_relay() -> ProgressRelay:
+    """
+    Relay a job's sampler progress and latent previews to the browser.
+
+    Previews are limited to ``COMFYUI_PREVIEW_FPS`` frames per second (0
+    disables them) and scaled to at most ``COMFYUI_PREVIEW_SIZE`` pixels.
+    """
+    def emit(event: str, payload: Dict[str, object]) -> None:
+        socketio.emit(event, payload, room="generation")
+
+    return ProgressRelay(
+        emit,
+        fps=env_float("COMFYUI_PREVIEW_FPS", 2.0),
+        max_size=env_int("COMFYUI_PREVIEW_SIZE", 256),
+    )
+
+
 def _emit_progress(status: str) -> None:
     """Send progress updates to clients."""
     socketio.emit(
@@ -0,0 +1,189 @@
+"""
+Expand preset and popular prompts into the prompt cache while idle.
+
+Preset prompts (``PROMPT_1..N``) and the history prompts with the most
+generated images are sent through the LLM at startup and every time the
+generation worker goes idle, so the first start of one of them is answered
+from the prompt cache. The single expansion is always filled; the
+``PROMPT_VARIANTS`` variant set only once variant mode has been used (the
+variant namespace of the prompt cache holds an entry) or when
+``PROMPT_PREFETCH_VARIANTS=true``, so installs that never use variants do
+not pay for a second LLM call per prompt. Prefetch lookups are not counted
+in the prompt cache hit rate. A real generation request interrupts the
+prefetcher at once (its LLM stream is cancelled); it resumes on the next
+idle period.
+"""
+from __future__ import annotations
+
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from src.core.history.manager import history_manager
+from src.core.prompt.generator import (
+    CancelEvent,
+    PromptCancelledError,
+    default_variant_count,
+    generate_prompt_variants,
+    has_cached_variants,
+    is_prompt_cached,
+)
+from src.core.prompt.similarity import normalize_request
+from src.utils.env import env_bool, env_float, env_int
+
+
+class PromptPrefetcher:
+    """Background thread filling the prompt cache between generation runs."""
+
+    def __init__(self) -> None:
+        self._wake = threading.Event()
+        self._cancel = CancelEvent()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._is_busy: Callable[[], bool] = lambda: False
+        self._presets: Callable[[], List[str]] = list
+        self._active = False
+        self._stats = {"prefetched": 0, "interrupted": 0, "failed": 0}
+
+    def start(self, is_busy: Callable[[], bool], presets: Callable[[], List[str]]) -> None:
+        """
+        Start the prefetch thread and run a first pass right away.
+
+        Args:
+            is_busy: Returns True while the generation worker is running.
+            presets: Returns the preset prompts.
+        """
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._is_busy = is_busy
+            self._presets = presets
+            self._thread = threading.Thread(target=self._run, name="prompt-prefetch", daemon=True)
+            self._thread.start()
+        self._wake.set()
+
+    def notify_idle(self) -> None:
+        """Schedule a pass; called when the generation worker exits."""
+        self._wake.set()
+
+    def interrupt(self) -> None:
+        """Cancel the expansion in progress; called when a real job starts."""
+        self._cancel.set()
+
+    def snapshot(self) -> Dict[str, object]:
+        """Return counters and whether a pass is in progress."""
+        with self._lock:
+            snapshot: Dict[str, object] = dict(self._stats)
+            snapshot["enabled"] = self._thread is not None
+            snapshot["active"] = self._active
+            return snapshot
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self._stats[key] += 1
+
+    def _run(self) -> None:
+        interval = env_float("PROMPT_PREFETCH_INTERVAL", 600.0)
+        while True:
+            self._wake.wait(interval if interval > 0 else None)
+            self._wake.clear()
+            with self._lock:
+                self._active = True
+            try:
+                self._prefetch_pass()
+            except Exception as exc:
+                print(f"⚠️ 提示词预取出错: {exc}", flush=True)
+            finally:
+                with self._lock:
+                    self._active = False
+
+    def _candidates(self) -> List[str]:
+        """Presets first, then the most used history prompts, without duplicates."""
+        prompts = list(self._presets())
+        limit = env_int("PROMPT_PREFETCH_HISTORY", 10)
+        if limit > 0:
+            try:
+                prompts.extend(history_manager.get_popular_prompts(limit))
+            except Exception as exc:
+                print(f"⚠️ 读取常用提示词失败: {exc}", flush=True)
+
+        seen = set()
+        unique: List[str] = []
+        for prompt in prompts:
+            key = normalize_request(prompt)
+            if key and key not in seen:
+                seen.add(key)
+                unique.append(prompt)
+        return unique
+
+    def _todo(self) -> List[Tuple[str, int]]:
+        """Uncached (prompt, variant count) pairs: single expansions first, then variant sets."""
+        counts = [1]
+        variants = default_variant_count()
+        if variants > 1 and (env_bool("PROMPT_PREFETCH_VARIANTS", False) or has_cached_variants(variants)):
+            counts.append(variants)
+        candidates = self._candidates()
+        return [
+            (prompt, count)
+            for count in counts
+            for prompt in candidates
+            if not is_prompt_cached(prompt, count)
+        ]
+
+    def _prefetch_pass(self) -> None:
+        if self._is_busy():
+            return
+        todo = self._todo()
+        if not todo:
+            return
+
+        print(f"🔮 空闲时预取 {len(todo)} 条提示词", flush=True)
+        for user_prompt, count in todo:
+            # Clear before the busy check: a job starting after this point
+            # sets the event again and cancels the LLM stream below
+            self._cancel.clear()
+            if self._is_busy():
+                self._count("interrupted")
+                print("⏸️ 有新的生成任务，暂停提示词预取", flush=True)
+                return
+            if is_prompt_cached(user_prompt, count):
+                continue
+            try:
+                generate_prompt_variants(
+                    user_prompt,
+                    count,
+                    stream=True,
+                    log_callback=_discard,
+                    cancel_event=self._cancel,
+                    record_stats=False,
+                )
+            except PromptCancelledError:
+                self._count("interrupted")
+                print("⏸️ 有新的生成任务，暂停提示词预取", flush=True)
+                return
+            except Exception as exc:
+                # Usually the LLM is unreachable; retry on the next idle period
+                self._count("failed")
+                print(f"⚠️ 提示词预取失败: {exc}", flush=True)
+                return
+            self._count("prefetched")
+
+
+def _discard(message: str) -> None:
+    """Prefetch output is not streamed to any client."""
+
+
+prompt_prefetcher = PromptPrefetcher()
+
+
+def start_prompt_prefetch() -> None:
+    """
+    Start prefetching preset and popular prompt expansions.
+
+    Disabled with ``PROMPT_PREFETCH=false``.
+    """
+    if not env_bool("PROMPT_PREFETCH", True):
+        return
+    # Imported here: the generation service imports this module
+    from .generation import get_preset_prompts, get_status_snapshot
+
+    prompt_prefetcher.start(lambda: bool(get_status_snapshot()["is_running"]), get_preset_prompts)
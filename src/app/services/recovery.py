@@ -0,0 +1,158 @@
+"""
+Reattach to ComfyUI jobs queued by a previous run of the process.
+
+Every job is written to the job journal (``data/jobs.db``) before it is
+POSTed, under the prompt id the client sends along with it. On startup, jobs
+the journal still lists as queued are looked up through ``/history``:
+finished ones have their images downloaded and recorded in ``HistoryManager``
+as if the worker had collected them, jobs still in the ComfyUI queue are
+polled until they finish, and jobs the backend no longer knows about (never
+queued, or lost in a backend restart) are marked lost.
+
+Each job is handled on its own: a failed lookup or download leaves only that
+job outstanding for the next pass. Collecting is idempotent (images get
+names derived from the job id and are recorded once), so a job retried after
+a partial failure never duplicates images or history rows.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from typing import Dict, List
+
+import requests
+
+from src.core.comfyui.client import comfyui_client
+from src.core.comfyui.workflow import select_output_images
+from src.core.history.journal import CANCELLED, DONE, LOST, QUEUED, job_journal
+from src.core.history.manager import history_manager
+from src.utils.env import env_bool, env_float
+
+from .generation import GENERATED_DIR
+
+
+def start_job_recovery() -> None:
+    """
+    Collect the results of journaled jobs in a background thread.
+
+    Disabled with ``COMFYUI_REATTACH=false``.
+    """
+    if not env_bool("COMFYUI_REATTACH", True):
+        return
+    threading.Thread(target=_recover_jobs, name="comfyui-reattach", daemon=True).start()
+
+
+def _recover_jobs() -> None:
+    try:
+        job_journal.purge()
+        jobs = job_journal.unfinished(env_float("COMFYUI_JOURNAL_MAX_AGE", 24.0))
+    except Exception as exc:
+        print(f"⚠️ 读取任务日志失败: {exc}", flush=True)
+        return
+    if not jobs:
+        return
+
+    print(f"🔁 重新接管 {len(jobs)} 个未完成的 ComfyUI 任务", flush=True)
+    poll_interval = env_float("COMFYUI_REATTACH_POLL", 2.0)
+    deadline = time.monotonic() + env_float("COMFYUI_REATTACH_TIMEOUT", 3600.0)
+
+    while jobs and time.monotonic() < deadline:
+        by_server: Dict[str, List[Dict]] = {}
+        for job in jobs:
+            by_server.setdefault(job["server_address"], []).append(job)
+
+        waiting: List[Dict] = []
+        for address, server_jobs in by_server.items():
+            try:
+                waiting += _check_server(address, server_jobs)
+            except requests.RequestException as exc:
+                # /queue unreachable: keep the jobs until it comes back or we give up
+                print(f"⚠️ 无法连接 ComfyUI 后端 ({address}): {exc}", flush=True)
+                waiting += server_jobs
+        jobs = waiting
+        if jobs:
+            time.sleep(poll_interval)
+
+    if jobs:
+        print(f"⚠️ {len(jobs)} 个 ComfyUI 任务在超时前仍未完成", flush=True)
+
+
+def _check_server(address: str, jobs: List[Dict]) -> List[Dict]:
+    """
+    Collect finished jobs of one backend and return those still outstanding.
+
+    Outstanding are jobs still in the backend's queue and jobs whose lookup
+    or download failed this pass. Jobs the journal no longer lists as queued
+    (collected or cancelled meanwhile) are dropped.
+    """
+    queue = comfyui_client.get_queue(address)
+    queued = {
+        item[1]
+        for key in ("queue_running", "queue_pending")
+        for item in queue.get(key, [])
+    }
+
+    waiting = []
+    for job in jobs:
+        job_id = job["job_id"]
+        if job_journal.status(job_id) != QUEUED:
+            continue
+        try:
+            history = comfyui_client.get_history(job_id, address)
+            if job_id in history:
+                _collect(job, history[job_id])
+                continue
+        except requests.RequestException as exc:
+            print(f"⚠️ 接管 ComfyUI 任务失败，稍后重试 ({job_id}): {exc}", flush=True)
+            waiting.append(job)
+            continue
+
+        if job_id in queued:
+            waiting.append(job)
+        else:
+            print(f"⚠️ ComfyUI 任务已丢失（未入队或后端已重启）: {job_id}", flush=True)
+            job_journal.finish([job_id], LOST)
+    return waiting
+
+
+def _collect(job: Dict, history: Dict) -> None:
+    """
+    Store the images of a finished job under its history record.
+
+    Every image is downloaded before anything is recorded, under a name
+    derived from the job id; images already on disk or in the record (from
+    an earlier, interrupted attempt) are not fetched or recorded again.
+    """
+    prompt_id = job["prompt_id"]
+    if not history_manager.get_record_by_id(prompt_id):
+        # The history record was deleted meanwhile
+        job_journal.finish([job["job_id"]], CANCELLED)
+        return
+
+    refs = select_output_images(history.get("outputs", {}), job["output_nodes"])
+    saved = []
+    for index, image_ref in enumerate(refs):
+        filename = f"{job['job_id']}-{index}.png"
+        path = GENERATED_DIR / prompt_id / filename
+        if not path.exists():
+            # Written atomically, so an existing file is complete
+            comfyui_client.download_image(image_ref, path, job["server_address"])
+        saved.append(filename)
+
+    recorded = set(history_manager.get_images_by_prompt_id(prompt_id))
+    for filename in saved:
+        if filename in recorded:
+            continue
+        history_manager.update_images(
+            prompt_id,
+            filename,
+            job["seed"],
+            job["stage"] or "full",
+            job["positive_prompt"],
+            job["negative_prompt"],
+        )
+
+    if saved and job["cache_key"]:
+        history_manager.save_cached_result(job["cache_key"], prompt_id, saved, job["seed"])
+    job_journal.finish([job["job_id"]], DONE)
+    print(f"📥 已接管 ComfyUI 任务 {job['job_id']}，保存 {len(saved)} 张图片", flush=True)
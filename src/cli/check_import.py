@@ -1,13 +1,14 @@
 """
 Quick smoke-test to ensure core modules import correctly.
 """
-import io
 import os
 import sys
 from pathlib import Path
 
-# Force UTF-8 output on Windows
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
+# Force UTF-8 output on Windows (reconfigure in place: a second wrapper would
+# close the shared buffer when it is garbage collected)
+if hasattr(sys.stdout, "reconfigure"):
+    sys.stdout.reconfigure(encoding="utf-8")
 
 PROJECT_ROOT = Path(__file__).resolve().parents[2]
 if str(PROJECT_ROOT) not in sys.path:
@@ -0,0 +1,184 @@
+"""
+asyncio API over the shared ComfyUI client.
+
+``AsyncComfyUIClient`` exposes queue, wait, fetch, upload and cancel as
+coroutines on top of ``comfyui_client``, so async callers share its pooled
+sessions and retries, the ``BackendPool`` dispatch, the cache-aware
+scheduler, the upload cache and the websocket ``CompletionTracker`` with the
+synchronous code paths.
+
+Waiting for completion, the long part of every job, holds no thread: the
+tracker's listener wakes each waiting coroutine on its event loop. Short HTTP
+requests run on a bounded executor (``COMFYUI_ASYNC_WORKERS`` threads), so one
+event loop can drive dozens of concurrent jobs across several backends.
+
+Synchronous callers can use ``generate_images``, which runs on the background
+loop of ``src.utils.aio``.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, TypeVar
+
+from src.core.comfyui.client import ComfyJob, ComfyUIClient, comfyui_client
+from src.core.comfyui.workflow import select_output_images
+from src.utils.aio import run_sync
+from src.utils.env import env_int
+
+T = TypeVar("T")
+
+
+class AsyncComfyUIClient:
+    """
+    Coroutine API over a ``ComfyUIClient``.
+
+    The instance is not bound to an event loop; it can be used from any loop,
+    and from several loops at once.
+    """
+
+    def __init__(self, client: Optional[ComfyUIClient] = None, max_workers: Optional[int] = None):
+        """
+        Args:
+            client: Synchronous client to wrap (``comfyui_client`` if None)
+            max_workers: Threads for HTTP requests (``COMFYUI_ASYNC_WORKERS``)
+        """
+        self.client = client or comfyui_client
+        self.max_workers = max_workers or env_int("COMFYUI_ASYNC_WORKERS", 8)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="comfyui-async"
+        )
+
+    async def _run(self, func: Callable[..., T], *args, **kwargs) -> T:
+        """Run one blocking request on the executor."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+
+    async def queue_prompt(self, prompt_workflow: Dict, server_address: Optional[str] = None) -> Dict:
+        """Submit a workflow to a server's queue (see ``ComfyUIClient.queue_prompt``)."""
+        return await self._run(self.client.queue_prompt, prompt_workflow, server_address)
+
+    async def get_history(self, prompt_id: str, server_address: Optional[str] = None) -> Dict:
+        return await self._run(self.client.get_history, prompt_id, server_address)
+
+    async def get_queue(self, server_address: Optional[str] = None) -> Dict:
+        return await self._run(self.client.get_queue, server_address)
+
+    async def get_image(self, image_ref: Dict, server_address: Optional[str] = None) -> bytes:
+        """Fetch one output image into memory."""
+        return await self._run(
+            self.client.get_image,
+            image_ref["filename"],
+            image_ref["subfolder"],
+            image_ref["type"],
+            server_address,
+        )
+
+    async def download_image(self, image_ref: Dict, dest_path: os.PathLike,
+                             server_address: Optional[str] = None) -> Path:
+        """Stream an output image to disk (see ``ComfyUIClient.download_image``)."""
+        return await self._run(self.client.download_image, image_ref, dest_path, server_address)
+
+    async def upload_image(self, image_path: os.PathLike, server_address: Optional[str] = None) -> str:
+        """Upload a reference image once per backend (see ``ComfyUIClient.upload_image``)."""
+        return await self._run(self.client.upload_image, image_path, server_address)
+
+    async def wait_for_completion(self, prompt_id: str, server_address: Optional[str] = None,
+                                  timeout: Optional[float] = None) -> Dict:
+        """Wait until the prompt finished and return its history entry."""
+        history = await self.client.tracker(server_address).wait_for_completion_async(
+            prompt_id,
+            lambda pid: self.get_history(pid, server_address),
+            timeout=timeout,
+        )
+        return history[prompt_id]
+
+    async def submit_image(self, positive_prompt, negative_prompt, **kwargs) -> ComfyJob:
+        """
+        Queue an image job without waiting for it.
+
+        Takes the arguments of ``ComfyUIClient.submit_image``. ``on_progress``
+        is called on the tracker's listener thread; use
+        ``loop.call_soon_threadsafe`` to hand events to a coroutine.
+        """
+        return await self._run(self.client.submit_image, positive_prompt, negative_prompt, **kwargs)
+
+    async def submit_many(self, jobs: List[Dict[str, Any]]) -> List[ComfyJob]:
+        """Queue several jobs in a cache-friendly order (see ``ComfyUIClient.submit_many``)."""
+        return await self._run(self.client.submit_many, jobs)
+
+    async def collect_outputs(self, job: ComfyJob, timeout: Optional[float] = None,
+                              include_previews: bool = False) -> List[Dict]:
+        """Wait for a queued job and list its output images (see ``ComfyUIClient.collect_outputs``)."""
+        with self.client.releasing(job):
+            history = await self.wait_for_completion(job.prompt_id, job.server_address, timeout=timeout)
+        return select_output_images(history["outputs"], job.output_nodes, include_previews)
+
+    async def collect_images(self, job: ComfyJob, timeout: Optional[float] = None,
+                             include_previews: bool = False) -> List[bytes]:
+        """Wait for a queued job and download its images concurrently."""
+        refs = await self.collect_outputs(job, timeout=timeout, include_previews=include_previews)
+        return list(await asyncio.gather(
+            *(self.get_image(ref, job.server_address) for ref in refs)
+        ))
+
+    def discard(self, job: ComfyJob) -> None:
+        """Stop tracking a job whose results are no longer needed."""
+        self.client.discard(job)
+
+    async def cancel(self, jobs: Iterable[ComfyJob]) -> None:
+        """Cancel queued or running jobs (see ``ComfyUIClient.cancel``)."""
+        await self._run(self.client.cancel, list(jobs))
+
+    async def generate_image(self, positive_prompt, negative_prompt, **kwargs) -> List[bytes]:
+        """Queue one job and return its images (arguments as ``submit_image``)."""
+        job = await self.submit_image(positive_prompt, negative_prompt, **kwargs)
+        try:
+            return await self.collect_images(job)
+        except asyncio.CancelledError:
+            await asyncio.shield(self.cancel([job]))
+            raise
+
+    def close(self) -> None:
+        """Stop the request threads; the wrapped client stays open."""
+        self._executor.shutdown(wait=False)
+
+
+# Shared async client over ``comfyui_client``
+async_comfyui_client = AsyncComfyUIClient()
+
+
+def generate_images(jobs: List[Dict[str, Any]]) -> List[List[bytes]]:
+    """
+    Run many image jobs concurrently on the background event loop.
+
+    Jobs are queued in a cache-friendly order and collected concurrently.
+
+    Args:
+        jobs: ``generate_image`` keyword arguments, one dict per job
+            (``positive_prompt`` and ``negative_prompt`` are required)
+
+    Returns:
+        Image data per job, in input order
+    """
+    async def _run() -> List[List[bytes]]:
+        queued = await async_comfyui_client.submit_many(jobs)
+        try:
+            return list(await asyncio.gather(
+                *(async_comfyui_client.collect_images(job) for job in queued)
+            ))
+        except BaseException:
+            await asyncio.shield(async_comfyui_client.cancel(queued))
+            raise
+
+    return run_sync(_run())
+
+
+__all__ = [
+    "AsyncComfyUIClient",
+    "async_comfyui_client",
+    "generate_images",
+]
@@ -1,215 +1,791 @@
-import json
+import hashlib
 import os
-import random
-import time
+import threading
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
 import requests
 import websocket
-
-from src.core.prompt.generator import generate_prompt
-
-def chat_with_ollama(model_name, prompt, stream=False):
-    """
-    Call Ollama API to chat with a model
-
-    Args:
-        model_name: Name of the model
-        prompt: The prompt/question to send to the model
-        stream: Whether to stream the response
-
-    Returns:
-        The model's response
-    """
-    url = "http://localhost:11434/api/generate"
-
-    payload = {
-        "model": model_name,
-        "prompt": prompt,
-        "stream": stream
-    }
-
-    response = requests.post(url, json=payload)
-
-    if stream:
-        full_response = ""
-        for line in response.iter_lines():
-            if line:
-                json_response = json.loads(line)
-                if 'response' in json_response:
-                    chunk = json_response['response']
-                    print(chunk, end='', flush=True)
-                    full_response += chunk
-        print()
-        return full_response
-    else:
-        result = response.json()
-        return result.get('response', '')
-
-
-def queue_prompt(prompt_workflow, server_address="127.0.0.1:8188"):
-    """
-    Submit a workflow to ComfyUI queue
-
-    Args:
-        prompt_workflow: The workflow JSON object
-        server_address: ComfyUI server address
-
-    Returns:
-        prompt_id and other response data
-    """
-    p = {"prompt": prompt_workflow, "client_id": str(uuid.uuid4())}
-    data = json.dumps(p).encode('utf-8')
-
-    url = f"http://{server_address}/prompt"
-    response = requests.post(url, data=data, headers={'Content-Type': 'application/json'})
-
-    return response.json()
-
-
-def get_image(filename, subfolder, folder_type, server_address="127.0.0.1:8188"):
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from src.core.prompt.generator import chat_with_ollama, generate_prompt  # noqa: F401 (re-exported)
+from src.core.comfyui.pool import BackendPool
+from src.core.comfyui.progress import annotate
+from src.core.comfyui.scheduler import CacheAwareScheduler
+from src.core.comfyui.tracker import CompletionTracker
+from src.core.comfyui.workflow import (
+    PROJECT_ROOT,
+    STAGE_FINAL,
+    STAGE_FULL,
+    build_job_workflow,
+    output_node_ids,
+    random_seed,
+    resolve_workflow_path,
+    result_cache_key,
+    select_output_images,
+)
+from src.utils.env import env_float, env_int, env_list
+
+DEFAULT_SERVER = "127.0.0.1:8188"
+
+
+_hash_lock = threading.Lock()
+_hash_cache: Dict[Tuple[str, int, int], str] = {}
+
+
+def resolve_image_path(image_path: os.PathLike) -> Path:
+    """Resolve a reference image path (relative paths fall back to the project root)."""
+    path = Path(image_path)
+    if not path.is_absolute() and not path.exists():
+        path = PROJECT_ROOT / path
+    if not path.exists():
+        raise FileNotFoundError(f"未找到参考图片: {image_path}")
+    return path
+
+
+def content_hash(path: Path) -> str:
+    """SHA-256 of a file, memoised by (path, mtime, size)."""
+    stat = path.stat()
+    key = (str(path.resolve()), stat.st_mtime_ns, stat.st_size)
+    with _hash_lock:
+        digest = _hash_cache.get(key)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(path, "rb") as fh:
+            for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        with _hash_lock:
+            _hash_cache[key] = digest
+    return digest
+
+
+def upload_name(path: Path, digest: str) -> str:
+    """Content-addressed file name used for ``/upload/image``."""
+    return f"{digest[:32]}{path.suffix.lower() or '.png'}"
+
+
+def uploaded_image_name(result: Dict) -> str:
+    """Turn an ``/upload/image`` response into a ``LoadImage`` value."""
+    if result.get("subfolder"):
+        return f"{result['subfolder']}/{result['name']}"
+    return result["name"]
+
+
+def result_key(positive_prompt, negative_prompt, width=800, height=1200,
+               seed=0, workflow_path=None, image_path=None, batch_size=1,
+               stage=STAGE_FULL, draft_path=None, features=None) -> str:
     """
-    Get generated image from ComfyUI
+    Return the result cache key of a job (arguments as ``submit_image``).
 
-    Args:
-        filename: Name of the image file
-        subfolder: Subfolder path
-        folder_type: Type of folder
-        server_address: ComfyUI server address
-
-    Returns:
-        Image data
+    Jobs with equal keys produce the same images, so a stored result can be
+    reused instead of rendering again.
     """
-    data = {"filename": filename, "subfolder": subfolder, "type": folder_type}
-    url = f"http://{server_address}/view"
-    response = requests.get(url, params=data)
-    return response.content
-
-
-def get_history(prompt_id, server_address="127.0.0.1:8188"):
+    return result_cache_key(
+        positive_prompt,
+        negative_prompt,
+        width,
+        height,
+        seed,
+        batch_size,
+        resolve_workflow_path(workflow_path, image_path),
+        content_hash(resolve_image_path(image_path)) if image_path else None,
+        stage,
+        content_hash(resolve_image_path(draft_path)) if draft_path else None,
+        features,
+    )
+
+
+@dataclass
+class ComfyJob:
+    """A workflow queued on a ComfyUI backend."""
+
+    prompt_id: str
+    server_address: Optional[str]
+    batch_size: int = 1
+    output_nodes: Tuple[str, ...] = ()
+    leased: bool = False
+    seed: Optional[int] = None
+    # Result cache key (see ``result_key``)
+    cache_key: Optional[str] = None
+    stage: str = STAGE_FULL
+
+
+class ComfyUIClient:
     """
-    Get generation history
-
-    Args:
-        prompt_id: The prompt ID
-        server_address: ComfyUI server address
-
-    Returns:
-        History data
+    ComfyUI HTTP client with pooled keep-alive sessions.
+
+    One ``requests.Session`` (and one websocket completion tracker) is kept per
+    server address, and every submission uses the same ``client_id`` so the
+    tracker receives its events. Connection errors are retried with backoff;
+    read errors and 5xx responses are only retried for idempotent GETs so a
+    workflow is never queued twice. Jobs without an explicit server are
+    dispatched through a ``BackendPool`` to the least-loaded healthy backend.
     """
-    url = f"http://{server_address}/history/{prompt_id}"
-    response = requests.get(url)
-    return response.json()
-
 
-def generate_image_with_comfyui(positive_prompt, negative_prompt, width=800, height=1200, workflow_path=None, image_path=None, server_address="127.0.0.1:8188"):
-    """
-    Generate image using ComfyUI workflow
-
-    Args:
-        positive_prompt: Positive prompt text
-        negative_prompt: Negative prompt text
-        width: Image width (default 800)
-        height: Image height (default 1200)
-        workflow_path: Path to workflow JSON file (auto-select if None)
-        image_path: Path to input image for face workflow (optional)
-        server_address: ComfyUI server address
-
-    Returns:
-        Generated image data
-    """
-    import random
-    import os
-
-    # Auto-select workflow based on image_path
-    project_root = Path(__file__).resolve().parents[3]
-
-    if workflow_path is None:
-        face = project_root / "config" / "workflows" / "flow_face.json"
-        normal = project_root / "config" / "workflows" / "flowv_normal.json"
-
-        workflow_path = face if image_path else normal
-
-    workflow_path = Path(workflow_path)
-    if not workflow_path.exists():
-        raise FileNotFoundError(f"未找到工作流文件: {workflow_path}")
-
-    if image_path:
-        print(f"🖼️ 使用人脸替换工作流: {workflow_path}", flush=True)
-    else:
-        print(f"📝 使用普通文生图工作流: {workflow_path}", flush=True)
-
-    # Load workflow
-    with open(workflow_path, 'r', encoding='utf-8') as f:
-        workflow = json.load(f)
-
-    # Replace image path in face workflow if needed
-    if image_path and "96:0" in workflow:
-        # Convert to absolute path for ComfyUI
-        abs_image_path = os.path.abspath(image_path)
-        workflow["96:0"]["inputs"]["image"] = abs_image_path
-        print(f"📸 输入图片路径: {abs_image_path}", flush=True)
-
-    # Update prompts in workflow
-    if "3" in workflow:
-        workflow["45"]["inputs"]["value"] = positive_prompt
-    if "4" in workflow:
-        workflow["46"]["inputs"]["value"] = negative_prompt
-
-    # Update image dimensions
-    if "6" in workflow:
-        workflow["6"]["inputs"]["width"] = width
-        workflow["6"]["inputs"]["height"] = height
-        print(f"📐 图片尺寸: {width}x{height}", flush=True)
-
-    # Update all seeds to random values
-    if "5" in workflow and "inputs" in workflow["5"] and "seed" in workflow["5"]["inputs"]:
-        new_seed_5 = random.randint(0, 999999999999999)
-        workflow["5"]["inputs"]["seed"] = new_seed_5
-        print(f"🎲 随机种子(节点5): {new_seed_5}", flush=True)
-
-    if "11" in workflow and "inputs" in workflow["11"] and "seed" in workflow["11"]["inputs"]:
-        new_seed_11 = random.randint(0, 999999999999999)
-        workflow["11"]["inputs"]["seed"] = new_seed_11
-        print(f"🎲 随机种子(节点11): {new_seed_11}", flush=True)
-
-    # Also handle seed nodes in face workflow
-    if "120" in workflow and "inputs" in workflow["120"] and "seed" in workflow["120"]["inputs"]:
-        new_seed_120 = random.randint(0, 999999999999999)
-        workflow["120"]["inputs"]["seed"] = new_seed_120
-        print(f"🎲 随机种子(节点120): {new_seed_120}", flush=True)
-
-    # Queue the prompt
-    response = queue_prompt(workflow, server_address)
-    prompt_id = response['prompt_id']
-
-    print(f"Queued prompt with ID: {prompt_id}")
-
-    # Wait for completion
-    while True:
-        history = get_history(prompt_id, server_address)
-        if prompt_id in history:
-            break
-        time.sleep(1)
-
-    # Get the generated images
-    history_data = history[prompt_id]
-    images = []
-
-    for node_id in history_data['outputs']:
-        node_output = history_data['outputs'][node_id]
-        if 'images' in node_output:
-            for image in node_output['images']:
-                image_data = get_image(
-                    image['filename'],
-                    image['subfolder'],
-                    image['type'],
-                    server_address
-                )
-                images.append(image_data)
-
-    return images
+    def __init__(
+        self,
+        server_address: Optional[str] = None,
+        servers: Optional[List[str]] = None,
+        client_id: Optional[str] = None,
+        connect_timeout: Optional[float] = None,
+        read_timeout: Optional[float] = None,
+        max_retries: Optional[int] = None,
+        backoff_factor: Optional[float] = None,
+        pool_size: int = 10,
+    ):
+        """
+        Args:
+            server_address: Default ComfyUI server address (``COMFYUI_SERVER``)
+            servers: Backend addresses for dispatch (``COMFYUI_SERVERS``, comma separated)
+            client_id: Stable websocket client id (random if None)
+            connect_timeout: Connect timeout in seconds (``COMFYUI_CONNECT_TIMEOUT``)
+            read_timeout: Read timeout in seconds (``COMFYUI_READ_TIMEOUT``)
+            max_retries: Retry budget per request (``COMFYUI_MAX_RETRIES``)
+            backoff_factor: Exponential backoff base (``COMFYUI_RETRY_BACKOFF``)
+            pool_size: Keep-alive connections per server
+        """
+        servers = servers or env_list("COMFYUI_SERVERS")
+        self.server_address = server_address or (servers[0] if servers else os.getenv("COMFYUI_SERVER", DEFAULT_SERVER))
+        self.pool = BackendPool(
+            servers or [self.server_address],
+            max_failures=env_int("COMFYUI_MAX_FAILURES", 3),
+            cooldown=env_float("COMFYUI_EVICT_COOLDOWN", 30.0),
+            idle_interval=env_float("COMFYUI_IDLE_PROBE_INTERVAL", 30.0),
+            affinity_slack=env_int("COMFYUI_AFFINITY_SLACK", 1),
+        )
+        self.scheduler = CacheAwareScheduler()
+        self.client_id = client_id or uuid.uuid4().hex
+        self.timeout = (
+            connect_timeout if connect_timeout is not None else env_float("COMFYUI_CONNECT_TIMEOUT", 5.0),
+            read_timeout if read_timeout is not None else env_float("COMFYUI_READ_TIMEOUT", 120.0),
+        )
+        self.max_retries = max_retries if max_retries is not None else env_int("COMFYUI_MAX_RETRIES", 3)
+        self.backoff_factor = backoff_factor if backoff_factor is not None else env_float("COMFYUI_RETRY_BACKOFF", 0.5)
+        self.pool_size = pool_size
+
+        self._lock = threading.Lock()
+        self._sessions: Dict[str, requests.Session] = {}
+        self._trackers: Dict[str, CompletionTracker] = {}
+        # (server_address, content hash) -> uploaded image name
+        self._uploads: Dict[Tuple[str, str], str] = {}
+
+    def session(self, server_address: Optional[str] = None) -> requests.Session:
+        """Return the pooled session for a server, creating it on first use."""
+        address = server_address or self.server_address
+        with self._lock:
+            session = self._sessions.get(address)
+            if session is None:
+                session = self._create_session()
+                self._sessions[address] = session
+            return session
+
+    def tracker(self, server_address: Optional[str] = None) -> CompletionTracker:
+        """Return the websocket completion tracker for a server."""
+        address = server_address or self.server_address
+        with self._lock:
+            tracker = self._trackers.get(address)
+            if tracker is None:
+                tracker = CompletionTracker(address, client_id=self.client_id)
+                self._trackers[address] = tracker
+        tracker.start()
+        return tracker
+
+    def _create_session(self) -> requests.Session:
+        retry = Retry(
+            total=self.max_retries,
+            connect=self.max_retries,
+            read=self.max_retries,
+            status=self.max_retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset(["GET"]),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_size,
+            pool_maxsize=self.pool_size,
+            max_retries=retry,
+        )
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def _url(self, path: str, server_address: Optional[str] = None) -> str:
+        return f"http://{server_address or self.server_address}{path}"
+
+    def queue_prompt(self, prompt_workflow: Dict, server_address: Optional[str] = None,
+                     prompt_id: Optional[str] = None) -> Dict:
+        """
+        Submit a workflow to ComfyUI queue
+
+        Args:
+            prompt_workflow: The workflow JSON object
+            server_address: ComfyUI server address (default server if None)
+            prompt_id: Client-chosen prompt id (ComfyUI versions without
+                support for it ignore the field and assign their own)
+
+        Returns:
+            prompt_id and other response data
+        """
+        payload = {"prompt": prompt_workflow, "client_id": self.client_id}
+        if prompt_id:
+            payload["prompt_id"] = prompt_id
+        response = self.session(server_address).post(
+            self._url("/prompt", server_address),
+            json=payload,
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def get_image(self, filename: str, subfolder: str, folder_type: str,
+                  server_address: Optional[str] = None) -> bytes:
+        """
+        Get generated image from ComfyUI
+
+        Args:
+            filename: Name of the image file
+            subfolder: Subfolder path
+            folder_type: Type of folder
+            server_address: ComfyUI server address (default server if None)
+
+        Returns:
+            Image data
+        """
+        params = {"filename": filename, "subfolder": subfolder, "type": folder_type}
+        response = self.session(server_address).get(
+            self._url("/view", server_address),
+            params=params,
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        return response.content
+
+    def get_history(self, prompt_id: str, server_address: Optional[str] = None) -> Dict:
+        """
+        Get generation history
+
+        Args:
+            prompt_id: The prompt ID
+            server_address: ComfyUI server address (default server if None)
+
+        Returns:
+            History data
+        """
+        response = self.session(server_address).get(
+            self._url(f"/history/{prompt_id}", server_address),
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def get_queue(self, server_address: Optional[str] = None) -> Dict:
+        """
+        Get the running and pending prompts of a server
+
+        Returns:
+            ``/queue`` JSON (``queue_running`` / ``queue_pending`` lists whose
+            second item is the prompt id)
+        """
+        response = self.session(server_address).get(
+            self._url("/queue", server_address),
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def wait_for_completion(self, prompt_id: str, server_address: Optional[str] = None,
+                            timeout: Optional[float] = None) -> Dict:
+        """Block until the prompt finished and return its history entry."""
+        history = self.tracker(server_address).wait_for_completion(
+            prompt_id,
+            lambda pid: self.get_history(pid, server_address),
+            timeout=timeout,
+        )
+        return history[prompt_id]
+
+    def upload_image(self, image_path: os.PathLike, server_address: Optional[str] = None) -> str:
+        """
+        Make a reference image available to a backend through ``/upload/image``.
+
+        Images are named after their content hash, and each backend remembers
+        which hashes it already has, so repeated jobs with the same reference
+        image upload nothing.
+
+        Args:
+            image_path: Local image path (relative paths resolve against the project root)
+            server_address: ComfyUI server address (default server if None)
+
+        Returns:
+            Image name to use in a ``LoadImage`` node
+        """
+        address = server_address or self.server_address
+        path = resolve_image_path(image_path)
+        digest = content_hash(path)
+        with self._lock:
+            name = self._uploads.get((address, digest))
+        if name:
+            return name
+
+        name = upload_name(path, digest)
+        with open(path, "rb") as fh:
+            response = self.session(address).post(
+                self._url("/upload/image", address),
+                files={"image": (name, fh)},
+                data={"type": "input", "overwrite": "true"},
+                timeout=self.timeout,
+            )
+        response.raise_for_status()
+        name = uploaded_image_name(response.json())
+        print(f"📤 已上传参考图片到 {address}: {name}", flush=True)
+
+        with self._lock:
+            self._uploads[(address, digest)] = name
+        return name
+
+    def build_workflow(self, positive_prompt, negative_prompt, width=800, height=1200,
+                       workflow_path=None, image_path=None, batch_size=1,
+                       image_name=None, seed=None, stage=STAGE_FULL,
+                       draft_image=None, features=None) -> Dict:
+        """
+        Build the job workflow from the cached template.
+
+        Args:
+            positive_prompt: Positive prompt text
+            negative_prompt: Negative prompt text
+            width: Image width (default 800)
+            height: Image height (default 1200)
+            workflow_path: Path to workflow JSON file (auto-select if None)
+            image_path: Path to input image for face workflow (optional)
+            batch_size: Images per prompt via EmptyLatentImage ``batch_size``
+            image_name: Name of the uploaded reference image on the backend
+                (falls back to the absolute ``image_path`` when None)
+            seed: Sampler seed (random if None)
+            stage: Workflow stage (see ``build_job_workflow``)
+            draft_image: Name of the uploaded draft on the backend (final stage)
+            features: Optional stage switches (``face_fix``/``upscale``, missing = on)
+
+        Returns:
+            Pruned, validated workflow ready for ``queue_prompt``
+        """
+        return build_job_workflow(
+            positive_prompt,
+            negative_prompt,
+            width=width,
+            height=height,
+            workflow_path=workflow_path,
+            image_path=image_path,
+            batch_size=batch_size,
+            image_name=image_name,
+            seed=seed,
+            stage=stage,
+            draft_image=draft_image,
+            features=features,
+        )
+
+    def submit_image(self, positive_prompt, negative_prompt, width=800, height=1200,
+                     workflow_path=None, image_path=None, server_address=None,
+                     batch_size=1, on_progress=None, seed=None, stage=STAGE_FULL,
+                     draft_path=None, features=None,
+                     on_queue: Optional[Callable[[ComfyJob], None]] = None) -> ComfyJob:
+        """
+        Queue an image job without waiting for it.
+
+        Takes the same arguments as ``generate_image``. When ``server_address``
+        is None a backend is leased from the pool until ``collect_images`` (or
+        ``discard``) is called for the returned job.
+
+        ``on_progress`` receives the job's websocket progress and preview
+        events (see ``src.core.comfyui.progress``), annotated with the node
+        class and title, until the job is collected or discarded.
+
+        The seed actually used (drawn at random unless ``seed`` is given) and
+        the job's result cache key (see ``result_key``) are recorded on the
+        returned job.
+
+        ``stage`` selects a draft (stop at VAEDecode) or the final pass over
+        the local draft image ``draft_path``, which is uploaded to the
+        backend first; pass the draft's seed to finalize it faithfully.
+        ``features`` switches optional stages off (e.g. ``{"upscale": False}``).
+
+        The prompt id is chosen here and sent with the workflow. ``on_queue``
+        is called with the complete job right before it is POSTed, so the job
+        can be journaled before a crash could lose track of it. ComfyUI
+        versions that ignore client-supplied ids assign their own; the job is
+        then updated and ``on_queue`` is called again with the new id.
+
+        Returns:
+            The queued job
+        """
+        if stage == STAGE_FINAL and not draft_path:
+            raise ValueError("精修阶段需要草稿图片")
+        job = ComfyJob(
+            prompt_id=str(uuid.uuid4()),
+            server_address=server_address,
+            batch_size=batch_size,
+            seed=random_seed() if seed is None else seed,
+            stage=stage,
+        )
+        job.cache_key = result_key(
+            positive_prompt,
+            negative_prompt,
+            width=width,
+            height=height,
+            seed=job.seed,
+            workflow_path=workflow_path,
+            image_path=image_path,
+            batch_size=batch_size,
+            stage=stage,
+            draft_path=draft_path,
+            features=features,
+        )
+        signature = self.scheduler.signature(
+            resolve_workflow_path(workflow_path, image_path),
+            positive_prompt,
+            negative_prompt,
+            content_hash(resolve_image_path(image_path)) if image_path else None,
+        )
+        if server_address is None:
+            # Prefer a backend that already has this job's models loaded
+            job.server_address = self.pool.acquire(affinity=self.scheduler.affinity(signature))
+            job.leased = True
+
+        try:
+            image_name = self.upload_image(image_path, job.server_address) if image_path else None
+            draft_image = self.upload_image(draft_path, job.server_address) if draft_path else None
+            workflow = self.build_workflow(
+                positive_prompt,
+                negative_prompt,
+                width=width,
+                height=height,
+                workflow_path=workflow_path,
+                image_path=image_path,
+                batch_size=batch_size,
+                image_name=image_name,
+                seed=job.seed,
+                stage=stage,
+                draft_image=draft_image,
+                features=features,
+            )
+            job.output_nodes = output_node_ids(workflow)
+            if on_queue is not None:
+                on_queue(job)
+            response = self.queue_prompt(workflow, job.server_address, job.prompt_id)
+        except requests.RequestException:
+            self._finish(job, success=False)
+            raise
+        except BaseException:
+            self._finish(job)
+            raise
+
+        if response['prompt_id'] != job.prompt_id:
+            job.prompt_id = response['prompt_id']
+            if on_queue is not None:
+                on_queue(job)
+        print(f"Queued prompt with ID: {job.prompt_id} ({job.server_address})")
+        self.scheduler.record(job.server_address, signature)
+        if on_progress is not None:
+            self.tracker(job.server_address).subscribe(
+                job.prompt_id,
+                lambda event: on_progress(annotate(event, workflow)),
+            )
+        return job
+
+    def submit_many(self, jobs: List[Dict]) -> List[ComfyJob]:
+        """
+        Queue several jobs in a cache-friendly order.
+
+        Jobs sharing a model stack and prompt text are submitted back to
+        back so ComfyUI reuses loaded models and text encodings between them.
+
+        Args:
+            jobs: ``submit_image`` keyword arguments, one dict per job
+
+        Returns:
+            Queued jobs in input order
+        """
+        signatures = [
+            self.scheduler.signature(
+                resolve_workflow_path(job.get("workflow_path"), job.get("image_path")),
+                job["positive_prompt"],
+                job["negative_prompt"],
+                content_hash(resolve_image_path(job["image_path"])) if job.get("image_path") else None,
+            )
+            for job in jobs
+        ]
+        address = self.pool.addresses[0] if len(self.pool) == 1 else None
+        submitted: Dict[int, ComfyJob] = {}
+        try:
+            for index in self.scheduler.order(signatures, address):
+                submitted[index] = self.submit_image(**jobs[index])
+        except BaseException:
+            self.cancel(submitted.values())
+            raise
+        return [submitted[index] for index in range(len(jobs))]
+
+    def collect_outputs(self, job: ComfyJob, timeout: Optional[float] = None,
+                        include_previews: bool = False) -> List[Dict]:
+        """
+        Wait for a queued job and list its output images.
+
+        Only images saved by the workflow's output nodes (``SaveImage``) with
+        ``type == "output"`` are returned; previews and comparer temp images
+        are skipped unless ``include_previews`` is set.
+
+        Args:
+            job: Job returned by ``submit_image``
+            timeout: Optional maximum seconds to wait for completion
+            include_previews: Also return non-final images (after the final ones)
+
+        Returns:
+            Image references (``filename``/``subfolder``/``type`` dicts)
+        """
+        with self.releasing(job):
+            # Wait for completion (websocket event, history polling while disconnected)
+            history_data = self.wait_for_completion(job.prompt_id, job.server_address, timeout=timeout)
+
+        return select_output_images(history_data['outputs'], job.output_nodes, include_previews)
+
+    def collect_images(self, job: ComfyJob, timeout: Optional[float] = None,
+                       include_previews: bool = False) -> List[bytes]:
+        """
+        Wait for a queued job and download its images into memory.
+
+        Args:
+            job: Job returned by ``submit_image``
+            timeout: Optional maximum seconds to wait for completion
+            include_previews: Also download non-final images, in parallel
+
+        Returns:
+            Generated image data
+        """
+        refs = self.collect_outputs(job, timeout=timeout, include_previews=include_previews)
+        if len(refs) <= 1:
+            return [self._fetch(ref, job.server_address) for ref in refs]
+
+        with ThreadPoolExecutor(max_workers=min(len(refs), self.pool_size)) as executor:
+            return list(executor.map(lambda ref: self._fetch(ref, job.server_address), refs))
+
+    def _fetch(self, image_ref: Dict, server_address: Optional[str]) -> bytes:
+        return self.get_image(
+            image_ref['filename'],
+            image_ref['subfolder'],
+            image_ref['type'],
+            server_address,
+        )
+
+    def download_image(self, image_ref: Dict, dest_path: os.PathLike,
+                       server_address: Optional[str] = None,
+                       chunk_size: int = 64 * 1024) -> Path:
+        """
+        Stream an output image from ``/view`` straight to ``dest_path``.
+
+        The body is written in chunks to a temporary file in the destination
+        directory and atomically renamed, so readers never see partial files
+        and memory use does not grow with the image size.
+
+        Args:
+            image_ref: ``filename``/``subfolder``/``type`` dict from the history
+            dest_path: Final file path
+            server_address: ComfyUI server address (default server if None)
+            chunk_size: Bytes per read
+
+        Returns:
+            The destination path
+        """
+        dest_path = Path(dest_path)
+        dest_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = dest_path.with_name(f".{dest_path.name}.part")
+
+        params = {
+            "filename": image_ref['filename'],
+            "subfolder": image_ref['subfolder'],
+            "type": image_ref['type'],
+        }
+        try:
+            with self.session(server_address).get(
+                self._url("/view", server_address),
+                params=params,
+                timeout=self.timeout,
+                stream=True,
+            ) as response:
+                response.raise_for_status()
+                with open(tmp_path, "wb") as fh:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        fh.write(chunk)
+            os.replace(tmp_path, dest_path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        return dest_path
+
+    @contextmanager
+    def releasing(self, job: ComfyJob) -> Iterator[ComfyJob]:
+        """
+        Release the job's backend lease when the block exits.
+
+        Request errors count as a backend failure; any other exit (including
+        cancellation) releases the backend as healthy.
+        """
+        try:
+            yield job
+        except requests.RequestException:
+            self._finish(job, success=False)
+            raise
+        except BaseException:
+            self._finish(job)
+            raise
+        self._finish(job)
+
+    def discard(self, job: ComfyJob) -> None:
+        """Stop tracking a job whose results are no longer needed."""
+        self._finish(job)
+
+    def cancel(self, jobs: Iterable[ComfyJob]) -> None:
+        """
+        Cancel queued or running jobs and release their backends.
+
+        Waiters in ``collect_outputs`` are woken with ``JobCancelledError``
+        right away. Our pending prompts are deleted from each backend's
+        ``/queue`` and a prompt that is currently executing is stopped via
+        ``/interrupt``; other clients' prompts are left alone.
+        """
+        by_server: Dict[str, List[ComfyJob]] = {}
+        for job in jobs:
+            if not job.prompt_id:
+                continue
+            by_server.setdefault(job.server_address, []).append(job)
+            self.tracker(job.server_address).cancel(job.prompt_id)
+
+        for address, server_jobs in by_server.items():
+            prompt_ids = {job.prompt_id for job in server_jobs}
+            session = self.session(address)
+            try:
+                queue = self.get_queue(address)
+
+                pending = [item[1] for item in queue.get("queue_pending", []) if item[1] in prompt_ids]
+                if pending:
+                    session.post(
+                        self._url("/queue", address),
+                        json={"delete": pending},
+                        timeout=self.timeout,
+                    ).raise_for_status()
+
+                for item in queue.get("queue_running", []):
+                    if item[1] in prompt_ids:
+                        session.post(
+                            self._url("/interrupt", address),
+                            json={"prompt_id": item[1]},
+                            timeout=self.timeout,
+                        ).raise_for_status()
+                print(f"🛑 已取消 {len(prompt_ids)} 个 ComfyUI 任务 ({address})", flush=True)
+            except requests.RequestException as exc:
+                print(f"⚠️ 取消 ComfyUI 任务失败 ({address}): {exc}", flush=True)
+
+            for job in server_jobs:
+                self._finish(job)
+
+    def _finish(self, job: ComfyJob, success: bool = True) -> None:
+        """Release the backend lease held by a job (at most once)."""
+        tracker = self._trackers.get(job.server_address)
+        if tracker is not None and job.prompt_id:
+            tracker.unsubscribe(job.prompt_id)
+        if not success:
+            # The backend may have restarted and lost its node cache
+            self.scheduler.forget(job.server_address)
+        if job.leased:
+            job.leased = False
+            self.pool.release(job.server_address, success=success)
+
+    def generate_image(self, positive_prompt, negative_prompt, width=800, height=1200,
+                       workflow_path=None, image_path=None, server_address=None,
+                       batch_size=1, seed=None, stage=STAGE_FULL,
+                       draft_path=None, features=None) -> List[bytes]:
+        """
+        Generate image using ComfyUI workflow
+
+        Args:
+            positive_prompt: Positive prompt text
+            negative_prompt: Negative prompt text
+            width: Image width (default 800)
+            height: Image height (default 1200)
+            workflow_path: Path to workflow JSON file (auto-select if None)
+            image_path: Path to input image for face workflow (optional)
+            server_address: ComfyUI server address (least-loaded backend if None)
+            batch_size: Images per prompt via EmptyLatentImage ``batch_size``
+            seed: Sampler seed (random if None)
+            stage: Workflow stage (see ``build_job_workflow``)
+            draft_path: Local draft image to finalize (final stage)
+            features: Optional stage switches (``face_fix``/``upscale``, missing = on)
+
+        Returns:
+            Generated image data
+        """
+        job = self.submit_image(
+            positive_prompt,
+            negative_prompt,
+            width=width,
+            height=height,
+            workflow_path=workflow_path,
+            image_path=image_path,
+            server_address=server_address,
+            batch_size=batch_size,
+            seed=seed,
+            stage=stage,
+            draft_path=draft_path,
+            features=features,
+        )
+        return self.collect_images(job)
+
+    def close(self) -> None:
+        """Close all pooled sessions."""
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
+
+
+# Shared client instance (one session pool and client id per process)
+comfyui_client = ComfyUIClient()
+
+
+# 向后兼容的函数接口
+def queue_prompt(prompt_workflow, server_address=None):
+    """Submit a workflow through the shared client."""
+    return comfyui_client.queue_prompt(prompt_workflow, server_address)
+
+
+def get_image(filename, subfolder, folder_type, server_address=None):
+    """Download an image through the shared client."""
+    return comfyui_client.get_image(filename, subfolder, folder_type, server_address)
+
+
+def get_history(prompt_id, server_address=None):
+    """Fetch prompt history through the shared client."""
+    return comfyui_client.get_history(prompt_id, server_address)
+
+
+def generate_image_with_comfyui(positive_prompt, negative_prompt, width=800, height=1200, workflow_path=None, image_path=None, server_address=None, batch_size=1, seed=None):
+    """Generate images through the shared client."""
+    return comfyui_client.generate_image(
+        positive_prompt,
+        negative_prompt,
+        width=width,
+        height=height,
+        workflow_path=workflow_path,
+        image_path=image_path,
+        server_address=server_address,
+        batch_size=batch_size,
+        seed=seed,
+    )
 
 
 if __name__ == "__main__":
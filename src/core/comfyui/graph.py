@@ -0,0 +1,214 @@
+"""
+Workflow graph pruning, feature bypass and validation.
+
+A ComfyUI API workflow is a dict of ``node_id -> {"class_type", "inputs"}``
+where a linked input is ``[source_node_id, output_slot]``. ``prune`` keeps
+only the nodes the chosen output nodes depend on, ``bypass_features`` cuts
+optional stages (face fix, upscale) out of the image chain, and ``validate``
+checks a graph before it is submitted.
+"""
+from __future__ import annotations
+
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Set
+
+# Node classes whose images are the real results of a workflow; other image
+# outputs (previews, rgthree comparers) are temp artifacts
+OUTPUT_NODE_CLASSES = ("SaveImage",)
+
+# Optional stages: feature name -> node classes implementing it. Every such
+# node takes the image to refine as input "image" and returns the refined
+# image on slot 0, so bypassing it links its consumers to that input.
+FEATURES: Dict[str, tuple] = {
+    "face_fix": ("DetailerForEach",),
+    "upscale": ("UltimateSDUpscale",),
+}
+BYPASS_INPUT = "image"
+
+
+class WorkflowValidationError(ValueError):
+    """Raised when a workflow graph is not safe to submit."""
+
+
+def is_link(value: Any) -> bool:
+    """Return True when an input value is a ``[node_id, slot]`` link."""
+    return isinstance(value, list) and len(value) == 2 and isinstance(value[0], str)
+
+
+def output_node_ids(workflow: Dict[str, Any]) -> tuple:
+    """Return the ids of the nodes that produce the final images."""
+    return tuple(
+        node_id for node_id, node in workflow.items()
+        if node.get("class_type") in OUTPUT_NODE_CLASSES
+    )
+
+
+def upstream_nodes(workflow: Dict[str, Any], roots: Iterable[str]) -> Set[str]:
+    """Return ``roots`` and every node they (transitively) take inputs from."""
+    seen: Set[str] = set()
+    stack = [root for root in roots if root in workflow]
+    while stack:
+        node_id = stack.pop()
+        if node_id in seen:
+            continue
+        seen.add(node_id)
+        for value in workflow[node_id].get("inputs", {}).values():
+            if is_link(value) and value[0] in workflow:
+                stack.append(value[0])
+    return seen
+
+
+def sink_nodes(workflow: Dict[str, Any]) -> List[str]:
+    """Return the nodes no other node links to (savers, previews, comparers)."""
+    linked = {
+        value[0]
+        for node in workflow.values()
+        for value in node.get("inputs", {}).values()
+        if is_link(value)
+    }
+    return [node_id for node_id in workflow if node_id not in linked]
+
+
+def prune(workflow: Dict[str, Any], outputs: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+    """
+    Drop every node the output nodes do not depend on.
+
+    Args:
+        workflow: Job workflow (not modified; kept nodes are shared).
+        outputs: Node ids to keep results of (the ``SaveImage`` nodes when None).
+
+    Returns:
+        The pruned workflow, in the original node order.
+    """
+    roots = list(outputs) if outputs is not None else output_node_ids(workflow)
+    keep = upstream_nodes(workflow, roots)
+    return {node_id: node for node_id, node in workflow.items() if node_id in keep}
+
+
+def bypass(workflow: Dict[str, Any], node_ids: Iterable[str], input_name: str = BYPASS_INPUT) -> Dict[str, Any]:
+    """
+    Short-circuit nodes: consumers of their slot 0 read ``input_name`` instead.
+
+    Chains of bypassed nodes are followed to the first kept source. Only the
+    consumer nodes are copied; the bypassed nodes become unreferenced and
+    are removed by a following ``prune``.
+
+    Raises:
+        WorkflowValidationError: When a bypassed node has no linked ``input_name``.
+    """
+    sources: Dict[str, list] = {}
+    for node_id in node_ids:
+        value = workflow.get(node_id, {}).get("inputs", {}).get(input_name)
+        if not is_link(value):
+            raise WorkflowValidationError(f"节点 {node_id} 没有可直通的 {input_name} 输入，无法跳过")
+        sources[node_id] = value
+
+    def resolve(link: list) -> list:
+        seen = set()
+        while link[0] in sources and link[1] == 0 and link[0] not in seen:
+            seen.add(link[0])
+            link = sources[link[0]]
+        return link
+
+    result = dict(workflow)
+    for node_id, node in workflow.items():
+        if node_id in sources:
+            continue
+        inputs = node.get("inputs", {})
+        rewired = {
+            name: resolve(value)
+            for name, value in inputs.items()
+            if is_link(value) and value[0] in sources
+        }
+        if rewired:
+            result[node_id] = {**node, "inputs": {**inputs, **rewired}}
+    return result
+
+
+def bypass_features(workflow: Dict[str, Any], features: Optional[Mapping[str, bool]]) -> Dict[str, Any]:
+    """
+    Bypass the nodes of every feature switched off in ``features``.
+
+    Features missing from ``features`` stay on.
+
+    Raises:
+        WorkflowValidationError: For unknown feature names.
+    """
+    if not features:
+        return workflow
+    unknown = set(features) - set(FEATURES)
+    if unknown:
+        raise WorkflowValidationError(f"未知的功能开关: {', '.join(sorted(unknown))}")
+
+    classes = {cls for name, enabled in features.items() if not enabled for cls in FEATURES[name]}
+    node_ids = [node_id for node_id, node in workflow.items() if node.get("class_type") in classes]
+    return bypass(workflow, node_ids) if node_ids else workflow
+
+
+def validate(workflow: Dict[str, Any]) -> None:
+    """
+    Check that a workflow can be submitted.
+
+    Every node needs a ``class_type`` and ``inputs``, every link must point
+    at an existing node and slot, the graph must be acyclic and it must
+    contain at least one output node.
+
+    Raises:
+        WorkflowValidationError: Describing the first problem found.
+    """
+    if not workflow:
+        raise WorkflowValidationError("工作流为空")
+
+    for node_id, node in workflow.items():
+        if not isinstance(node, dict) or not node.get("class_type"):
+            raise WorkflowValidationError(f"节点 {node_id} 缺少 class_type")
+        if not isinstance(node.get("inputs", {}), dict):
+            raise WorkflowValidationError(f"节点 {node_id} 的 inputs 不是对象")
+        for name, value in node.get("inputs", {}).items():
+            if not is_link(value):
+                continue
+            if value[0] not in workflow:
+                raise WorkflowValidationError(f"节点 {node_id} 的输入 {name} 指向不存在的节点 {value[0]}")
+            if not isinstance(value[1], int) or value[1] < 0:
+                raise WorkflowValidationError(f"节点 {node_id} 的输入 {name} 输出槽无效: {value[1]}")
+
+    if not output_node_ids(workflow):
+        raise WorkflowValidationError("工作流没有输出节点（SaveImage）")
+
+    # Iterative DFS cycle check (white/grey/black)
+    state: Dict[str, int] = {}
+    for start in workflow:
+        if state.get(start):
+            continue
+        stack = [(start, iter(_links(workflow[start])))]
+        state[start] = 1
+        while stack:
+            node_id, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                state[node_id] = 2
+                stack.pop()
+            elif state.get(child) == 1:
+                raise WorkflowValidationError(f"工作流存在环: {node_id} -> {child}")
+            elif not state.get(child):
+                state[child] = 1
+                stack.append((child, iter(_links(workflow[child]))))
+
+
+def _links(node: Dict[str, Any]) -> List[str]:
+    return [value[0] for value in node.get("inputs", {}).values() if is_link(value)]
+
+
+__all__ = [
+    "BYPASS_INPUT",
+    "FEATURES",
+    "OUTPUT_NODE_CLASSES",
+    "WorkflowValidationError",
+    "bypass",
+    "bypass_features",
+    "is_link",
+    "output_node_ids",
+    "prune",
+    "sink_nodes",
+    "upstream_nodes",
+    "validate",
+]
@@ -0,0 +1,319 @@
+"""
+Multi-backend ComfyUI pool with queue-depth-aware dispatch.
+
+Backends are configured as a list of ``host:port`` addresses. A background
+thread probes every backend's ``/queue`` depth concurrently once per
+``check_interval`` while there is work (jobs of ours in flight or prompts
+queued remotely) and once per ``idle_interval`` otherwise; dispatch reads
+the last snapshot and picks the least-loaded healthy backend, so a slow or
+dead node never holds up job submission. Backends that keep failing are
+evicted for a cooldown period; backends can also be drained manually so
+they finish in-flight work but receive no new jobs.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class NoBackendAvailableError(RuntimeError):
+    """Raised when no healthy ComfyUI backend can accept a job."""
+
+
+@dataclass
+class Backend:
+    """Runtime state of one ComfyUI backend."""
+
+    address: str
+    healthy: bool = True
+    draining: bool = False
+    queue_depth: int = 0
+    in_flight: int = 0
+    failures: int = 0
+    evicted_until: float = 0.0
+    last_checked: float = 0.0
+    # A /queue probe for this backend is running
+    probing: bool = False
+    # Jobs sent here instead of the least-loaded backend for cache reuse
+    affinity_picks: int = 0
+
+    @property
+    def load(self) -> int:
+        """Jobs ahead of a new submission: remote queue plus our own in-flight jobs."""
+        return max(self.queue_depth, self.in_flight)
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "address": self.address,
+            "healthy": self.healthy,
+            "draining": self.draining,
+            "queue_depth": self.queue_depth,
+            "in_flight": self.in_flight,
+            "failures": self.failures,
+            "affinity_picks": self.affinity_picks,
+        }
+
+
+class BackendPool:
+    """Select the least-loaded healthy ComfyUI backend for each job."""
+
+    def __init__(
+        self,
+        addresses: List[str],
+        max_failures: int = 3,
+        cooldown: float = 30.0,
+        check_interval: float = 1.0,
+        idle_interval: float = 30.0,
+        probe_timeout: float = 2.0,
+        affinity_slack: int = 1,
+    ):
+        """
+        Args:
+            addresses: Backend addresses (host:port), in preference order.
+            max_failures: Consecutive failures before a backend is evicted.
+            cooldown: Seconds an evicted backend is skipped before re-probing.
+            check_interval: Minimum seconds between ``/queue`` probes per backend.
+            idle_interval: Seconds between probes while no backend has work.
+            probe_timeout: Timeout for health/queue probes.
+            affinity_slack: Extra load a backend may carry and still win a
+                job through ``acquire(affinity=...)``.
+        """
+        if not addresses:
+            raise ValueError("至少需要配置一个 ComfyUI 后端地址")
+
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.check_interval = check_interval
+        self.idle_interval = max(idle_interval, check_interval)
+        self.probe_timeout = probe_timeout
+        self.affinity_slack = affinity_slack
+
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._backends: Dict[str, Backend] = {}
+        for address in addresses:
+            self._backends.setdefault(address, Backend(address))
+
+        # Probes use their own session without retries so a dead backend fails fast
+        self._probe_session = requests.Session()
+        self._probe_session.mount(
+            "http://", HTTPAdapter(pool_maxsize=len(self._backends), max_retries=0)
+        )
+        self._probe_executor = ThreadPoolExecutor(
+            max_workers=len(self._backends), thread_name_prefix="comfyui-probe"
+        )
+        self._refresher: Optional[threading.Thread] = None
+        self._closed = threading.Event()
+        # Set when a job is dispatched so an idle refresher resumes fast probing
+        self._wakeup = threading.Event()
+
+    @property
+    def addresses(self) -> List[str]:
+        return list(self._backends)
+
+    def __len__(self) -> int:
+        return len(self._backends)
+
+    def acquire(self, affinity: Optional[Callable[[str], int]] = None) -> str:
+        """
+        Reserve the least-loaded healthy backend for one job.
+
+        Args:
+            affinity: Optional scorer by address; among backends within
+                ``affinity_slack`` of the lowest load the highest score wins
+                (e.g. the backend that already has the job's models loaded).
+
+        Returns:
+            The selected backend address; pass it to ``release`` when done.
+
+        Raises:
+            NoBackendAvailableError: When every backend is down or draining.
+        """
+        self._ensure_refresher()
+        backend = self._select(affinity)
+        if backend is None:
+            # Every backend is cooling down; re-probe them once before giving up
+            self.refresh(force=True)
+            backend = self._select(affinity)
+        if backend is None:
+            raise NoBackendAvailableError("没有可用的 ComfyUI 后端")
+        self._wakeup.set()
+        return backend.address
+
+    def release(self, address: str, success: bool = True) -> None:
+        """Return a backend reserved by ``acquire`` and record the job outcome."""
+        with self._lock:
+            backend = self._backends.get(address)
+            if backend is None:
+                return
+            backend.in_flight = max(0, backend.in_flight - 1)
+            if success:
+                backend.failures = 0
+            else:
+                self._record_failure(backend)
+
+    @contextmanager
+    def lease(self) -> Iterator[str]:
+        """Context manager around ``acquire``/``release``."""
+        address = self.acquire()
+        try:
+            yield address
+        except requests.RequestException:
+            self.release(address, success=False)
+            raise
+        except BaseException:
+            self.release(address)
+            raise
+        else:
+            self.release(address)
+
+    def drain(self, address: str, draining: bool = True) -> None:
+        """Stop (or resume) dispatching new jobs to a backend."""
+        with self._lock:
+            backend = self._backends.get(address)
+            if backend:
+                backend.draining = draining
+
+    def evict(self, address: str) -> None:
+        """Mark a backend unhealthy and skip it for one cooldown period."""
+        with self._lock:
+            backend = self._backends.get(address)
+            if backend:
+                self._evict(backend)
+
+    def snapshot(self) -> List[Dict[str, object]]:
+        """Return the state of every backend."""
+        with self._lock:
+            return [backend.to_dict() for backend in self._backends.values()]
+
+    def close(self) -> None:
+        """Stop the background refresher."""
+        self._closed.set()
+        self._wakeup.set()
+        self._probe_executor.shutdown(wait=False)
+
+    def _ensure_refresher(self) -> None:
+        """Probe once and start the background refresher on first use."""
+        if self._refresher is not None:
+            return
+        with self._refresh_lock:
+            if self._refresher is not None:
+                return
+            self.refresh(force=True)
+            self._refresher = threading.Thread(
+                target=self._refresh_loop, name="comfyui-pool-refresh", daemon=True
+            )
+            self._refresher.start()
+
+    def _refresh_interval(self) -> float:
+        """Probe often while any backend has work, rarely while all are idle."""
+        with self._lock:
+            busy = any(b.in_flight or b.queue_depth for b in self._backends.values())
+        return self.check_interval if busy else self.idle_interval
+
+    def _refresh_loop(self) -> None:
+        while True:
+            self._wakeup.wait(self._refresh_interval())
+            self._wakeup.clear()
+            if self._closed.is_set():
+                return
+            try:
+                # Do not wait: a slow backend only delays its own next probe
+                self._schedule_probes(force=False)
+            except RuntimeError:
+                # Executor shut down (pool closed or interpreter exiting)
+                return
+            except Exception as exc:
+                print(f"⚠️ 刷新 ComfyUI 后端状态失败: {exc}", flush=True)
+
+    def refresh(self, force: bool = False) -> None:
+        """Probe ``/queue`` on backends whose last check is older than ``check_interval``."""
+        for future in self._schedule_probes(force):
+            future.result()
+
+    def _schedule_probes(self, force: bool) -> List[Future]:
+        """Start a probe for every due backend that is not being probed already."""
+        now = time.monotonic()
+        with self._lock:
+            due = [
+                backend for backend in self._backends.values()
+                if not backend.probing and (force or (
+                    now - backend.last_checked >= self.check_interval
+                    and now >= backend.evicted_until
+                ))
+            ]
+            for backend in due:
+                backend.probing = True
+        return [self._probe_executor.submit(self._probe_backend, backend) for backend in due]
+
+    def _probe_backend(self, backend: Backend) -> None:
+        try:
+            depth = self._probe(backend.address)
+        finally:
+            with self._lock:
+                backend.probing = False
+        with self._lock:
+            backend.last_checked = time.monotonic()
+            if depth is None:
+                self._record_failure(backend)
+            else:
+                if not backend.healthy:
+                    print(f"✅ ComfyUI 后端恢复: {backend.address}", flush=True)
+                    backend.failures = 0
+                backend.healthy = True
+                backend.queue_depth = depth
+
+    def _probe(self, address: str) -> Optional[int]:
+        """Return the number of queued + running prompts, or None when unreachable."""
+        try:
+            response = self._probe_session.get(
+                f"http://{address}/queue",
+                timeout=self.probe_timeout,
+            )
+            response.raise_for_status()
+            data = response.json()
+        except (requests.RequestException, ValueError):
+            return None
+        return len(data.get("queue_running", [])) + len(data.get("queue_pending", []))
+
+    def _select(self, affinity: Optional[Callable[[str], int]] = None) -> Optional[Backend]:
+        with self._lock:
+            candidates = [
+                backend for backend in self._backends.values()
+                if backend.healthy and not backend.draining
+            ]
+            if not candidates:
+                return None
+            # min() keeps configuration order on ties
+            backend = min(candidates, key=lambda b: b.load)
+            if affinity is not None and len(candidates) > 1:
+                eligible = [b for b in candidates if b.load <= backend.load + self.affinity_slack]
+                scores = {b.address: affinity(b.address) for b in eligible}
+                preferred = min(eligible, key=lambda b: (-scores[b.address], b.load))
+                if scores[preferred.address] > scores[backend.address]:
+                    preferred.affinity_picks += 1
+                    backend = preferred
+            backend.in_flight += 1
+            backend.queue_depth += 1
+            return backend
+
+    def _record_failure(self, backend: Backend) -> None:
+        backend.failures += 1
+        if backend.failures >= self.max_failures:
+            self._evict(backend)
+
+    def _evict(self, backend: Backend) -> None:
+        if backend.healthy:
+            print(f"⚠️ ComfyUI 后端不可用，暂时移出调度: {backend.address}", flush=True)
+        backend.healthy = False
+        backend.evicted_until = time.monotonic() + self.cooldown
+
+
+__all__ = ["Backend", "BackendPool", "NoBackendAvailableError"]
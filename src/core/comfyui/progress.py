@@ -0,0 +1,198 @@
+"""
+Live execution progress and latent previews from the ComfyUI websocket.
+
+ComfyUI reports which node is executing, per-step sampler ``progress`` and
+binary preview frames on the same socket used for completion tracking. The
+parsers here turn those messages into small event dicts; ``ProgressRelay``
+throttles and downsizes previews before they are forwarded to the browser.
+"""
+from __future__ import annotations
+
+import base64
+import io
+import json
+import struct
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+try:
+    from PIL import Image
+except ImportError:  # Without Pillow previews are dropped rather than sent full size
+    Image = None
+
+# Binary websocket event types
+PREVIEW_IMAGE = 1
+PREVIEW_IMAGE_WITH_METADATA = 4
+
+# Image format ids used by PREVIEW_IMAGE frames
+_PREVIEW_FORMATS = {1: "image/jpeg", 2: "image/png"}
+
+ProgressEvent = Dict[str, Any]
+
+
+def parse_progress(message: str) -> Optional[ProgressEvent]:
+    """
+    Turn a websocket text message into a progress event.
+
+    Returns:
+        ``{"type": "start" | "executing" | "cached" | "progress", "prompt_id", ...}``
+        or None for messages that carry no progress information.
+    """
+    try:
+        payload = json.loads(message)
+    except ValueError:
+        return None
+
+    msg_type = payload.get("type")
+    data = payload.get("data") or {}
+    prompt_id = data.get("prompt_id")
+    if not prompt_id:
+        return None
+
+    if msg_type == "execution_start":
+        return {"type": "start", "prompt_id": prompt_id}
+    if msg_type == "executing" and data.get("node") is not None:
+        return {"type": "executing", "prompt_id": prompt_id, "node": str(data["node"])}
+    if msg_type == "execution_cached":
+        return {"type": "cached", "prompt_id": prompt_id, "nodes": [str(n) for n in data.get("nodes", [])]}
+    if msg_type == "progress":
+        return {
+            "type": "progress",
+            "prompt_id": prompt_id,
+            "node": str(data.get("node")) if data.get("node") is not None else None,
+            "value": data.get("value", 0),
+            "max": data.get("max", 0),
+        }
+    return None
+
+
+def parse_preview(frame: bytes) -> Optional[ProgressEvent]:
+    """
+    Decode a binary preview frame.
+
+    Old-style frames carry no prompt id (they belong to the prompt that is
+    currently executing); frames with metadata name the prompt and node.
+
+    Returns:
+        ``{"type": "preview", "prompt_id", "node", "mime", "image"}`` or None
+    """
+    if len(frame) < 8:
+        return None
+    (event_type,) = struct.unpack(">I", frame[:4])
+
+    if event_type == PREVIEW_IMAGE:
+        (image_format,) = struct.unpack(">I", frame[4:8])
+        return {
+            "type": "preview",
+            "prompt_id": None,
+            "node": None,
+            "mime": _PREVIEW_FORMATS.get(image_format, "image/jpeg"),
+            "image": frame[8:],
+        }
+
+    if event_type == PREVIEW_IMAGE_WITH_METADATA:
+        (length,) = struct.unpack(">I", frame[4:8])
+        try:
+            metadata = json.loads(frame[8:8 + length])
+        except ValueError:
+            return None
+        node = metadata.get("display_node_id") or metadata.get("node_id")
+        return {
+            "type": "preview",
+            "prompt_id": metadata.get("prompt_id"),
+            "node": str(node) if node is not None else None,
+            "mime": metadata.get("image_type", "image/jpeg"),
+            "image": frame[8 + length:],
+        }
+
+    return None
+
+
+def annotate(event: ProgressEvent, workflow: Dict[str, Any]) -> ProgressEvent:
+    """Add the node class and title from the submitted workflow to an event."""
+    node = workflow.get(event.get("node") or "")
+    if node:
+        event["class_type"] = node.get("class_type")
+        event["title"] = (node.get("_meta") or {}).get("title")
+    return event
+
+
+class ProgressRelay:
+    """
+    Forward progress events to ``emit`` with previews throttled and downsized.
+
+    Progress and node events are forwarded as-is. Previews are dropped when
+    they arrive faster than ``fps``, scaled so the longest edge is at most
+    ``max_size`` and sent as a base64 data URL. Frames that cannot be
+    downscaled (Pillow missing or an undecodable image) are dropped so
+    full-size frames never reach every socket client.
+    """
+
+    def __init__(
+        self,
+        emit: Callable[[str, Dict[str, Any]], None],
+        fps: float = 2.0,
+        max_size: int = 256,
+        quality: int = 70,
+    ):
+        """
+        Args:
+            emit: Called as ``emit(event_name, payload)``.
+            fps: Maximum preview frames per second (0 disables previews).
+            max_size: Longest preview edge in pixels.
+            quality: JPEG quality of re-encoded previews.
+        """
+        self.emit = emit
+        self.fps = fps
+        self.max_size = max_size
+        self.quality = quality
+        self._lock = threading.Lock()
+        self._last_preview = 0.0
+
+    def __call__(self, event: ProgressEvent) -> None:
+        if event["type"] != "preview":
+            self.emit("sampler_progress", event)
+            return
+
+        if self.fps <= 0 or Image is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_preview < 1.0 / self.fps:
+                return
+            self._last_preview = now
+
+        shrunk = self._shrink(event["mime"], event["image"])
+        if shrunk is None:
+            return
+        mime, image = shrunk
+        self.emit(
+            "preview",
+            {
+                "prompt_id": event.get("prompt_id"),
+                "node": event.get("node"),
+                "image": f"data:{mime};base64,{base64.b64encode(image).decode('ascii')}",
+            },
+        )
+
+    def _shrink(self, mime: str, data: bytes) -> Optional[Tuple[str, bytes]]:
+        """Return the downscaled ``(mime, jpeg)``, or None when the frame cannot be decoded."""
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                if max(image.size) <= self.max_size and mime == "image/jpeg":
+                    return mime, data
+                image.thumbnail((self.max_size, self.max_size))
+                buffer = io.BytesIO()
+                image.convert("RGB").save(buffer, format="JPEG", quality=self.quality)
+                return "image/jpeg", buffer.getvalue()
+        except Exception:
+            return None
+
+
+__all__ = [
+    "ProgressRelay",
+    "annotate",
+    "parse_preview",
+    "parse_progress",
+]
@@ -0,0 +1,171 @@
+"""
+Cache-aware job placement and ordering.
+
+ComfyUI only re-executes nodes whose inputs changed since the previous
+prompt: checkpoint/LoRA/upscaler loaders and CLIP text encodes are reused
+when consecutive jobs share them. ``CacheAwareScheduler`` remembers what
+each backend ran last, steers new jobs to a backend that already holds
+their model stack (within a small load slack) and orders batches so jobs
+sharing a model stack and prompt text run back to back.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from src.core.comfyui.workflow import load_workflow_template, workflow_cache
+
+# Node classes whose outputs are models kept in ComfyUI's cache
+MODEL_NODE_MARKERS = ("Loader", "DetectorProvider", "CLIPSetLastLayer")
+
+
+@dataclass(frozen=True)
+class JobSignature:
+    """What a job shares with other jobs from ComfyUI's cache point of view."""
+
+    workflow: str
+    models: str
+    text: str
+
+
+def _digest(value: Any) -> str:
+    raw = json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def model_stack(template: Dict[str, Any]) -> str:
+    """Hash the loader nodes (checkpoints, LoRA chain, upscalers, detectors) of a template."""
+    nodes = {
+        node_id: [node.get("class_type"), node.get("inputs", {})]
+        for node_id, node in template.items()
+        if any(marker in node.get("class_type", "") for marker in MODEL_NODE_MARKERS)
+    }
+    return _digest(nodes)
+
+
+class CacheAwareScheduler:
+    """Track per-backend cache state and use it for dispatch and ordering."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last: Dict[str, JobSignature] = {}
+        self._stacks: Dict[str, str] = {}
+        self._metrics = {
+            "jobs": 0,
+            "model_reuse": 0,
+            "model_loads": 0,
+            "text_reuse": 0,
+            "reordered_batches": 0,
+            "reorder_avoided_reloads": 0,
+            "reorder_avoided_encodes": 0,
+        }
+
+    def signature(self, workflow_path: os.PathLike, positive_prompt: str,
+                  negative_prompt: str, image_digest: Optional[str] = None) -> JobSignature:
+        """Return the signature of a job built from ``workflow_path``."""
+        fingerprint = workflow_cache.fingerprint(workflow_path)
+        with self._lock:
+            stack = self._stacks.get(fingerprint)
+        if stack is None:
+            stack = model_stack(load_workflow_template(workflow_path))
+            with self._lock:
+                self._stacks[fingerprint] = stack
+        # The face reference feeds IPAdapter, so it belongs to the model side
+        models = _digest([stack, image_digest]) if image_digest else stack
+        return JobSignature(fingerprint, models, _digest([positive_prompt, negative_prompt]))
+
+    def affinity(self, signature: JobSignature) -> Callable[[str], int]:
+        """
+        Score backends for ``BackendPool.acquire``: 2 when the model stack is
+        loaded there, +1 when the prompt text is already encoded by it (text
+        encodes are only reused under the same model stack).
+        """
+        def score(address: str) -> int:
+            with self._lock:
+                last = self._last.get(address)
+            if last is None or last.models != signature.models:
+                return 0
+            return 2 + (last.text == signature.text)
+
+        return score
+
+    def record(self, address: str, signature: JobSignature) -> None:
+        """Note that ``signature`` was queued on ``address`` (it runs after the previous job)."""
+        with self._lock:
+            last = self._last.get(address)
+            self._metrics["jobs"] += 1
+            if last is not None and last.models == signature.models:
+                self._metrics["model_reuse"] += 1
+                if last.text == signature.text:
+                    self._metrics["text_reuse"] += 1
+            else:
+                self._metrics["model_loads"] += 1
+            self._last[address] = signature
+
+    def forget(self, address: str) -> None:
+        """Drop the cache state of a backend (e.g. after it restarted)."""
+        with self._lock:
+            self._last.pop(address, None)
+
+    def order(self, signatures: Sequence[JobSignature], address: Optional[str] = None) -> List[int]:
+        """
+        Return an execution order (indices) that groups equal model stacks,
+        then equal prompt text, keeping first-seen order between groups.
+
+        The group matching what ``address`` ran last goes first.
+        """
+        with self._lock:
+            last = self._last.get(address) if address else None
+
+        model_rank: Dict[str, int] = {}
+        text_rank: Dict[tuple, int] = {}
+        if last is not None:
+            model_rank[last.models] = -1
+            text_rank[(last.models, last.text)] = -1
+        for signature in signatures:
+            model_rank.setdefault(signature.models, len(model_rank))
+            text_rank.setdefault((signature.models, signature.text), len(text_rank))
+
+        order = sorted(
+            range(len(signatures)),
+            key=lambda i: (
+                model_rank[signatures[i].models],
+                text_rank[(signatures[i].models, signatures[i].text)],
+                i,
+            ),
+        )
+
+        naive = _transitions(signatures, range(len(signatures)), last)
+        ordered = _transitions(signatures, order, last)
+        with self._lock:
+            if order != sorted(order):
+                self._metrics["reordered_batches"] += 1
+            self._metrics["reorder_avoided_reloads"] += naive[0] - ordered[0]
+            self._metrics["reorder_avoided_encodes"] += naive[1] - ordered[1]
+        return order
+
+    def metrics(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._metrics)
+
+
+def _transitions(signatures: Sequence[JobSignature], order, last: Optional[JobSignature]):
+    """Count model reloads and text re-encodes when running jobs in ``order``."""
+    reloads = encodes = 0
+    previous = last
+    for index in order:
+        current = signatures[index]
+        if previous is None or previous.models != current.models:
+            reloads += 1
+            encodes += 1
+        elif previous.text != current.text:
+            encodes += 1
+        previous = current
+    return reloads, encodes
+
+
+__all__ = ["CacheAwareScheduler", "JobSignature", "model_stack"]
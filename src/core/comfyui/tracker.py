@@ -0,0 +1,382 @@
+"""
+Event-driven completion tracking over the ComfyUI websocket.
+
+A single persistent ``/ws?clientId=...`` connection is kept per backend. Jobs
+submitted with the tracker's ``client_id`` are woken as soon as ComfyUI reports
+them finished, instead of polling ``/history`` once per second. Polling is only
+used as a fallback while the socket is down.
+
+The same connection carries per-node/per-step progress and binary preview
+frames; callers can ``subscribe`` to them per prompt.
+
+Coroutines wait through ``wait_for_completion_async``: the listener thread
+wakes them on their event loop, so an awaiting job holds no thread.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+import websocket
+
+from src.core.comfyui.progress import ProgressEvent, parse_preview, parse_progress
+
+# Message types that mean a prompt will not execute any further
+_TERMINAL_MESSAGES = {"execution_success", "execution_error", "execution_interrupted"}
+
+# How many recently finished prompt ids to remember for late waiters
+RECENT_LIMIT = 512
+
+# Status recorded for prompts cancelled locally; never overwritten by ComfyUI events
+CANCELLED = "cancelled"
+
+
+class JobCancelledError(RuntimeError):
+    """Raised to a waiter when its prompt was cancelled."""
+
+
+class _AsyncWaker:
+    """``threading.Event``-like wake-up for a coroutine; ``set`` may be called from any thread."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._event = asyncio.Event()
+
+    def set(self) -> None:
+        try:
+            self._loop.call_soon_threadsafe(self._event.set)
+        except RuntimeError:
+            # Event loop already closed; nobody is waiting any more
+            pass
+
+    def clear(self) -> None:
+        self._event.clear()
+
+    def is_set(self) -> bool:
+        return self._event.is_set()
+
+    async def wait(self, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self._event.is_set()
+
+
+class CompletionTracker:
+    """Wake waiting jobs from ComfyUI websocket events for one backend."""
+
+    def __init__(
+        self,
+        server_address: str,
+        client_id: Optional[str] = None,
+        poll_interval: float = 1.0,
+        check_interval: float = 30.0,
+        settle_interval: float = 0.1,
+        reconnect_delay: float = 2.0,
+        recv_timeout: float = 30.0,
+    ):
+        """
+        Args:
+            server_address: ComfyUI server address (host:port).
+            client_id: Websocket client id; prompts must be queued with it.
+            poll_interval: History polling interval while the socket is down.
+            check_interval: Safety-net history check while the socket is up.
+            settle_interval: Delay before re-reading history after a wake-up.
+            reconnect_delay: Delay between reconnect attempts.
+            recv_timeout: Socket read timeout before sending a keep-alive ping.
+        """
+        self.server_address = server_address
+        self.client_id = client_id or uuid.uuid4().hex
+        self.poll_interval = poll_interval
+        self.check_interval = check_interval
+        self.settle_interval = settle_interval
+        self.reconnect_delay = reconnect_delay
+        self.recv_timeout = recv_timeout
+
+        self._lock = threading.Lock()
+        # threading.Event for blocking waiters, _AsyncWaker for coroutines
+        self._waiters: Dict[str, object] = {}
+        self._finished: "OrderedDict[str, str]" = OrderedDict()
+        self._listeners: Dict[str, Callable[[ProgressEvent], None]] = {}
+        # (prompt_id, node) currently executing; old-style previews carry neither
+        self._executing: Tuple[Optional[str], Optional[str]] = (None, None)
+        self._connected = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._ws: Optional[websocket.WebSocket] = None
+
+    @property
+    def connected(self) -> bool:
+        """Return True while the websocket connection is open."""
+        return self._connected.is_set()
+
+    def start(self) -> None:
+        """Start the background listener thread if it is not running yet."""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(
+                target=self._run,
+                name=f"comfyui-ws-{self.server_address}",
+                daemon=True,
+            )
+            self._thread.start()
+
+    def wait_for_completion(
+        self,
+        prompt_id: str,
+        fetch_history: Callable[[str], Dict],
+        timeout: Optional[float] = None,
+    ) -> Dict:
+        """
+        Block until a prompt shows up in the ComfyUI history.
+
+        Args:
+            prompt_id: The prompt ID returned by ``/prompt``.
+            fetch_history: Callable returning the ``/history/<prompt_id>`` JSON.
+            timeout: Optional maximum number of seconds to wait.
+
+        Returns:
+            History data containing ``prompt_id``.
+
+        Raises:
+            TimeoutError: When the prompt did not finish within ``timeout``.
+            JobCancelledError: When ``cancel`` was called for the prompt.
+        """
+        self.start()
+        event = self._watch(prompt_id, threading.Event())
+        deadline = time.monotonic() + timeout if timeout else None
+
+        try:
+            while True:
+                signalled = event.wait(self._interval(deadline))
+                if self._status(prompt_id) == CANCELLED:
+                    raise JobCancelledError(f"ComfyUI 任务已取消: {prompt_id}")
+
+                history = fetch_history(prompt_id)
+                if prompt_id in history:
+                    return history
+
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise TimeoutError(f"等待 ComfyUI 任务超时: {prompt_id}")
+
+                if signalled and self._rearm(prompt_id, event) is not None:
+                    # ComfyUI stores history slightly after announcing completion
+                    time.sleep(self.settle_interval)
+        finally:
+            self._unwatch(prompt_id)
+
+    async def wait_for_completion_async(
+        self,
+        prompt_id: str,
+        fetch_history: Callable[[str], Awaitable[Dict]],
+        timeout: Optional[float] = None,
+    ) -> Dict:
+        """
+        Awaitable ``wait_for_completion``; ``fetch_history`` is a coroutine function.
+
+        The coroutine is woken on its own event loop by the listener thread,
+        so any number of jobs can wait without holding a thread each.
+        """
+        self.start()
+        event = self._watch(prompt_id, _AsyncWaker(asyncio.get_running_loop()))
+        deadline = time.monotonic() + timeout if timeout else None
+
+        try:
+            while True:
+                signalled = await event.wait(self._interval(deadline))
+                if self._status(prompt_id) == CANCELLED:
+                    raise JobCancelledError(f"ComfyUI 任务已取消: {prompt_id}")
+
+                history = await fetch_history(prompt_id)
+                if prompt_id in history:
+                    return history
+
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise TimeoutError(f"等待 ComfyUI 任务超时: {prompt_id}")
+
+                if signalled and self._rearm(prompt_id, event) is not None:
+                    await asyncio.sleep(self.settle_interval)
+        finally:
+            self._unwatch(prompt_id)
+
+    def _interval(self, deadline: Optional[float]) -> float:
+        """Seconds until the next history check (safety net or polling fallback)."""
+        interval = self.check_interval if self.connected else self.poll_interval
+        if deadline is not None:
+            interval = max(0.0, min(interval, deadline - time.monotonic()))
+        return interval
+
+    def subscribe(self, prompt_id: str, callback: Callable[[ProgressEvent], None]) -> None:
+        """
+        Deliver progress and preview events of a prompt to ``callback``.
+
+        The callback runs on the listener thread and must return quickly.
+        """
+        with self._lock:
+            self._listeners[prompt_id] = callback
+
+    def unsubscribe(self, prompt_id: str) -> None:
+        with self._lock:
+            self._listeners.pop(prompt_id, None)
+
+    def _notify(self, event: ProgressEvent) -> None:
+        with self._lock:
+            callback = self._listeners.get(event["prompt_id"])
+        if callback is None:
+            return
+        try:
+            callback(event)
+        except Exception as exc:
+            print(f"⚠️ 进度回调出错 ({event['prompt_id']}): {exc}", flush=True)
+
+    def _watch(self, prompt_id: str, event):
+        """Register a waiter's event, pre-set when the prompt already finished."""
+        with self._lock:
+            self._waiters[prompt_id] = event
+            if prompt_id in self._finished:
+                event.set()
+            return event
+
+    def cancel(self, prompt_id: str) -> None:
+        """Wake the waiter of a prompt with ``JobCancelledError`` (now or when it starts waiting)."""
+        self._mark_finished(prompt_id, CANCELLED)
+
+    def _status(self, prompt_id: str) -> Optional[str]:
+        with self._lock:
+            return self._finished.get(prompt_id)
+
+    def _rearm(self, prompt_id: str, event) -> Optional[str]:
+        """
+        Return the prompt status, clearing ``event`` if the prompt has not finished.
+
+        The check and the clear happen under the lock that ``_mark_finished``
+        records the status under, so a completion arriving in between is never
+        cleared away (it would otherwise only be noticed at the next
+        ``check_interval``).
+        """
+        with self._lock:
+            status = self._finished.get(prompt_id)
+            if status is None:
+                # Woken by a reconnect, not by completion
+                event.clear()
+            return status
+
+    def _unwatch(self, prompt_id: str) -> None:
+        with self._lock:
+            self._waiters.pop(prompt_id, None)
+            self._finished.pop(prompt_id, None)
+
+    def _mark_finished(self, prompt_id: str, status: str) -> None:
+        with self._lock:
+            if self._finished.get(prompt_id) == CANCELLED:
+                return
+            self._finished[prompt_id] = status
+            while len(self._finished) > RECENT_LIMIT:
+                self._finished.popitem(last=False)
+            event = self._waiters.get(prompt_id)
+        if event:
+            event.set()
+
+    def _wake_all(self) -> None:
+        """Wake every waiter so it re-checks history (e.g. after reconnect)."""
+        with self._lock:
+            events = list(self._waiters.values())
+        for event in events:
+            event.set()
+
+    def _run(self) -> None:
+        """Listener loop: connect, dispatch messages, reconnect on failure."""
+        url = f"ws://{self.server_address}/ws?clientId={self.client_id}"
+        while True:
+            try:
+                ws = websocket.WebSocket()
+                ws.connect(url, timeout=self.recv_timeout)
+                self._ws = ws
+                self._connected.set()
+                # Completions may have been missed while disconnected
+                self._wake_all()
+                self._listen(ws)
+            except Exception as exc:
+                if self._connected.is_set():
+                    print(f"⚠️ ComfyUI websocket 断开 ({self.server_address}): {exc}", flush=True)
+            finally:
+                self._connected.clear()
+                if self._ws is not None:
+                    try:
+                        self._ws.close()
+                    except Exception:
+                        pass
+                    self._ws = None
+            time.sleep(self.reconnect_delay)
+
+    def _listen(self, ws: websocket.WebSocket) -> None:
+        while True:
+            try:
+                message = ws.recv()
+            except websocket.WebSocketTimeoutException:
+                ws.ping()
+                continue
+
+            if not message:
+                raise ConnectionError("websocket closed by server")
+            if isinstance(message, bytes):
+                self._handle_preview(message)
+            else:
+                self._handle_message(message)
+
+    def _handle_message(self, message: str) -> None:
+        finished = parse_completion(message)
+        if finished:
+            self._executing = (None, None)
+            self._mark_finished(*finished)
+            return
+
+        event = parse_progress(message)
+        if event is None:
+            return
+        if event["type"] in ("start", "executing"):
+            self._executing = (event["prompt_id"], event.get("node"))
+        self._notify(event)
+
+    def _handle_preview(self, frame: bytes) -> None:
+        if not self._listeners:
+            return
+        event = parse_preview(frame)
+        if event is None:
+            return
+        if event["prompt_id"] is None:
+            event["prompt_id"], event["node"] = self._executing
+            if event["prompt_id"] is None:
+                return
+        self._notify(event)
+
+
+def parse_completion(message: str) -> Optional[Tuple[str, str]]:
+    """
+    Return ``(prompt_id, status)`` when a websocket text message ends a prompt.
+    """
+    try:
+        payload = json.loads(message)
+    except ValueError:
+        return None
+
+    msg_type = payload.get("type")
+    data = payload.get("data") or {}
+    prompt_id = data.get("prompt_id")
+    if not prompt_id:
+        return None
+
+    if msg_type == "executing" and data.get("node") is None:
+        return prompt_id, "success"
+    if msg_type in _TERMINAL_MESSAGES:
+        return prompt_id, msg_type
+    return None
+
+
+__all__ = ["CompletionTracker", "JobCancelledError", "parse_completion"]
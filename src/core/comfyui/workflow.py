@@ -0,0 +1,373 @@
+"""
+Parsed ComfyUI workflow templates and cheap per-job patching.
+
+Workflow files are parsed once and re-read only when their mtime (or size)
+changes. Cached templates are shared and must never be mutated: each job gets
+a shallow copy from ``patch_workflow`` that duplicates only the nodes it
+changes.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import random
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from src.core.comfyui.graph import (
+    OUTPUT_NODE_CLASSES,
+    bypass_features,
+    output_node_ids,
+    prune,
+    validate,
+)
+
+PROJECT_ROOT = Path(__file__).resolve().parents[3]
+WORKFLOW_DIR = PROJECT_ROOT / "config" / "workflows"
+NORMAL_WORKFLOW = WORKFLOW_DIR / "flowv_normal.json"
+FACE_WORKFLOW = WORKFLOW_DIR / "flow_face.json"
+
+# Node ids patched per job
+POSITIVE_NODE = "45"
+NEGATIVE_NODE = "46"
+LATENT_NODE = "6"
+SEED_NODES = ("5", "11", "120")
+LOAD_IMAGE_NODE = "96:0"
+DECODE_NODE = "7"
+SAVE_NODE = "37"
+
+# Workflow stages: the whole graph, a draft that stops at the base image
+# (VAEDecode) and the detail/upscale passes run on a stored draft
+STAGE_FULL = "full"
+STAGE_DRAFT = "draft"
+STAGE_FINAL = "final"
+STAGES = (STAGE_FULL, STAGE_DRAFT, STAGE_FINAL)
+
+# Upper bound of generated seeds
+MAX_SEED = 999999999999999
+
+
+class WorkflowTemplateCache:
+    """Parse each workflow file once and invalidate it on mtime change."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[Tuple[int, int], Dict[str, Any], str]] = {}
+
+    def get(self, path: os.PathLike) -> Dict[str, Any]:
+        """
+        Return the parsed (read-only) template for ``path``.
+
+        Raises:
+            FileNotFoundError: When the workflow file does not exist.
+        """
+        return self._entry(path)[1]
+
+    def fingerprint(self, path: os.PathLike) -> str:
+        """Return a hash of the template content (independent of formatting)."""
+        return self._entry(path)[2]
+
+    def _entry(self, path: os.PathLike) -> Tuple[Tuple[int, int], Dict[str, Any], str]:
+        key = str(Path(path).resolve())
+        try:
+            stat = os.stat(key)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"未找到工作流文件: {path}") from None
+        version = (stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == version:
+                return entry
+
+        with open(key, "r", encoding="utf-8") as fh:
+            template = json.load(fh)
+        canonical = json.dumps(template, sort_keys=True, separators=(",", ":"))
+        entry = (version, template, hashlib.sha256(canonical.encode("utf-8")).hexdigest())
+
+        with self._lock:
+            self._entries[key] = entry
+        return entry
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+def patch_workflow(
+    template: Dict[str, Any],
+    patches: Dict[str, Dict[str, Any]],
+) -> Dict[str, Any]:
+    """
+    Return a job copy of ``template`` with node inputs replaced.
+
+    Only the patched nodes (and their ``inputs`` dicts) are copied; every
+    other node is shared with the template. Patches for nodes missing from
+    the template are ignored.
+
+    Args:
+        template: Cached workflow template (not modified).
+        patches: Mapping of node id to ``{input_name: value}``.
+
+    Returns:
+        Workflow dict ready for submission.
+    """
+    workflow = dict(template)
+    for node_id, inputs in patches.items():
+        node = template.get(node_id)
+        if node is None or not inputs:
+            continue
+        node = dict(node)
+        node["inputs"] = {**node.get("inputs", {}), **inputs}
+        workflow[node_id] = node
+    return workflow
+
+
+def resolve_workflow_path(workflow_path: Optional[os.PathLike], image_path: Optional[str]) -> Path:
+    """Auto-select the face workflow when a reference image is given."""
+    if workflow_path is None:
+        return FACE_WORKFLOW if image_path else NORMAL_WORKFLOW
+    return Path(workflow_path)
+
+
+def has_input(template: Dict[str, Any], node_id: str, name: str) -> bool:
+    """Return True when ``node_id`` exists and declares input ``name``."""
+    return name in template.get(node_id, {}).get("inputs", {})
+
+
+def random_seed() -> int:
+    """Draw a seed for a job that does not pin one."""
+    return random.randint(0, MAX_SEED)
+
+
+def _require_nodes(workflow: Dict[str, Any], stage: str) -> None:
+    for node_id in (DECODE_NODE, SAVE_NODE):
+        if node_id not in workflow:
+            raise ValueError(f"工作流缺少节点 {node_id}，无法使用 {stage} 阶段")
+
+
+def draft_workflow(workflow: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Trim a job workflow to the base image.
+
+    Points SaveImage (node 37) at VAEDecode (node 7) and prunes the graph,
+    leaving the sampler, text encodes, checkpoint and LoRA chain; the
+    detailers and the upscaler are never executed or loaded.
+    """
+    _require_nodes(workflow, STAGE_DRAFT)
+    draft = dict(workflow)
+    save = dict(workflow[SAVE_NODE])
+    save["inputs"] = {**save.get("inputs", {}), "images": [DECODE_NODE, 0], "filename_prefix": "draft"}
+    draft[SAVE_NODE] = save
+    return prune(draft)
+
+
+def final_workflow(workflow: Dict[str, Any], draft_image: str) -> Dict[str, Any]:
+    """
+    Run only the stages after VAEDecode on a stored draft.
+
+    VAEDecode (node 7) is replaced by a ``LoadImage`` of ``draft_image``
+    (an image name on the backend), which keeps every link to it valid;
+    pruning then drops the sampler and the nodes only it needed.
+    """
+    _require_nodes(workflow, STAGE_FINAL)
+    final = dict(workflow)
+    final[DECODE_NODE] = {
+        "class_type": "LoadImage",
+        "inputs": {"image": draft_image},
+        "_meta": {"title": "Draft"},
+    }
+    return prune(final)
+
+
+def build_job_workflow(positive_prompt, negative_prompt, width=800, height=1200,
+                       workflow_path=None, image_path=None, batch_size=1,
+                       image_name=None, seed=None, stage=STAGE_FULL,
+                       draft_image=None, features=None) -> Dict[str, Any]:
+    """
+    Build a job workflow from the cached template.
+
+    Args:
+        positive_prompt: Positive prompt text
+        negative_prompt: Negative prompt text
+        width: Image width (default 800)
+        height: Image height (default 1200)
+        workflow_path: Path to workflow JSON file (auto-select if None)
+        image_path: Path to input image for face workflow (optional)
+        batch_size: Images per prompt via EmptyLatentImage ``batch_size``
+        image_name: Name of the uploaded reference image on the backend
+            (falls back to the absolute ``image_path`` when None)
+        seed: Sampler seed (random if None)
+        stage: ``STAGE_FULL``, ``STAGE_DRAFT`` (stop at VAEDecode) or
+            ``STAGE_FINAL`` (detail and upscale ``draft_image``)
+        draft_image: Name of the uploaded draft on the backend (final stage)
+        features: Optional stage switches, e.g. ``{"face_fix": False,
+            "upscale": False}`` (see ``graph.FEATURES``; missing = on)
+
+    Returns:
+        Pruned and validated workflow ready for submission
+
+    Raises:
+        ValueError: For an unknown stage, a final stage without
+            ``draft_image`` or a template lacking nodes 7/37.
+        WorkflowValidationError: When the resulting graph is invalid.
+    """
+    if stage not in STAGES:
+        raise ValueError(f"未知的工作流阶段: {stage}")
+    if stage == STAGE_FINAL and not draft_image:
+        raise ValueError("精修阶段需要草稿图片")
+
+    # Auto-select workflow based on image_path
+    workflow_path = resolve_workflow_path(workflow_path, image_path)
+    template = load_workflow_template(workflow_path)
+
+    if image_path:
+        print(f"🖼️ 使用人脸替换工作流: {workflow_path}", flush=True)
+    else:
+        print(f"📝 使用普通文生图工作流: {workflow_path}", flush=True)
+
+    patches = {}
+
+    # Replace image path in face workflow if needed
+    if image_path and LOAD_IMAGE_NODE in template:
+        # Uploaded name on the backend, or an absolute path on a shared filesystem
+        image_value = image_name or os.path.abspath(image_path)
+        patches[LOAD_IMAGE_NODE] = {"image": image_value}
+        print(f"📸 输入图片: {image_value}", flush=True)
+
+    # Update prompts in workflow
+    if "3" in template:
+        patches[POSITIVE_NODE] = {"value": positive_prompt}
+    if "4" in template:
+        patches[NEGATIVE_NODE] = {"value": negative_prompt}
+
+    # Update image dimensions
+    if LATENT_NODE in template:
+        patches[LATENT_NODE] = {"width": width, "height": height, "batch_size": batch_size}
+        print(f"📐 图片尺寸: {width}x{height}，批量: {batch_size}", flush=True)
+
+    # Set the job seed on the seed nodes; KSampler inputs linked to the
+    # "easy seed" node (120) keep their link
+    if seed is None:
+        seed = random_seed()
+    for node_id in SEED_NODES:
+        if has_input(template, node_id, "seed") and not isinstance(template[node_id]["inputs"]["seed"], list):
+            patches[node_id] = {"seed": seed}
+    print(f"🎲 种子: {seed}", flush=True)
+
+    workflow = bypass_features(patch_workflow(template, patches), features)
+    disabled = [name for name, enabled in (features or {}).items() if not enabled]
+    if disabled and stage != STAGE_DRAFT:
+        print(f"⏭️ 跳过: {', '.join(disabled)}", flush=True)
+
+    if stage == STAGE_DRAFT:
+        print("✏️ 草稿模式：只生成到 VAE 解码", flush=True)
+        workflow = draft_workflow(workflow)
+    elif stage == STAGE_FINAL:
+        print(f"✨ 精修草稿: {draft_image}", flush=True)
+        workflow = final_workflow(workflow, draft_image)
+    else:
+        workflow = prune(workflow)
+
+    validate(workflow)
+    return workflow
+
+
+def select_output_images(
+    outputs: Dict[str, Any],
+    output_nodes: Tuple[str, ...],
+    include_previews: bool = False,
+) -> List[Dict[str, Any]]:
+    """
+    Pick the final images from a ``/history`` ``outputs`` mapping.
+
+    Only images from ``output_nodes`` (any node when empty) with
+    ``type == "output"`` are final; the rest (previews, comparer temp images)
+    are appended only when ``include_previews`` is set.
+    """
+    refs = []
+    extras = []
+    for node_id, node_output in outputs.items():
+        is_output_node = not output_nodes or node_id in output_nodes
+        for image in node_output.get("images", []):
+            if is_output_node and image.get("type") == "output":
+                refs.append(image)
+            else:
+                extras.append(image)
+    return refs + extras if include_previews else refs
+
+
+def result_cache_key(
+    positive_prompt: str,
+    negative_prompt: str,
+    width: int,
+    height: int,
+    seed: int,
+    batch_size: int,
+    workflow_path: os.PathLike,
+    image_digest: Optional[str] = None,
+    stage: str = STAGE_FULL,
+    draft_digest: Optional[str] = None,
+    features: Optional[Mapping[str, bool]] = None,
+) -> str:
+    """
+    Key identifying the images a job deterministically produces.
+
+    Covers everything patched into the template plus the template content
+    itself, the reference image content (face workflow) and, for draft and
+    final stages, the stage and the draft image content, plus the
+    switched-off features.
+    """
+    parts = [
+        positive_prompt,
+        negative_prompt,
+        str(width),
+        str(height),
+        str(seed),
+        str(batch_size),
+        workflow_cache.fingerprint(workflow_path),
+        image_digest or "",
+    ]
+    if stage != STAGE_FULL:
+        # Full-stage keys stay unchanged so existing cache entries remain valid
+        parts += [stage, draft_digest or ""]
+    disabled = sorted(name for name, enabled in (features or {}).items() if not enabled)
+    if disabled:
+        parts.append("-" + ",".join(disabled))
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+# Shared template cache
+workflow_cache = WorkflowTemplateCache()
+
+
+def load_workflow_template(path: os.PathLike) -> Dict[str, Any]:
+    """Return the cached template for ``path``."""
+    return workflow_cache.get(path)
+
+
+__all__ = [
+    "FACE_WORKFLOW",
+    "MAX_SEED",
+    "NORMAL_WORKFLOW",
+    "OUTPUT_NODE_CLASSES",
+    "STAGES",
+    "STAGE_DRAFT",
+    "STAGE_FINAL",
+    "STAGE_FULL",
+    "WorkflowTemplateCache",
+    "build_job_workflow",
+    "draft_workflow",
+    "final_workflow",
+    "has_input",
+    "load_workflow_template",
+    "output_node_ids",
+    "patch_workflow",
+    "random_seed",
+    "resolve_workflow_path",
+    "result_cache_key",
+    "select_output_images",
+    "workflow_cache",
+]
@@ -0,0 +1,169 @@
+"""
+ComfyUI 任务日志（SQLite）
+在提交前记录每个 ComfyUI prompt，进程重启后可据此重新接管未完成的任务
+"""
+import sqlite3
+import json
+import os
+from datetime import datetime, timedelta
+from typing import List, Dict, Iterable, Optional
+from contextlib import contextmanager
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../.."))
+DB_FILE = os.path.join(PROJECT_ROOT, 'data/jobs.db')
+
+# 任务状态
+QUEUED = 'queued'        # 已提交，结果尚未保存
+DONE = 'done'            # 结果已保存
+CANCELLED = 'cancelled'  # 已取消或结果不再需要
+LOST = 'lost'            # ComfyUI 既没有历史也不在队列中（后端重启等）
+
+
+class JobJournal:
+    """ComfyUI 任务日志 - 与 history.db 放在同一目录"""
+
+    def __init__(self, db_path: str = DB_FILE):
+        if not os.path.isabs(db_path):
+            db_path = os.path.join(PROJECT_ROOT, db_path)
+        self.db_path = db_path
+
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+
+        # 初始化数据库
+        self._init_database()
+
+    @contextmanager
+    def get_connection(self):
+        """获取数据库连接的上下文管理器"""
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise e
+        finally:
+            conn.close()
+
+    def _init_database(self):
+        """初始化数据库表结构"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+
+            # WAL 模式下每次提交只追加日志，写入不阻塞读取
+            cursor.execute('PRAGMA journal_mode=WAL')
+
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    server_address TEXT NOT NULL,
+                    prompt_id TEXT NOT NULL,
+                    output_nodes TEXT NOT NULL,
+                    batch_size INTEGER DEFAULT 1,
+                    seed INTEGER,
+                    stage TEXT DEFAULT 'full',
+                    cache_key TEXT,
+                    status TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                )
+            ''')
+
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_jobs_status
+                ON jobs(status, created_at)
+            ''')
+
+            # 任务使用的提示词（多变体模式下与历史记录中的提示词不同）
+            columns = [row['name'] for row in cursor.execute('PRAGMA table_info(jobs)')]
+            if 'positive_prompt' not in columns:
+                cursor.execute('ALTER TABLE jobs ADD COLUMN positive_prompt TEXT')
+                cursor.execute('ALTER TABLE jobs ADD COLUMN negative_prompt TEXT')
+
+    def record(self, job_id: str, server_address: str, prompt_id: str,
+               output_nodes: Iterable[str] = (), batch_size: int = 1,
+               seed: Optional[int] = None, stage: str = 'full',
+               cache_key: Optional[str] = None, positive_prompt: Optional[str] = None,
+               negative_prompt: Optional[str] = None):
+        """
+        记录一个任务（在提交到 ComfyUI 之前调用）
+
+        Args:
+            job_id: ComfyUI 的 prompt_id（由客户端生成并随工作流提交）
+            server_address: 任务所在的 ComfyUI 后端
+            prompt_id: 历史记录 ID（图片保存到该记录下）
+        """
+        now = datetime.now().isoformat()
+
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT OR REPLACE INTO jobs
+                (job_id, server_address, prompt_id, output_nodes, batch_size, seed,
+                 stage, cache_key, positive_prompt, negative_prompt, status, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (job_id, server_address, prompt_id, json.dumps(list(output_nodes)),
+                  batch_size, seed, stage, cache_key, positive_prompt, negative_prompt,
+                  QUEUED, now, now))
+
+    def finish(self, job_ids: Iterable[str], status: str = DONE):
+        """将任务标记为结束（只更新仍在排队状态的任务）"""
+        job_ids = [job_id for job_id in job_ids if job_id]
+        if not job_ids:
+            return
+        now = datetime.now().isoformat()
+
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany('''
+                UPDATE jobs SET status = ?, updated_at = ?
+                WHERE job_id = ? AND status = ?
+            ''', [(status, now, job_id, QUEUED) for job_id in job_ids])
+
+    def status(self, job_id: str) -> Optional[str]:
+        """任务当前状态（没有记录时为 None）"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT status FROM jobs WHERE job_id = ?', (job_id,))
+            row = cursor.fetchone()
+            return row['status'] if row else None
+
+    def unfinished(self, max_age_hours: float = 24) -> List[Dict]:
+        """获取未完成的任务（超过 max_age_hours 的视为丢失）"""
+        cutoff = (datetime.now() - timedelta(hours=max_age_hours)).isoformat()
+
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE jobs SET status = ?, updated_at = ?
+                WHERE status = ? AND created_at < ?
+            ''', (LOST, datetime.now().isoformat(), QUEUED, cutoff))
+
+            cursor.execute('''
+                SELECT * FROM jobs
+                WHERE status = ?
+                ORDER BY created_at ASC
+            ''', (QUEUED,))
+
+            jobs = []
+            for row in cursor.fetchall():
+                job = dict(row)
+                job['output_nodes'] = tuple(json.loads(job['output_nodes']))
+                jobs.append(job)
+            return jobs
+
+    def purge(self, max_age_hours: float = 24 * 7):
+        """删除早已结束的任务记录，防止日志无限增长"""
+        cutoff = (datetime.now() - timedelta(hours=max_age_hours)).isoformat()
+
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                DELETE FROM jobs
+                WHERE status != ? AND updated_at < ?
+            ''', (QUEUED, cutoff))
+
+
+# 全局实例
+job_journal = JobJournal()
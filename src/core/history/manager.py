@@ -4,6 +4,7 @@ SQLite 版本的历史记录管理器
 """
 import sqlite3
 import hashlib
+import json
 import os
 from datetime import datetime
 from typing import List, Dict, Optional
@@ -86,6 +87,34 @@ class HistoryManager:
                 ON images(prompt_id)
             ''')
 
+            # 旧数据库的图片表没有种子列
+            columns = [row['name'] for row in cursor.execute('PRAGMA table_info(images)')]
+            if 'seed' not in columns:
+                cursor.execute('ALTER TABLE images ADD COLUMN seed INTEGER')
+            # 生成阶段：full（完整流程）、draft（草稿）、final（由草稿精修）
+            if 'stage' not in columns:
+                cursor.execute("ALTER TABLE images ADD COLUMN stage TEXT DEFAULT 'full'")
+            # 图片实际使用的提示词（多变体模式下同一记录的图片提示词各不相同），NULL 表示与记录相同
+            if 'positive_prompt' not in columns:
+                cursor.execute('ALTER TABLE images ADD COLUMN positive_prompt TEXT')
+                cursor.execute('ALTER TABLE images ADD COLUMN negative_prompt TEXT')
+
+            # 生成结果缓存：任务缓存键 -> 已保存的图片
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS result_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    prompt_id TEXT NOT NULL,
+                    filenames TEXT NOT NULL,
+                    seed INTEGER,
+                    created_at TEXT NOT NULL
+                )
+            ''')
+
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_result_cache_prompt_id
+                ON result_cache(prompt_id)
+            ''')
+
     def add_record(self, prompt: str, positive_prompt: str, negative_prompt: str,
                    width: int, height: int) -> str:
         """添加新记录或更新已存在的记录"""
@@ -129,8 +158,10 @@ class HistoryManager:
                 return record
             return None
 
-    def update_images(self, prompt_id: str, image_filename: str):
-        """添加图片到记录"""
+    def update_images(self, prompt_id: str, image_filename: str, seed: Optional[int] = None,
+                      stage: str = 'full', positive_prompt: Optional[str] = None,
+                      negative_prompt: Optional[str] = None):
+        """添加图片到记录（positive_prompt/negative_prompt 为该图片实际使用的提示词）"""
         now = datetime.now().isoformat()
 
         with self.get_connection() as conn:
@@ -138,9 +169,10 @@ class HistoryManager:
 
             # 添加图片记录
             cursor.execute('''
-                INSERT INTO images (prompt_id, filename, created_at)
-                VALUES (?, ?, ?)
-            ''', (prompt_id, image_filename, now))
+                INSERT INTO images
+                (prompt_id, filename, created_at, seed, stage, positive_prompt, negative_prompt)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (prompt_id, image_filename, now, seed, stage, positive_prompt, negative_prompt))
 
             # 更新图片计数和最后使用时间
             cursor.execute('''
@@ -184,6 +216,25 @@ class HistoryManager:
 
             return [row['filename'] for row in cursor.fetchall()]
 
+    def get_image_info(self, prompt_id: str, image_filename: str) -> Optional[Dict]:
+        """获取单张图片的种子、生成阶段和实际使用的提示词（未单独记录时为 None）"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT seed, stage, positive_prompt, negative_prompt FROM images
+                WHERE prompt_id = ? AND filename = ?
+            ''', (prompt_id, image_filename))
+            row = cursor.fetchone()
+
+            if row:
+                return {
+                    'seed': row['seed'],
+                    'stage': row['stage'] or 'full',
+                    'positive_prompt': row['positive_prompt'],
+                    'negative_prompt': row['negative_prompt'],
+                }
+            return None
+
     def get_all_records(self) -> List[Dict]:
         """获取所有历史记录，按最后使用时间排序"""
         with self.get_connection() as conn:
@@ -202,6 +253,17 @@ class HistoryManager:
 
             return records
 
+    def get_popular_prompts(self, limit: int = 10) -> List[str]:
+        """获取生成图片最多的用户提示词（次数相同时最近使用的在前）"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT prompt FROM prompts
+                ORDER BY image_count DESC, last_used DESC
+                LIMIT ?
+            ''', (limit,))
+            return [row['prompt'] for row in cursor.fetchall()]
+
     def delete_record(self, prompt_id: str):
         """删除记录（级联删除关联的图片记录）"""
         with self.get_connection() as conn:
@@ -213,6 +275,51 @@ class HistoryManager:
             # 删除提示词记录
             cursor.execute('DELETE FROM prompts WHERE id = ?', (prompt_id,))
 
+            # 删除指向这些图片的结果缓存
+            cursor.execute('DELETE FROM result_cache WHERE prompt_id = ?', (prompt_id,))
+
+    def get_cached_result(self, cache_key: str) -> Optional[Dict]:
+        """
+        根据任务缓存键查找已保存的生成结果
+
+        Returns:
+            {'prompt_id', 'filenames', 'seed'}，未命中时返回 None
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT prompt_id, filenames, seed FROM result_cache
+                WHERE cache_key = ?
+            ''', (cache_key,))
+            row = cursor.fetchone()
+
+            if row:
+                return {
+                    'prompt_id': row['prompt_id'],
+                    'filenames': json.loads(row['filenames']),
+                    'seed': row['seed'],
+                }
+            return None
+
+    def save_cached_result(self, cache_key: str, prompt_id: str,
+                           filenames: List[str], seed: Optional[int] = None):
+        """记录一个任务生成的图片（文件名相对于 prompt_id 目录）"""
+        now = datetime.now().isoformat()
+
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT OR REPLACE INTO result_cache
+                (cache_key, prompt_id, filenames, seed, created_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (cache_key, prompt_id, json.dumps(filenames), seed, now))
+
+    def invalidate_cached_result(self, cache_key: str):
+        """删除失效（图片已被删除）的结果缓存"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM result_cache WHERE cache_key = ?', (cache_key,))
+
     def get_statistics(self) -> Dict:
         """获取统计信息"""
         with self.get_connection() as conn:
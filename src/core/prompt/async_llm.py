@@ -0,0 +1,132 @@
+"""
+异步 LLM 调用层
+
+协程接口建立在同步路径之上：对话经 ``get_router()`` 发送（与同步路径共用
+熔断、EMA 选路和失败切换），提示词生成调用 ``generate_prompt_variants``
+（共用缓存和相同请求合并）。阻塞调用在 ``LLM_ASYNC_WORKERS`` 个工作线程中
+执行，流式片段通过 ``call_soon_threadsafe`` 交回事件循环。协程被取消时触发
+``CancelEvent``，立即断开进行中的请求（包括还在等待首个片段的请求）。
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from src.core.prompt import generator
+from src.core.prompt.providers import CancelEvent
+from src.core.prompt.router import get_router
+from src.utils.aio import run_sync
+from src.utils.env import env_int
+
+_executor = ThreadPoolExecutor(max_workers=env_int('LLM_ASYNC_WORKERS', 8), thread_name_prefix='llm-async')
+
+# astream 队列中的标记：请求结束 / 切换端点重新生成
+_DONE = object()
+_FAILOVER = object()
+
+
+async def _run(func, *args, **kwargs):
+    """在工作线程中执行阻塞的 LLM 调用；协程被取消时触发 CancelEvent 中止请求"""
+    cancel_event = CancelEvent()
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(_executor, partial(func, *args, cancel_event=cancel_event, **kwargs))
+    try:
+        return await future
+    except asyncio.CancelledError:
+        cancel_event.set()
+        raise
+
+
+def _on_loop(loop: asyncio.AbstractEventLoop, callback: Optional[Callable]) -> Optional[Callable]:
+    """把工作线程中的回调转到事件循环线程执行"""
+    if callback is None:
+        return None
+    return lambda *args: loop.call_soon_threadsafe(callback, *args)
+
+
+async def achat(messages: List[Dict], stream: bool = False,
+                callback: Optional[Callable[[str], None]] = None,
+                stop_when: Optional[Callable[[str], bool]] = None,
+                on_failover: Optional[Callable[[], None]] = None) -> str:
+    """
+    异步发送对话并返回完整回复（参数同 ``LLMRouter.chat``）
+
+    callback 和 on_failover 在事件循环线程中调用；stop_when 在工作线程中调用。
+    """
+    loop = asyncio.get_running_loop()
+    return await _run(get_router().chat, messages, stream=stream,
+                      callback=_on_loop(loop, callback) if stream else None,
+                      stop_when=stop_when, on_failover=_on_loop(loop, on_failover))
+
+
+async def astream(messages: List[Dict], stop_when: Optional[Callable[[str], bool]] = None,
+                  on_failover: Optional[Callable[[], None]] = None) -> AsyncIterator[str]:
+    """
+    流式读取回复，逐个产出片段
+
+    切换端点重新生成时先调用 on_failover（此前产出的片段作废），再继续产出
+    新端点的片段。提前结束迭代会中止请求。
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+
+    def put(item):
+        loop.call_soon_threadsafe(queue.put_nowait, item)
+
+    task = asyncio.ensure_future(_run(get_router().chat, messages, stream=True, callback=put,
+                                      stop_when=stop_when, on_failover=lambda: put(_FAILOVER)))
+    # 片段都在请求结束前交回事件循环，结束标记排在它们之后
+    task.add_done_callback(lambda _: queue.put_nowait(_DONE))
+    try:
+        while True:
+            item = await queue.get()
+            if item is _DONE:
+                break
+            if item is _FAILOVER:
+                if on_failover is not None:
+                    on_failover()
+                continue
+            yield item
+        await task
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+async def agenerate_prompt_variants(user_req: str, count: int, stream: bool = False,
+                                    log_callback: Optional[Callable[[str], None]] = None,
+                                    reset_callback: Optional[Callable[[str], None]] = None
+                                    ) -> List[Tuple[str, str]]:
+    """
+    异步生成 count 组提示词（参数和返回值同 ``generate_prompt_variants``）
+
+    log_callback 和 reset_callback 在事件循环线程中调用。
+    """
+    loop = asyncio.get_running_loop()
+    return await _run(generator.generate_prompt_variants, user_req, count, stream=stream,
+                      log_callback=_on_loop(loop, log_callback),
+                      reset_callback=_on_loop(loop, reset_callback))
+
+
+async def agenerate_prompt(user_req: str, stream: bool = False,
+                           log_callback: Optional[Callable[[str], None]] = None) -> Tuple[str, str]:
+    """
+    异步生成提示词，与 ``generate_prompt`` 共用缓存
+
+    Returns:
+        (positive_prompt, negative_prompt) 元组
+    """
+    variants = await agenerate_prompt_variants(user_req, 1, stream=stream, log_callback=log_callback)
+    return variants[0]
+
+
+async def agenerate_prompts(user_reqs: List[str], stream: bool = False) -> List[Tuple[str, str]]:
+    """并发生成多条提示词，结果顺序与输入一致"""
+    return list(await asyncio.gather(
+        *(agenerate_prompt(req, stream=stream) for req in user_reqs)
+    ))
+
+
+def generate_prompts(user_reqs: List[str]) -> List[Tuple[str, str]]:
+    """同步入口：在后台事件循环中并发生成多条提示词"""
+    return run_sync(agenerate_prompts(user_reqs))
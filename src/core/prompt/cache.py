@@ -0,0 +1,453 @@
+"""
+两级提示词缓存
+
+内存 LRU（条目数有上限）在前，SQLite 持久化存储在后：进程重启后已生成过的
+提示词仍可直接命中，不必重新等待 LLM。条目带有效期（TTL），缓存键包含
+命名空间（provider、模型、系统提示词的哈希），模型或系统提示词变化后旧条目
+自然失效。
+
+每个条目保存一组或多组 (正面, 负面) 提示词：``get``/``put`` 读写单组，
+``get_variants``/``put_variants`` 读写多变体生成的全部结果。
+
+缓存键使用归一化后的用户需求（见 ``similarity.normalize_request``）；
+开启相似度阈值后，近似重复的需求（MinHash 估计的 Jaccard 相似度达到阈值）
+也会复用已缓存的结果。
+
+内存命中的最近使用时间先记在内存里，按 ``TOUCH_INTERVAL`` 节流批量写回
+SQLite，淘汰前总会先写回，常用条目不会因为只在内存中命中而被当作最久未使用。
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from src.core.prompt.similarity import (
+    MinHashIndex,
+    minhash,
+    normalize_request,
+    signature_from_bytes,
+    signature_to_bytes,
+)
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../.."))
+DB_FILE = os.path.join(PROJECT_ROOT, 'data/prompt_cache.db')
+
+PromptPair = Tuple[str, str]
+
+# 内存命中的最近使用时间批量写回 SQLite 的最短间隔（秒）
+TOUCH_INTERVAL = 60.0
+
+
+def cache_namespace(provider: str, model: str, system_prompt: str) -> str:
+    """生成缓存命名空间：任一部分变化都会让旧条目不再命中"""
+    digest = hashlib.sha256(system_prompt.encode('utf-8')).hexdigest()[:16]
+    return f"{provider}:{model}:{digest}"
+
+
+def _cache_key(namespace: str, user_req: str) -> str:
+    return hashlib.sha256(f"{namespace}\x1f{normalize_request(user_req)}".encode('utf-8')).hexdigest()
+
+
+class PromptCache:
+    """内存 LRU + SQLite 的提示词缓存（线程安全）"""
+
+    def __init__(self, db_path: Optional[str] = DB_FILE, max_entries: int = 256,
+                 max_rows: int = 10000, ttl: float = 7 * 24 * 3600, similarity: float = 0.0):
+        """
+        Args:
+            db_path: SQLite 文件路径，None 表示只使用内存
+            max_entries: 内存 LRU 最多保留的条目数
+            max_rows: SQLite 最多保留的条目数（按最近使用淘汰）
+            ttl: 条目有效期（秒），0 表示永不过期
+            similarity: 近似重复命中的相似度阈值（0~1），0 表示只做精确匹配
+        """
+        if db_path and not os.path.isabs(db_path):
+            db_path = os.path.join(PROJECT_ROOT, db_path)
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.ttl = ttl
+        self.similarity = similarity
+
+        self._lock = threading.Lock()
+        # key -> (variants, created_at)
+        self._memory: "OrderedDict[str, Tuple[List[PromptPair], float]]" = OrderedDict()
+        # 尚未写回 SQLite 的内存命中：key -> last_used
+        self._touched: Dict[str, float] = {}
+        self._touched_flushed = time.time()
+        self._stats = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'similar_hits': 0,
+            'misses': 0,
+            'expired': 0,
+            'stores': 0,
+            'evictions': 0,
+        }
+        # 本进程写入过条目的命名空间（内存条目不记录命名空间）
+        self._namespaces = set()
+        self._index: Optional[MinHashIndex] = None
+        if similarity > 0:
+            self._index = MinHashIndex(max_rows if db_path else max_entries)
+
+        if self.db_path:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            self._init_database()
+
+    @contextmanager
+    def get_connection(self):
+        """获取数据库连接的上下文管理器"""
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise e
+        finally:
+            conn.close()
+
+    def _init_database(self):
+        """初始化数据库表结构"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS prompt_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    namespace TEXT NOT NULL,
+                    user_req TEXT NOT NULL,
+                    positive_prompt TEXT NOT NULL,
+                    negative_prompt TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_prompt_cache_last_used
+                ON prompt_cache(last_used)
+            ''')
+
+            # 多变体条目：全部 (正面, 负面) 组的 JSON，单组条目为 NULL
+            columns = [row['name'] for row in cursor.execute('PRAGMA table_info(prompt_cache)')]
+            if 'variants' not in columns:
+                cursor.execute('ALTER TABLE prompt_cache ADD COLUMN variants TEXT')
+            # 相似度索引用的 MinHash 签名
+            if 'minhash' not in columns:
+                cursor.execute('ALTER TABLE prompt_cache ADD COLUMN minhash BLOB')
+
+            # 旧条目的缓存键使用原始需求文本，改为归一化后的文本
+            if cursor.execute('PRAGMA user_version').fetchone()[0] < 1:
+                rows = cursor.execute('SELECT cache_key, namespace, user_req FROM prompt_cache').fetchall()
+                for row in rows:
+                    cursor.execute('UPDATE OR REPLACE prompt_cache SET cache_key = ? WHERE cache_key = ?',
+                                   (_cache_key(row['namespace'], row['user_req']), row['cache_key']))
+                cursor.execute('PRAGMA user_version = 1')
+
+            if self._index is not None:
+                self._load_index(cursor)
+
+    def _load_index(self, cursor):
+        """把最近使用的条目载入相似度索引，缺少签名的条目补算并写回"""
+        rows = cursor.execute('''
+            SELECT cache_key, namespace, user_req, minhash FROM prompt_cache
+            ORDER BY last_used DESC LIMIT ?
+        ''', (self._index.max_entries,)).fetchall()
+        for row in reversed(rows):
+            signature = signature_from_bytes(row['minhash']) if row['minhash'] else None
+            if signature is None:
+                signature = minhash(row['user_req'])
+                cursor.execute('UPDATE prompt_cache SET minhash = ? WHERE cache_key = ?',
+                               (signature_to_bytes(signature), row['cache_key']))
+            self._index.add(row['cache_key'], row['namespace'], signature)
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return bool(self.ttl) and now - created_at > self.ttl
+
+    def get(self, user_req: str, namespace: str = '') -> Optional[PromptPair]:
+        """
+        查找缓存的提示词（先内存后 SQLite，SQLite 命中后回填内存）
+
+        Returns:
+            (positive_prompt, negative_prompt)，未命中或已过期时返回 None
+        """
+        variants = self.get_variants(user_req, namespace)
+        return variants[0] if variants else None
+
+    def get_variants(self, user_req: str, namespace: str = '') -> Optional[List[PromptPair]]:
+        """
+        查找缓存的全部提示词组
+
+        Returns:
+            [(positive_prompt, negative_prompt), ...]，未命中或已过期时返回 None
+        """
+        found = self.lookup(user_req, namespace)
+        return found[0] if found else None
+
+    def lookup(self, user_req: str, namespace: str = '',
+               record_stats: bool = True) -> Optional[Tuple[List[PromptPair], float]]:
+        """
+        先按归一化后的需求精确查找，未命中且开启了相似度阈值时再查近似重复的条目
+
+        Args:
+            record_stats: False 时不计入命中/未命中统计（预取等内部查询）
+
+        Returns:
+            (提示词组, 相似度)，精确命中时相似度为 1.0；未命中时返回 None
+        """
+        now = time.time()
+        key = _cache_key(namespace, user_req)
+        found = self._find(key, now)
+        if found is not None:
+            variants, source = found
+            if record_stats:
+                with self._lock:
+                    self._stats[f'{source}_hits'] += 1
+            self._flush_touched()
+            return variants, 1.0
+
+        if self._index is not None:
+            signature = minhash(user_req)
+            with self._lock:
+                match = self._index.query(namespace, signature, self.similarity)
+            if match is not None:
+                found = self._find(match[0], now)
+                with self._lock:
+                    if found is not None:
+                        if record_stats:
+                            self._stats['similar_hits'] += 1
+                        return found[0], match[1]
+                    # 条目已过期或已被淘汰
+                    self._index.remove(match[0])
+
+        if record_stats:
+            with self._lock:
+                self._stats['misses'] += 1
+        return None
+
+    def contains(self, user_req: str, namespace: str = '') -> bool:
+        """是否已缓存归一化后相同的需求（不计入命中统计，供预取判断）"""
+        return self._find(_cache_key(namespace, user_req), time.time()) is not None
+
+    def has_namespace(self, namespace: str) -> bool:
+        """命名空间中是否有条目（本进程写入过，或 SQLite 中有未过期的条目）"""
+        with self._lock:
+            if namespace in self._namespaces:
+                return True
+        if not self.db_path:
+            return False
+        cutoff = time.time() - self.ttl if self.ttl else 0.0
+        try:
+            with self.get_connection() as conn:
+                row = conn.execute(
+                    'SELECT 1 FROM prompt_cache WHERE namespace = ? AND created_at >= ? LIMIT 1',
+                    (namespace, cutoff),
+                ).fetchone()
+                return row is not None
+        except sqlite3.Error:
+            return False
+
+    def _find(self, key: str, now: float) -> Optional[Tuple[List[PromptPair], str]]:
+        """
+        按缓存键查找（先内存后 SQLite，SQLite 命中后回填内存）
+
+        Returns:
+            (提示词组, 'memory' 或 'disk')，未找到或已过期时返回 None
+        """
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self._expired(entry[1], now):
+                    self._memory.move_to_end(key)
+                    if self.db_path:
+                        self._touched[key] = now
+                    return list(entry[0]), 'memory'
+                del self._memory[key]
+                self._stats['expired'] += 1
+
+        row = None
+        if self.db_path:
+            try:
+                with self.get_connection() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute('''
+                        SELECT positive_prompt, negative_prompt, variants, created_at
+                        FROM prompt_cache WHERE cache_key = ?
+                    ''', (key,))
+                    row = cursor.fetchone()
+                    if row is not None and self._expired(row['created_at'], now):
+                        cursor.execute('DELETE FROM prompt_cache WHERE cache_key = ?', (key,))
+                        with self._lock:
+                            self._stats['expired'] += 1
+                        row = None
+                    elif row is not None:
+                        cursor.execute('''
+                            UPDATE prompt_cache SET last_used = ? WHERE cache_key = ?
+                        ''', (now, key))
+            except sqlite3.Error as exc:
+                print(f"⚠️ 读取提示词缓存失败: {exc}", flush=True)
+                row = None
+
+        if row is None:
+            return None
+        if row['variants']:
+            variants = [tuple(pair) for pair in json.loads(row['variants'])]
+        else:
+            variants = [(row['positive_prompt'], row['negative_prompt'])]
+        with self._lock:
+            self._remember(key, variants, row['created_at'])
+        return list(variants), 'disk'
+
+    def put(self, user_req: str, result: PromptPair, namespace: str = ''):
+        """写入内存和 SQLite，超出上限时淘汰最久未使用的条目"""
+        self.put_variants(user_req, [result], namespace)
+
+    def put_variants(self, user_req: str, variants: List[PromptPair], namespace: str = ''):
+        """写入多组提示词（第一组同时写入正面/负面列）"""
+        if not variants:
+            return
+        key = _cache_key(namespace, user_req)
+        now = time.time()
+        variants = [tuple(pair) for pair in variants]
+        positive_prompt, negative_prompt = variants[0]
+        variants_json = json.dumps(variants, ensure_ascii=False) if len(variants) > 1 else None
+        signature = minhash(user_req) if self._index is not None else None
+
+        with self._lock:
+            self._remember(key, variants, now)
+            self._namespaces.add(namespace)
+            if signature is not None:
+                self._index.add(key, namespace, signature)
+            self._stats['stores'] += 1
+
+        if not self.db_path:
+            return
+        # 按 last_used 淘汰前先写回内存命中的使用时间
+        self.flush()
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT OR REPLACE INTO prompt_cache
+                    (cache_key, namespace, user_req, positive_prompt, negative_prompt, variants,
+                     minhash, created_at, last_used)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (key, namespace, user_req, positive_prompt, negative_prompt, variants_json,
+                      signature_to_bytes(signature) if signature else None, now, now))
+                cursor.execute('''
+                    DELETE FROM prompt_cache WHERE cache_key IN (
+                        SELECT cache_key FROM prompt_cache
+                        ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                    )
+                ''', (self.max_rows,))
+        except sqlite3.Error as exc:
+            print(f"⚠️ 写入提示词缓存失败: {exc}", flush=True)
+
+    def flush(self):
+        """立即把内存命中的最近使用时间写回 SQLite"""
+        self._flush_touched(force=True)
+
+    def _flush_touched(self, force: bool = False):
+        """批量写回内存命中的最近使用时间；未到 TOUCH_INTERVAL 时跳过（force 除外）"""
+        if not self.db_path:
+            return
+        now = time.time()
+        with self._lock:
+            if not self._touched or (not force and now - self._touched_flushed < TOUCH_INTERVAL):
+                return
+            touched = [(last_used, key) for key, last_used in self._touched.items()]
+            self._touched.clear()
+            self._touched_flushed = now
+        try:
+            with self.get_connection() as conn:
+                conn.executemany('UPDATE prompt_cache SET last_used = ? WHERE cache_key = ?', touched)
+        except sqlite3.Error as exc:
+            print(f"⚠️ 写入提示词缓存失败: {exc}", flush=True)
+
+    def _remember(self, key: str, variants: List[PromptPair], created_at: float):
+        """写入内存 LRU（调用方持有锁）"""
+        self._memory[key] = (variants, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            evicted, _ = self._memory.popitem(last=False)
+            self._stats['evictions'] += 1
+            # 只用内存时，被淘汰的条目也不再参与相似查找
+            if not self.db_path and self._index is not None:
+                self._index.remove(evicted)
+
+    def invalidate(self, user_req: Optional[str] = None, namespace: Optional[str] = None) -> int:
+        """
+        使缓存失效
+
+        Args:
+            user_req: 只删除该用户需求的条目（需同时给出 namespace）
+            namespace: 只删除该命名空间的条目；两者都为 None 时清空全部
+
+        Returns:
+            删除的条目数（内存与 SQLite 中较大的一个）
+        """
+        with self._lock:
+            if self._index is not None:
+                if user_req is None and namespace is None:
+                    self._index.clear()
+                elif user_req is not None:
+                    self._index.remove(_cache_key(namespace or '', user_req))
+                else:
+                    self._index.remove_namespace(namespace)
+            if user_req is None and namespace is None:
+                removed = len(self._memory)
+                self._memory.clear()
+                self._touched.clear()
+                self._namespaces.clear()
+            elif user_req is not None:
+                removed = int(self._memory.pop(_cache_key(namespace or '', user_req), None) is not None)
+            else:
+                # 内存条目不记录命名空间，按命名空间失效时整体清空
+                removed = len(self._memory)
+                self._memory.clear()
+                self._namespaces.discard(namespace)
+
+        if not self.db_path:
+            return removed
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            if user_req is None and namespace is None:
+                cursor.execute('DELETE FROM prompt_cache')
+            elif user_req is not None:
+                cursor.execute('DELETE FROM prompt_cache WHERE cache_key = ?',
+                               (_cache_key(namespace or '', user_req),))
+            else:
+                cursor.execute('DELETE FROM prompt_cache WHERE namespace = ?', (namespace,))
+            return max(removed, cursor.rowcount)
+
+    def clear(self) -> int:
+        """清空全部缓存"""
+        return self.invalidate()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._memory)
+
+    def stats(self) -> Dict[str, float]:
+        """命中/未命中计数与当前大小"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memory_entries'] = len(self._memory)
+            if self._index is not None:
+                stats['similar_entries'] = len(self._index)
+        hits = stats['memory_hits'] + stats['disk_hits'] + stats['similar_hits']
+        total = hits + stats['misses']
+        stats['hit_rate'] = round(hits / total, 4) if total else 0.0
+        if self.db_path:
+            try:
+                with self.get_connection() as conn:
+                    stats['disk_entries'] = conn.execute('SELECT COUNT(*) FROM prompt_cache').fetchone()[0]
+            except sqlite3.Error:
+                pass
+        return stats
@@ -1,10 +1,22 @@
-import json
-import os
+import atexit
 from pathlib import Path
+from typing import List
 
-import requests
 from dotenv import load_dotenv
-from openai import OpenAI
+
+from src.core.prompt.cache import DB_FILE as PROMPT_CACHE_DB, PromptCache, cache_namespace
+from src.core.prompt.providers import (  # noqa: F401 (re-exported)
+    CancelEvent,
+    PromptCancelledError,
+    ProviderUnavailableError,
+    check_cancelled,
+    get_provider,
+)
+from src.core.prompt.router import get_router
+from src.core.prompt.similarity import normalize_request
+from src.core.prompt.singleflight import Flight, SingleFlight
+from src.core.prompt.tags import PromptTagParser, parse_tags
+from src.utils.env import env_bool, env_float, env_int
 
 PROJECT_ROOT = Path(__file__).resolve().parents[3]
 
@@ -17,6 +29,7 @@ def _load_env():
 
 _load_env()
 
+
 def chat_with_ollama(model_name, prompt, stream=False):
     """
     Call Ollama API to chat with a model
@@ -29,79 +42,30 @@ def chat_with_ollama(model_name, prompt, stream=False):
     Returns:
         The model's response
     """
-    url = "http://localhost:11434/api/generate"
-
-    payload = {
-        "model": model_name,
-        "prompt": prompt,
-        "stream": stream
-    }
+    return get_provider('ollama', model_name).generate(prompt, stream=stream)
 
-    response = requests.post(url, json=payload)
 
-    if stream:
-        # Handle streaming response
-        full_response = ""
-        for line in response.iter_lines():
-            if line:
-                json_response = json.loads(line)
-                if 'response' in json_response:
-                    chunk = json_response['response']
-                    print(chunk, end='', flush=True)
-                    full_response += chunk
-        print()  # New line at the end
-        return full_response
-    else:
-        # Handle non-streaming response
-        result = response.json()
-        return result.get('response', '')
-
-
-def chat_conversation(model_name, messages, stream=False, callback=None):
+def chat_conversation(model_name, messages, stream=False, callback=None, cancel_event=None, stop_when=None):
     """
-    Have a conversation using the chat endpoint
+    Have a conversation using the chat endpoint (``OLLAMA_URL``)
 
     Args:
         model_name: Name of the model
         messages: List of message dicts with 'role' and 'content'
         stream: Whether to stream the response
         callback: Function to call for each chunk (only used when stream=True)
+        cancel_event: threading.Event that aborts the stream when set
+        stop_when: Called with each chunk; closes the stream once it returns True
 
     Returns:
         The assistant's response
     """
-    url = "http://localhost:11434/api/chat"
-
-    payload = {
-        "model": model_name,
-        "messages": messages,
-        "stream": stream
-    }
-
-    response = requests.post(url, json=payload, stream=stream)
-
-    if stream:
-        # Handle streaming response
-        full_response = ""
-        for line in response.iter_lines():
-            if line:
-                json_response = json.loads(line)
-                if 'message' in json_response and 'content' in json_response['message']:
-                    chunk = json_response['message']['content']
-                    full_response += chunk
-                    if callback:
-                        callback(chunk)
-                    else:
-                        print(chunk, end='', flush=True)
-        if not callback:
-            print()  # New line at the end
-        return full_response
-    else:
-        result = response.json()
-        return result.get('message', {}).get('content', '')
+    return get_provider('ollama', model_name).chat(
+        messages, stream=stream, callback=callback, cancel_event=cancel_event, stop_when=stop_when
+    )
 
 
-def chat_with_gemini(messages, stream=False, callback=None):
+def chat_with_gemini(messages, stream=False, callback=None, cancel_event=None, stop_when=None):
     """
     Have a conversation using Gemini API via OpenAI-compatible endpoint
 
@@ -109,80 +73,29 @@ def chat_with_gemini(messages, stream=False, callback=None):
         messages: List of message dicts with 'role' and 'content'
         stream: Whether to stream the response
         callback: Function to call for each chunk (only used when stream=True)
+        cancel_event: threading.Event that aborts the stream when set
+        stop_when: Called with each chunk; closes the stream once it returns True
 
     Returns:
         The assistant's response
     """
-    api_key = os.getenv('GEMINI_API_KEY')
-    model_name = os.getenv('GEMINI_MODEL', 'gemini-2.0-flash-exp')
-    base_url = os.getenv('GEMINI_BASE_URL', 'https://api.laozhang.ai/v1/')
-
-    client = OpenAI(
-        api_key=api_key,
-        base_url=base_url
+    return get_provider('gemini').chat(
+        messages, stream=stream, callback=callback, cancel_event=cancel_event, stop_when=stop_when
     )
 
-    try:
-        response = client.chat.completions.create(
-            model=model_name,
-            messages=messages,
-            stream=stream
-        )
-
-        if stream:
-            full_response = ""
-            for chunk in response:
-                if chunk.choices[0].delta.content:
-                    content = chunk.choices[0].delta.content
-                    full_response += content
-                    if callback:
-                        callback(content)
-                    else:
-                        print(content, end='', flush=True)
-            if not callback:
-                print()  # New line at the end
-            return full_response
-        else:
-            return response.choices[0].message.content
-    except Exception as e:
-        print(f"❌ Gemini API 错误: {str(e)}", flush=True)
-        raise
-
-# 提示词缓存
-_prompt_cache = {}
-
-def generate_prompt(user_req: str, stream=False, log_callback=None):
-    """
-    生成提示词，带缓存机制
-
-    Args:
-        user_req: 用户需求描述
-        stream: 是否使用流式输出
-        log_callback: 日志回调函数，用于实时输出日志
-
-    Returns:
-        (positive_prompt, negative_prompt) 元组
-    """
-    def log(msg):
-        """统一的日志输出函数"""
-        print(msg, flush=True)
-        if log_callback:
-            log_callback(msg)
-
-    # 检查缓存
-    if user_req in _prompt_cache:
-        log(f"✅ 使用缓存的提示词（用户需求: {user_req[:30]}...）")
-        return _prompt_cache[user_req]
-
-    # 获取 AI Provider 配置
-    provider = os.getenv('AI_PROVIDER', 'ollama').lower()
-    log(f"🤖 使用 AI Provider: {provider}")
-
-    # 生成新的提示词
-    log(f"🔄 生成新的提示词（用户需求: {user_req[:30]}...）")
-
-    messages = [
-        {"role": "system", "content": """
+# 提示词缓存：内存 LRU + SQLite（data/prompt_cache.db），重启后仍可命中
+_prompt_cache = PromptCache(
+    db_path=PROMPT_CACHE_DB if env_bool('PROMPT_CACHE_PERSIST', True) else None,
+    max_entries=env_int('PROMPT_CACHE_SIZE', 256),
+    max_rows=env_int('PROMPT_CACHE_DB_SIZE', 10000),
+    ttl=env_float('PROMPT_CACHE_TTL', 7 * 24 * 3600),
+    similarity=env_float('PROMPT_CACHE_SIMILARITY', 0.0),
+)
+# 退出前写回尚未落盘的最近使用时间
+atexit.register(_prompt_cache.flush)
+
+# 提示词生成的系统提示词
+SYSTEM_PROMPT = """
 # role
 你是一个comfyui的提示词设计大师，专门帮助用户设计符合comfyui要求的提示词
 
@@ -266,49 +179,287 @@ score_4, score_5, score_6, worst quality, low quality, normal quality, source_an
 # 返回样例
 <positive_prompt>正面提示词</positive_prompt>
 <negative_prompt>负面提示词</negative_prompt>
-"""},
+"""
+
+
+# 多变体模式：一次请求让模型给出多组提示词，追加在用户需求之后
+VARIANT_INSTRUCTION = """
+
+# 多组输出
+请针对上面的需求给出 {count} 组不同的提示词：每组都必须满足需求，但在构图、视角、姿势、服饰、环境或光线等细节上互不相同。
+按顺序输出 {count} 组，每组都包含一对 <positive_prompt></positive_prompt><negative_prompt></negative_prompt>。
+"""
+
+# 单次请求最多的变体数（输出越长，首张图等待越久）
+MAX_PROMPT_VARIANTS = 8
+
+
+# 进行中的提示词生成（(缓存命名空间, 归一化后的用户需求) -> Flight）
+_inflight = SingleFlight()
+
+
+def prompt_cache_namespace(variants: int = 1):
+    """当前 provider、模型和系统提示词对应的缓存命名空间（多变体结果单独存放）"""
+    providers = get_router().providers
+    names = '+'.join(sorted({provider.name for provider in providers}))
+    models = '+'.join(sorted({provider.model for provider in providers}))
+    namespace = cache_namespace(names, models, SYSTEM_PROMPT)
+    return f"{namespace}:x{variants}" if variants > 1 else namespace
+
+
+def default_variant_count():
+    """开启多变体模式时每次请求的变体数（PROMPT_VARIANTS，1~MAX_PROMPT_VARIANTS）"""
+    return max(1, min(env_int('PROMPT_VARIANTS', 4), MAX_PROMPT_VARIANTS))
+
+
+def build_messages(user_req: str, variants: int = 1):
+    """构造提示词生成的对话消息（variants > 1 时要求模型输出多组）"""
+    content = user_req
+    if variants > 1:
+        content += VARIANT_INSTRUCTION.format(count=variants)
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": content},
     ]
-    messages.append({"role": "user", "content": user_req})
 
-    # 定义流式回调函数
-    stream_buffer = []
+
+def parse_prompt_response(response: str):
+    """
+    从 AI 回复中解析正面/负面提示词（忽略 <think> 中的内容）
+
+    Returns:
+        (positive_prompt, negative_prompt) 元组
+    """
+    return parse_tags(response)[0]
+
+
+def parse_prompt_variants(response: str, count: int = MAX_PROMPT_VARIANTS):
+    """
+    从多变体回复中按顺序解析最多 count 组 (正面, 负面) 提示词
+
+    <think> 中的内容会被忽略；某组缺少负面提示词时沿用前一组的负面提示词。
+
+    Returns:
+        [(positive_prompt, negative_prompt), ...]
+
+    Raises:
+        ValueError: 回复中没有任何正面提示词
+    """
+    return parse_tags(response, count)
+
+
+def generate_prompt(user_req: str, stream=False, log_callback=None, cancel_event=None, reset_callback=None):
+    """
+    生成提示词，带缓存机制
+
+    Args:
+        user_req: 用户需求描述
+        stream: 是否使用流式输出
+        log_callback: 日志回调函数，用于实时输出日志
+        cancel_event: threading.Event，触发后中止正在进行的流式生成（CancelEvent 可中止还在等待首个片段的请求）
+        reset_callback: 切换 LLM 端点重新生成时调用，参数为需要撤回的已输出片段
+
+    Returns:
+        (positive_prompt, negative_prompt) 元组
+
+    Raises:
+        PromptCancelledError: 生成过程中 cancel_event 被触发
+    """
+    return generate_prompt_variants(user_req, 1, stream=stream, log_callback=log_callback,
+                                    cancel_event=cancel_event, reset_callback=reset_callback)[0]
+
+
+def generate_prompt_variants(user_req: str, count: int, stream=False, log_callback=None, cancel_event=None,
+                             reset_callback=None, record_stats=True):
+    """
+    一次 LLM 调用生成 count 组提示词，带缓存机制
+
+    Args:
+        user_req: 用户需求描述
+        count: 变体数量（1 与 generate_prompt 相同）
+        stream: 是否使用流式输出
+        log_callback: 日志回调函数，用于实时输出日志
+        cancel_event: threading.Event，触发后中止正在进行的流式生成（CancelEvent 可中止还在等待首个片段的请求）
+        reset_callback: 切换 LLM 端点重新生成时调用，参数为需要撤回的已输出片段
+                        （未提供时只在控制台换行）
+        record_stats: False 时查缓存不计入命中统计（空闲预取）
+
+    Returns:
+        [(positive_prompt, negative_prompt), ...]；模型给出的组数可能少于 count
+
+    Raises:
+        PromptCancelledError: 生成过程中 cancel_event 被触发
+    """
+    def log(msg):
+        """统一的日志输出函数"""
+        print(msg, flush=True)
+        if log_callback:
+            log_callback(msg)
+
+    count = max(1, min(count, MAX_PROMPT_VARIANTS))
+
     def stream_callback(chunk):
         """处理流式输出的每个chunk"""
-        stream_buffer.append(chunk)
         if log_callback:
             log_callback(chunk)
         else:
             print(chunk, end='', flush=True)
 
-    # 根据 provider 调用不同的 API
+    def withdraw(discarded):
+        """撤回已输出的流式片段"""
+        if reset_callback:
+            reset_callback(discarded)
+        elif not log_callback:
+            print()  # 控制台无法撤回，换行后重新输出
+
+    namespace = prompt_cache_namespace(count)
+    while True:
+        # 检查缓存
+        found = _prompt_cache.lookup(user_req, namespace, record_stats=record_stats)
+        if found:
+            cached, score = found
+            if score < 1.0:
+                log(f"✅ 使用相似需求的缓存提示词（相似度 {score:.2f}，用户需求: {user_req[:30]}...）")
+            else:
+                log(f"✅ 使用缓存的提示词（用户需求: {user_req[:30]}...）")
+            return cached
+
+        # 相同需求正在生成时加入那一次请求，不再重复调用 LLM
+        key = (namespace, normalize_request(user_req))
+        flight, leader = _inflight.join(key)
+        if leader:
+            break
+        variants = _await_flight(flight, stream, stream_callback, withdraw, log, cancel_event)
+        if stream and not log_callback:
+            print()  # 换行
+        if variants is not None:
+            return variants
+        # 发起者被取消了，重新检查缓存或自己发起请求
+
+    try:
+        variants = _expand(user_req, count, namespace, stream, log, log_callback, stream_callback, withdraw,
+                           flight, cancel_event)
+    except BaseException as exc:
+        _inflight.finish(key, flight, error=exc)
+        raise
+    _inflight.finish(key, flight, result=variants)
+    return variants
+
+
+def _expand(user_req, count, namespace, stream, log, log_callback, stream_callback, withdraw, flight: Flight,
+            cancel_event):
+    """缓存未命中时调用 LLM 生成提示词，流式片段同时转发给 flight 的等待者"""
+    # 获取 LLM 路由器（长连接客户端，配置不变时复用；多个端点时按速度选择并自动切换）
+    router = get_router()
+    log(f"🤖 使用 AI Provider: {'+'.join(provider.name for provider in router.providers)}")
+
+    # 生成新的提示词
+    if count > 1:
+        log(f"🔄 生成 {count} 组提示词变体（用户需求: {user_req[:30]}...）")
+    else:
+        log(f"🔄 生成新的提示词（用户需求: {user_req[:30]}...）")
+
+    messages = build_messages(user_req, count)
+
+    streamed: List[str] = []
+
+    def fan_out(chunk):
+        streamed.append(chunk)
+        stream_callback(chunk)
+        flight.publish(chunk)
+
+    # 流式读取时边收边解析，所需的标签闭合后立即结束
+    parser = PromptTagParser(count)
+    stop_when = parser.feed if stream else None
+
+    def on_failover():
+        """端点中途出错：丢弃解析状态，并撤回该端点已输出的片段（本调用方和等待者）"""
+        parser.reset()
+        discarded = ''.join(streamed)
+        streamed.clear()
+        flight.reset()
+        if discarded:
+            withdraw(discarded)
+            log("⚠️ LLM 端点中途出错，已撤回部分输出，切换端点重新生成...")
+
     log(f"📡 开始调用 AI 生成提示词...")
-    if provider == 'gemini':
-        response = chat_with_gemini(messages, stream=stream, callback=stream_callback if stream else None)
-    else:  # default to ollama
-        model = os.getenv('OLLAMA_MODEL', 'huihui_ai/qwen3-abliterated:30b')
-        response = chat_conversation(model, messages, stream=stream, callback=stream_callback if stream else None)
+    response = router.chat(messages, stream=stream, callback=fan_out if stream else None,
+                           cancel_event=cancel_event, stop_when=stop_when, on_failover=on_failover)
+    check_cancelled(cancel_event)
 
     if stream and not log_callback:
         print()  # 换行
 
     log(f"✅ AI 生成完成，开始解析提示词...")
 
-    positive_prompt = response.split("<positive_prompt>")[1].split("</positive_prompt>")[0]
-    negative_prompt = response.split("<negative_prompt>")[1].split("</negative_prompt>")[0]
+    if not stream:
+        parser.feed(response)
+    variants = parser.variants()
+    if len(variants) < count:
+        log(f"⚠️ 只解析到 {len(variants)}/{count} 组提示词，轮换使用已有的组")
 
     # 缓存结果
-    _prompt_cache[user_req] = (positive_prompt, negative_prompt)
+    _prompt_cache.put_variants(user_req, variants, namespace)
     log(f"💾 提示词已缓存，缓存数量: {len(_prompt_cache)}")
 
-    return positive_prompt, negative_prompt
+    return variants
+
+
+def _await_flight(flight: Flight, stream, stream_callback, withdraw, log, cancel_event):
+    """
+    等待进行中的相同请求，流式输出时先补发已收到的片段再接收后续片段
+
+    Returns:
+        发起者的结果；发起者被取消时返回 None，由调用方重试
+
+    Raises:
+        PromptCancelledError: 本调用方的 cancel_event 被触发（不影响发起者）
+        发起者的异常: 发起者生成失败
+    """
+    log(f"⏳ 相同需求的提示词正在生成，等待共享结果...")
+    if stream:
+        flight.subscribe(stream_callback, on_reset=withdraw)
+    try:
+        finished = flight.wait(cancel_event)
+    finally:
+        if stream:
+            flight.unsubscribe(stream_callback)
+        flight.leave()
+    if not finished:
+        check_cancelled(cancel_event)
+    if isinstance(flight.error, PromptCancelledError):
+        return None
+    if flight.error is not None:
+        raise flight.error
+    log(f"✅ 共享了进行中的提示词生成结果")
+    return list(flight.result)
+
+
+def is_prompt_cached(user_req: str, count: int = 1) -> bool:
+    """该需求的提示词是否已在缓存中（不计入命中统计）"""
+    count = max(1, min(count, MAX_PROMPT_VARIANTS))
+    return _prompt_cache.contains(user_req, prompt_cache_namespace(count))
+
+
+def has_cached_variants(count: int) -> bool:
+    """缓存中是否有 count 组的多变体结果（即用过多变体模式，且结果尚未过期）"""
+    count = max(1, min(count, MAX_PROMPT_VARIANTS))
+    return _prompt_cache.has_namespace(prompt_cache_namespace(count))
+
 
 def clear_cache():
-    """清空提示词缓存"""
-    global _prompt_cache
-    cache_size = len(_prompt_cache)
-    _prompt_cache = {}
+    """清空提示词缓存（内存和 SQLite）"""
+    cache_size = _prompt_cache.clear()
     print(f"🗑️ 已清空提示词缓存，清除了 {cache_size} 条记录", flush=True)
     return cache_size
+
+
+def get_cache_stats():
+    """提示词缓存的命中/未命中统计，以及合并的并发请求数"""
+    stats = _prompt_cache.stats()
+    stats['inflight'] = len(_inflight)
+    stats['coalesced'] = _inflight.coalesced
+    return stats
 if __name__ == "__main__":
     positive_prompt, negative_prompt = generate_prompt(
         "xxxxxxxxxxxxxxxxxxxxxxx",
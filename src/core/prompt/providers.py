@@ -0,0 +1,446 @@
+"""
+LLM Provider 层
+
+``generate_prompt`` 通过 ``get_provider()`` 取得当前 AI_PROVIDER 对应的
+provider。每个 provider 持有长连接客户端（Ollama 使用带连接池的
+``requests.Session``，Gemini 复用一个 ``OpenAI`` 客户端），热请求不再重复建立
+连接和 TLS 握手；地址、模型和超时都来自环境变量。连续失败的 provider
+触发熔断，冷却期内直接失败，不再让每个任务都等到超时。
+"""
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+import requests
+from openai import OpenAI, Timeout
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from src.utils.env import env_float, env_int
+
+DEFAULT_OLLAMA_URL = 'http://localhost:11434'
+DEFAULT_OLLAMA_MODEL = 'huihui_ai/qwen3-abliterated:30b'
+DEFAULT_GEMINI_MODEL = 'gemini-2.0-flash-exp'
+DEFAULT_GEMINI_BASE_URL = 'https://api.laozhang.ai/v1/'
+
+
+class PromptCancelledError(RuntimeError):
+    """提示词生成被取消时抛出"""
+
+
+class CancelEvent(threading.Event):
+    """
+    可注册取消回调的 threading.Event
+
+    ``set()`` 时立即调用已注册的回调，用来关闭还没收到第一个片段的连接，
+    不必等到下一个片段或读取超时才发现已取消。
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._callbacks_lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """注册取消回调（已取消时立即调用），返回注销函数"""
+        with self._callbacks_lock:
+            if not self.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._remove(callback)
+        callback()
+        return lambda: None
+
+    def _remove(self, callback):
+        with self._callbacks_lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def set(self):
+        with self._callbacks_lock:
+            super().set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as exc:
+                print(f"⚠️ 取消回调出错: {exc}", flush=True)
+
+
+class ProviderUnavailableError(RuntimeError):
+    """provider 熔断中（连续失败后的冷却期）时抛出"""
+
+
+def check_cancelled(cancel_event, response=None):
+    """取消事件已触发时关闭流式响应（让服务端停止生成）并抛出异常"""
+    if cancel_event is not None and cancel_event.is_set():
+        if response is not None:
+            response.close()
+        raise PromptCancelledError("提示词生成已取消")
+
+
+@contextmanager
+def _close_on_cancel(cancel_event, response):
+    """请求期间在 CancelEvent 上登记 response.close，停止时立即断开连接"""
+    register = getattr(cancel_event, 'on_cancel', None)
+    unregister = register(response.close) if register else None
+    try:
+        check_cancelled(cancel_event, response)
+        yield
+    finally:
+        if unregister:
+            unregister()
+
+
+def _should_stop(stop_when, chunk, response):
+    """stop_when 判定回复已足够时关闭流式响应，让服务端停止生成"""
+    if stop_when is not None and stop_when(chunk):
+        response.close()
+        print("⏹️ 提示词标签已完整，提前结束 LLM 输出", flush=True)
+        return True
+    return False
+
+
+def provider_timeouts(name: str):
+    """
+    provider 的 (连接超时, 读取超时)
+
+    优先读取 ``<NAME>_CONNECT_TIMEOUT`` / ``<NAME>_READ_TIMEOUT``，
+    其次是通用的 ``LLM_CONNECT_TIMEOUT`` / ``LLM_READ_TIMEOUT``。
+    """
+    prefix = name.upper()
+    connect = env_float(f'{prefix}_CONNECT_TIMEOUT', env_float('LLM_CONNECT_TIMEOUT', 5.0))
+    read = env_float(f'{prefix}_READ_TIMEOUT', env_float('LLM_READ_TIMEOUT', 120.0))
+    return connect, read
+
+
+class CircuitBreaker:
+    """连续失败 max_failures 次后打开，cooldown 秒后放行一次试探请求"""
+
+    def __init__(self, name: str, max_failures: int = 3, cooldown: float = 30.0):
+        self.name = name
+        self.max_failures = max(1, max_failures)
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        """熔断未打开或冷却已结束（不占用试探请求的名额）"""
+        with self._lock:
+            return self.failures < self.max_failures or time.monotonic() >= self.opened_until
+
+    def allow(self) -> bool:
+        """是否允许发起请求（冷却结束后的试探请求失败会重新打开熔断）"""
+        with self._lock:
+            if self.failures < self.max_failures:
+                return True
+            now = time.monotonic()
+            if now < self.opened_until:
+                return False
+            # 半开：放行一个请求，其余请求在它结束前继续被拒绝
+            self.opened_until = now + self.cooldown
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self.failures >= self.max_failures:
+                print(f"✅ LLM provider 已恢复: {self.name}", flush=True)
+            self.failures = 0
+            self.opened_until = 0.0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.max_failures:
+                if self.failures == self.max_failures:
+                    print(f"⚠️ LLM provider 连续失败 {self.failures} 次，熔断 {self.cooldown:g} 秒: {self.name}",
+                          flush=True)
+                self.opened_until = time.monotonic() + self.cooldown
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._lock:
+            is_open = self.failures >= self.max_failures and time.monotonic() < self.opened_until
+            return {'name': self.name, 'failures': self.failures, 'open': is_open}
+
+
+class LLMProvider(ABC):
+    """provider 基类：熔断检查、失败计数，具体请求由子类实现"""
+
+    name = ''
+
+    def __init__(self, model: str, breaker: Optional[CircuitBreaker] = None):
+        self.model = model
+        self.connect_timeout, self.read_timeout = provider_timeouts(self.name)
+        self.breaker = breaker or CircuitBreaker(
+            self.name,
+            max_failures=env_int('LLM_MAX_FAILURES', 3),
+            cooldown=env_float('LLM_COOLDOWN', 30.0),
+        )
+
+    def chat(self, messages: List[Dict], stream: bool = False,
+             callback: Optional[Callable[[str], None]] = None, cancel_event=None,
+             stop_when: Optional[Callable[[str], bool]] = None) -> str:
+        """
+        发送对话并返回完整回复
+
+        Args:
+            messages: 对话消息列表
+            stream: 是否流式读取
+            callback: 每个流式片段的回调（仅 stream=True 时使用；None 时打印到控制台）
+            cancel_event: threading.Event，触发后中止流式读取；传入 CancelEvent 时
+                请求在后台线程中进行，取消后立即返回（包括还在等待第一个片段时）
+            stop_when: 以每个片段调用，返回 True 时关闭连接并结束读取
+
+        Raises:
+            ProviderUnavailableError: provider 熔断中
+            PromptCancelledError: cancel_event 被触发
+        """
+        if not self.breaker.allow():
+            raise ProviderUnavailableError(f"LLM provider {self.name} 暂时不可用（熔断中）")
+        try:
+            result = self._request(messages, stream, callback, cancel_event, stop_when)
+        except PromptCancelledError:
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        return result
+
+    def generate(self, prompt: str, stream: bool = False) -> str:
+        """单轮补全：以一条用户消息调用 ``chat``（流式时打印到控制台）"""
+        return self.chat([{"role": "user", "content": prompt}], stream=stream)
+
+    def _request(self, messages, stream, callback, cancel_event, stop_when) -> str:
+        """调用 ``_chat``；cancel_event 支持 on_cancel 时在后台线程中等待，取消即返回"""
+        if not hasattr(cancel_event, 'on_cancel'):
+            return self._chat(messages, stream, callback, cancel_event, stop_when)
+
+        outcome = {}
+        done = threading.Event()
+
+        def run():
+            try:
+                outcome['result'] = self._chat(messages, stream, callback, cancel_event, stop_when)
+            except BaseException as exc:
+                outcome['error'] = exc
+            finally:
+                done.set()
+
+        unregister = cancel_event.on_cancel(done.set)
+        try:
+            threading.Thread(target=run, name='llm-request', daemon=True).start()
+            done.wait()
+        finally:
+            unregister()
+        # 已取消时丢弃后台线程的结果或错误（关闭连接引发的错误不算 provider 故障）；
+        # 后台线程在连接被关闭（或超时）后自行结束
+        check_cancelled(cancel_event)
+        if 'error' in outcome:
+            raise outcome['error']
+        return outcome['result']
+
+    @abstractmethod
+    def _chat(self, messages, stream, callback, cancel_event, stop_when) -> str:
+        """发送一次请求并返回完整回复（参数同 ``chat``）"""
+
+    def close(self):
+        """释放连接池"""
+
+
+class OllamaProvider(LLMProvider):
+    """Ollama：共享带连接池的 requests.Session"""
+
+    name = 'ollama'
+
+    def __init__(self, base_url: str, model: str, pool_size: int = 4,
+                 max_retries: int = 2, breaker: Optional[CircuitBreaker] = None):
+        super().__init__(model, breaker)
+        self.base_url = base_url.rstrip('/')
+        # 只重试连接错误：请求尚未发出，重试不会让模型重复生成
+        retry = Retry(total=max_retries, connect=max_retries, read=0, status=0,
+                      backoff_factor=0.5, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @property
+    def timeout(self):
+        return self.connect_timeout, self.read_timeout
+
+    def _chat(self, messages, stream, callback, cancel_event, stop_when) -> str:
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "stream": stream
+        }
+        response = self.session.post(f"{self.base_url}/api/chat", json=payload,
+                                     stream=stream, timeout=self.timeout)
+        response.raise_for_status()
+
+        if not stream:
+            return response.json().get('message', {}).get('content', '')
+
+        chunks = []
+        with response, _close_on_cancel(cancel_event, response):
+            for line in response.iter_lines():
+                check_cancelled(cancel_event, response)
+                if not line:
+                    continue
+                json_response = json.loads(line)
+                if 'message' in json_response and 'content' in json_response['message']:
+                    chunk = json_response['message']['content']
+                    chunks.append(chunk)
+                    if callback:
+                        callback(chunk)
+                    else:
+                        print(chunk, end='', flush=True)
+                    if _should_stop(stop_when, chunk, response):
+                        break
+        if not callback:
+            print()  # New line at the end
+        return ''.join(chunks)
+
+    def close(self):
+        self.session.close()
+
+
+class GeminiProvider(LLMProvider):
+    """Gemini（OpenAI 兼容接口）：复用一个 OpenAI 客户端及其连接池"""
+
+    name = 'gemini'
+
+    def __init__(self, base_url: str, api_key: Optional[str], model: str,
+                 max_retries: int = 2, breaker: Optional[CircuitBreaker] = None):
+        super().__init__(model, breaker)
+        self.base_url = base_url
+        self.api_key = api_key
+        self.max_retries = max_retries
+        self._client: Optional[OpenAI] = None
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self) -> OpenAI:
+        """首次请求时创建客户端（缺少 API key 时在请求时报错，而不是在读取配置时）"""
+        with self._client_lock:
+            if self._client is None:
+                self._client = OpenAI(
+                    api_key=self.api_key,
+                    base_url=self.base_url,
+                    timeout=Timeout(self.read_timeout, connect=self.connect_timeout),
+                    max_retries=self.max_retries,
+                )
+            return self._client
+
+    def _chat(self, messages, stream, callback, cancel_event, stop_when) -> str:
+        try:
+            response = self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                stream=stream
+            )
+
+            if not stream:
+                return response.choices[0].message.content
+
+            chunks = []
+            with _close_on_cancel(cancel_event, response):
+                for chunk in response:
+                    check_cancelled(cancel_event, response)
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        content = chunk.choices[0].delta.content
+                        chunks.append(content)
+                        if callback:
+                            callback(content)
+                        else:
+                            print(content, end='', flush=True)
+                        if _should_stop(stop_when, content, response):
+                            break
+            if not callback:
+                print()  # New line at the end
+            return ''.join(chunks)
+        except PromptCancelledError:
+            raise
+        except Exception as e:
+            # 停止时连接被主动关闭，不是 API 错误
+            check_cancelled(cancel_event)
+            print(f"❌ Gemini API 错误: {str(e)}", flush=True)
+            raise
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+
+
+# 配置 -> provider；熔断状态按 provider 名称和地址保留，模型或超时变化不会重置它
+_providers: Dict[tuple, LLMProvider] = {}
+_breakers: Dict[tuple, CircuitBreaker] = {}
+_lock = threading.Lock()
+
+
+def provider_name() -> str:
+    """当前配置的 AI_PROVIDER（ollama / gemini）"""
+    return os.getenv('AI_PROVIDER', 'ollama').lower()
+
+
+def get_provider(name: Optional[str] = None, model: Optional[str] = None,
+                 base_url: Optional[str] = None) -> LLMProvider:
+    """
+    获取（必要时创建）provider，配置不变时返回同一个实例
+
+    Args:
+        name: provider 名称，默认读取 AI_PROVIDER
+        model: 覆盖环境变量中的模型名称
+        base_url: 覆盖环境变量中的地址（OLLAMA_URL / GEMINI_BASE_URL）
+    """
+    name = (name or provider_name()).lower()
+    retries = env_int('LLM_MAX_RETRIES', 2)
+    if name == 'gemini':
+        base_url = base_url or os.getenv('GEMINI_BASE_URL', DEFAULT_GEMINI_BASE_URL)
+        api_key = os.getenv('GEMINI_API_KEY')
+        model = model or os.getenv('GEMINI_MODEL', DEFAULT_GEMINI_MODEL)
+        key = (name, base_url, api_key, model, provider_timeouts(name), retries)
+    else:
+        name = 'ollama'
+        base_url = (base_url or os.getenv('OLLAMA_URL', DEFAULT_OLLAMA_URL)).rstrip('/')
+        api_key = None
+        model = model or os.getenv('OLLAMA_MODEL', DEFAULT_OLLAMA_MODEL)
+        key = (name, base_url, model, provider_timeouts(name), retries, env_int('LLM_POOL_SIZE', 4))
+
+    with _lock:
+        provider = _providers.get(key)
+        if provider is not None:
+            return provider
+        breaker = _breakers.setdefault((name, base_url), CircuitBreaker(
+            f"{name}@{base_url}",
+            max_failures=env_int('LLM_MAX_FAILURES', 3),
+            cooldown=env_float('LLM_COOLDOWN', 30.0),
+        ))
+        if name == 'gemini':
+            provider = GeminiProvider(base_url, api_key, model, max_retries=retries, breaker=breaker)
+        else:
+            provider = OllamaProvider(base_url, model, pool_size=env_int('LLM_POOL_SIZE', 4),
+                                      max_retries=retries, breaker=breaker)
+        _providers[key] = provider
+        return provider
+
+
+def provider_status() -> List[Dict[str, object]]:
+    """全部 provider 的熔断状态"""
+    with _lock:
+        return [breaker.snapshot() for breaker in _breakers.values()]
+
+
+def close_providers():
+    """关闭全部 provider 的连接池"""
+    with _lock:
+        providers = list(_providers.values())
+        _providers.clear()
+    for provider in providers:
+        provider.close()
@@ -0,0 +1,204 @@
+"""
+多端点 LLM 路由
+
+``LLM_ENDPOINTS`` 配置多个 LLM 端点（逗号分隔，``ollama=http://gpu1:11434``、
+``gemini`` 等；未配置时只有 AI_PROVIDER 对应的一个端点）。路由器为每个端点
+维护首 token 延迟（TTFT）和输出速度（tokens/s）的指数移动平均，每次请求按
+预计耗时从快到慢尝试健康的端点；端点在请求中途出错时切换到下一个端点重新
+生成，生成 worker 不会因为单个端点变慢或宕机而停住。
+"""
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from src.core.prompt.providers import (
+    LLMProvider,
+    PromptCancelledError,
+    ProviderUnavailableError,
+    get_provider,
+    provider_name,
+)
+from src.utils.env import env_float, env_list
+
+
+class EndpointStats:
+    """一个端点的延迟/吞吐统计"""
+
+    def __init__(self):
+        self.ttft: Optional[float] = None  # 首 token 延迟 EMA（秒）
+        self.tps: Optional[float] = None   # 输出速度 EMA（片段/秒）
+        self.requests = 0
+        self.errors = 0
+        self.failovers = 0
+
+    def update(self, alpha: float, ttft: Optional[float], tps: Optional[float]):
+        if ttft is not None:
+            self.ttft = ttft if self.ttft is None else alpha * ttft + (1 - alpha) * self.ttft
+        if tps is not None:
+            self.tps = tps if self.tps is None else alpha * tps + (1 - alpha) * self.tps
+
+
+class LLMRouter:
+    """按预计耗时在多个 LLM 端点之间选择，出错时切换端点"""
+
+    def __init__(self, providers: List[LLMProvider], alpha: float = 0.3,
+                 expected_tokens: float = 400):
+        """
+        Args:
+            providers: 候选端点，排在前面的在没有统计数据时优先
+            alpha: EMA 平滑系数，越大越偏向最近的请求
+            expected_tokens: 估算耗时用的回复长度（TTFT + expected_tokens / tps）
+        """
+        if not providers:
+            raise ValueError("至少需要一个 LLM 端点")
+        self.providers = providers
+        self.alpha = alpha
+        self.expected_tokens = expected_tokens
+        self._stats: Dict[int, EndpointStats] = {id(p): EndpointStats() for p in providers}
+        self._lock = threading.Lock()
+
+    @property
+    def primary(self) -> LLMProvider:
+        return self.providers[0]
+
+    def _estimate(self, provider: LLMProvider) -> float:
+        """预计耗时；没有数据的端点返回 0，让它先被试用"""
+        stats = self._stats[id(provider)]
+        if stats.ttft is None:
+            return 0.0
+        estimate = stats.ttft
+        if stats.tps:
+            estimate += self.expected_tokens / stats.tps
+        return estimate
+
+    def candidates(self) -> List[LLMProvider]:
+        """健康端点按预计耗时排序，熔断中的端点排在最后（全部熔断时仍会尝试）"""
+        with self._lock:
+            order = {id(p): index for index, p in enumerate(self.providers)}
+            return sorted(
+                self.providers,
+                key=lambda p: (not p.breaker.available, self._estimate(p), order[id(p)]),
+            )
+
+    def chat(self, messages: List[Dict], stream: bool = False,
+             callback: Optional[Callable[[str], None]] = None, cancel_event=None,
+             stop_when: Optional[Callable[[str], bool]] = None,
+             on_failover: Optional[Callable[[], None]] = None) -> str:
+        """
+        发送对话，失败时依次切换到下一个端点
+
+        Args:
+            on_failover: 切换端点重新生成前调用（用于重置已收到的部分回复）
+            其余参数同 ``LLMProvider.chat``
+
+        Raises:
+            PromptCancelledError: cancel_event 被触发
+            最后一个端点的异常: 所有端点都失败
+        """
+        last_error: Optional[Exception] = None
+        candidates = self.candidates()
+        for index, provider in enumerate(candidates):
+            if index and on_failover is not None:
+                on_failover()
+            try:
+                return self._chat_one(provider, messages, stream, callback, cancel_event, stop_when)
+            except PromptCancelledError:
+                raise
+            except ProviderUnavailableError as exc:
+                last_error = exc
+                continue
+            except Exception as exc:
+                last_error = exc
+                with self._lock:
+                    stats = self._stats[id(provider)]
+                    stats.errors += 1
+                    if index + 1 < len(candidates):
+                        stats.failovers += 1
+                if index + 1 < len(candidates):
+                    print(f"⚠️ LLM 端点 {provider.breaker.name} 出错（{exc}），切换到 "
+                          f"{candidates[index + 1].breaker.name} 重新生成", flush=True)
+        raise last_error
+
+    def _chat_one(self, provider: LLMProvider, messages, stream, callback, cancel_event, stop_when) -> str:
+        """在一个端点上请求，并用本次的 TTFT 和输出速度更新统计"""
+        started = time.monotonic()
+        first_chunk: List[float] = []
+        chunk_count = [0]
+
+        def measure(chunk):
+            if not first_chunk:
+                first_chunk.append(time.monotonic())
+            chunk_count[0] += 1
+            if callback:
+                callback(chunk)
+            else:
+                print(chunk, end='', flush=True)
+
+        response = provider.chat(messages, stream=stream, callback=measure if stream else None,
+                                 cancel_event=cancel_event, stop_when=stop_when)
+        finished = time.monotonic()
+        if stream and not callback:
+            print()  # New line at the end
+
+        ttft = (first_chunk[0] if first_chunk else finished) - started
+        tps = None
+        if first_chunk and chunk_count[0] > 1 and finished > first_chunk[0]:
+            tps = (chunk_count[0] - 1) / (finished - first_chunk[0])
+        with self._lock:
+            stats = self._stats[id(provider)]
+            stats.requests += 1
+            stats.update(self.alpha, ttft, tps)
+        return response
+
+    def snapshot(self) -> List[Dict[str, object]]:
+        """全部端点的统计与熔断状态"""
+        with self._lock:
+            result = []
+            for provider in self.providers:
+                stats = self._stats[id(provider)]
+                entry = provider.breaker.snapshot()
+                entry.update({
+                    'model': provider.model,
+                    'ttft': round(stats.ttft, 3) if stats.ttft is not None else None,
+                    'tokens_per_second': round(stats.tps, 1) if stats.tps is not None else None,
+                    'requests': stats.requests,
+                    'errors': stats.errors,
+                    'failovers': stats.failovers,
+                })
+                result.append(entry)
+            return result
+
+
+def endpoint_specs() -> List[tuple]:
+    """
+    解析 LLM_ENDPOINTS
+
+    Returns:
+        [(provider 名称, 地址或 None), ...]；未配置时为 AI_PROVIDER 对应的一个端点
+    """
+    specs = []
+    for item in env_list('LLM_ENDPOINTS'):
+        name, _, url = item.partition('=')
+        specs.append((name.strip().lower(), url.strip() or None))
+    return specs or [(provider_name(), None)]
+
+
+# 端点配置 -> 路由器（统计随路由器保留，配置变化时重新开始）
+_routers: Dict[tuple, LLMRouter] = {}
+_lock = threading.Lock()
+
+
+def get_router() -> LLMRouter:
+    """获取当前配置对应的路由器"""
+    providers = [get_provider(name, base_url=url) for name, url in endpoint_specs()]
+    key = tuple(id(p) for p in providers)
+    with _lock:
+        router = _routers.get(key)
+        if router is None:
+            router = LLMRouter(
+                providers,
+                alpha=env_float('LLM_ROUTER_ALPHA', 0.3),
+                expected_tokens=env_float('LLM_ROUTER_EXPECTED_TOKENS', 400),
+            )
+            _routers[key] = router
+        return router
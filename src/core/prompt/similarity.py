@@ -0,0 +1,131 @@
+"""
+用户需求的归一化与近似重复查找
+
+``normalize_request`` 把全角字符转成半角（NFKC）、统一大小写、把标点当作
+空白并合并连续空白（中文两侧的空白直接去掉），只在这些细节上不同的需求
+共用同一个缓存键。
+
+``MinHashIndex`` 对归一化后的字符 n-gram 计算 MinHash 签名，用 LSH 分桶
+快速找出候选条目，估计的 Jaccard 相似度达到阈值的条目视为近似重复。
+"""
+import hashlib
+import re
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+SHINGLE_SIZE = 3
+NUM_PERM = 64
+BANDS = 16  # 每段 NUM_PERM / BANDS 个值；任一段完全相同即成为候选
+
+_SPACES = re.compile(r'\s+')
+# 与中文等非 ASCII 字符相邻的空白（"红色 的猫" 与 "红色的猫" 视为相同）
+_CJK_SPACES = re.compile(r'(?<=[^\x00-\x7f]) | (?=[^\x00-\x7f])')
+
+
+def normalize_request(text: str) -> str:
+    """归一化用户需求：NFKC、小写、标点视为空白、合并空白，去掉中文两侧的空白"""
+    text = unicodedata.normalize('NFKC', text).lower()
+    text = ''.join(' ' if unicodedata.category(ch)[0] in 'PZ' else ch for ch in text)
+    text = _SPACES.sub(' ', text).strip()
+    return _CJK_SPACES.sub('', text)
+
+
+def minhash(text: str) -> Tuple[int, ...]:
+    """
+    归一化后文本的 MinHash 签名
+
+    每个字符 n-gram 的 SHAKE-128 输出切成 NUM_PERM 个 32 位哈希值，
+    签名的每一位是全部 n-gram 在该位置上的最小值。
+    """
+    text = normalize_request(text)
+    if len(text) <= SHINGLE_SIZE:
+        grams = {text}
+    else:
+        grams = {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+    hashes = [array('I', hashlib.shake_128(gram.encode('utf-8')).digest(NUM_PERM * 4)) for gram in grams]
+    if len(hashes) == 1:
+        return tuple(hashes[0])
+    return tuple(map(min, *hashes))
+
+
+def signature_to_bytes(signature: Tuple[int, ...]) -> bytes:
+    return array('I', signature).tobytes()
+
+
+def signature_from_bytes(data: bytes) -> Optional[Tuple[int, ...]]:
+    values = array('I')
+    values.frombytes(data)
+    return tuple(values) if len(values) == NUM_PERM else None
+
+
+def similarity(a: Tuple[int, ...], b: Tuple[int, ...]) -> float:
+    """两个签名估计的 Jaccard 相似度"""
+    return sum(1 for x, y in zip(a, b) if x == y) / NUM_PERM
+
+
+class MinHashIndex:
+    """按命名空间分组的 MinHash LSH 索引（非线程安全，由调用方加锁）"""
+
+    def __init__(self, max_entries: int = 10000):
+        """
+        Args:
+            max_entries: 最多索引的条目数，超出时丢弃最早加入的
+        """
+        self.max_entries = max_entries
+        # key -> (namespace, signature)
+        self._entries: "OrderedDict[str, Tuple[str, Tuple[int, ...]]]" = OrderedDict()
+        self._buckets: Dict[tuple, Set[str]] = {}
+
+    def _bands(self, namespace: str, signature: Tuple[int, ...]) -> List[tuple]:
+        rows = NUM_PERM // BANDS
+        return [(namespace, band, signature[band * rows:(band + 1) * rows]) for band in range(BANDS)]
+
+    def add(self, key: str, namespace: str, signature: Tuple[int, ...]):
+        self.remove(key)
+        self._entries[key] = (namespace, signature)
+        for bucket in self._bands(namespace, signature):
+            self._buckets.setdefault(bucket, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self.remove(next(iter(self._entries)))
+
+    def remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for bucket in self._bands(*entry):
+            keys = self._buckets.get(bucket)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._buckets[bucket]
+
+    def remove_namespace(self, namespace: str):
+        for key in [key for key, entry in self._entries.items() if entry[0] == namespace]:
+            self.remove(key)
+
+    def clear(self):
+        self._entries.clear()
+        self._buckets.clear()
+
+    def query(self, namespace: str, signature: Tuple[int, ...],
+              threshold: float) -> Optional[Tuple[str, float]]:
+        """
+        查找同一命名空间中最相似的条目
+
+        Returns:
+            (key, 相似度)，没有达到阈值的条目时返回 None
+        """
+        candidates: Set[str] = set()
+        for bucket in self._bands(namespace, signature):
+            candidates.update(self._buckets.get(bucket, ()))
+        best = None
+        for key in candidates:
+            score = similarity(signature, self._entries[key][1])
+            if score >= threshold and (best is None or score > best[1]):
+                best = (key, score)
+        return best
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,151 @@
+"""
+相同请求的合并（singleflight）
+
+同一个键的请求正在进行时，后来的调用者不再发起自己的 LLM 请求，而是加入
+进行中的那一次：订阅它的流式片段（先补发已收到的部分），等待同一个结果。
+发起者切换 LLM 端点重新生成时调用 ``reset``，订阅者撤回已经收到的片段。
+"""
+import threading
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+# 等待期间检查取消事件的间隔（秒）
+_WAIT_INTERVAL = 0.1
+
+
+class _Subscriber:
+    """一个订阅者及其已收到的片段数；lock 保证补发、转发和撤回按顺序送达"""
+
+    def __init__(self, callback: Callable[[str], None], on_reset: Optional[Callable[[str], None]]):
+        self.callback = callback
+        self.on_reset = on_reset
+        self.lock = threading.RLock()
+        self.received = 0
+
+
+class Flight:
+    """
+    一次进行中的请求：发起者发布片段和结果，等待者订阅并等待
+
+    回调在释放 Flight 的锁之后调用，较慢或重入 Flight 的订阅者不会阻塞发起者
+    发布片段，也不会阻塞其他调用方加入。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._chunks: List[str] = []
+        self._subscribers: List[_Subscriber] = []
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0  # 当前正在等待的调用方（不含发起者）
+
+    def publish(self, chunk: str):
+        """发起者收到一个流式片段时调用，转发给全部订阅者"""
+        with self._lock:
+            self._chunks.append(chunk)
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            self._flush(subscriber)
+
+    def reset(self):
+        """发起者丢弃已发布的片段（切换端点重新生成）时调用，订阅者收到各自已收到、被撤回的文本"""
+        with self._lock:
+            chunks = self._chunks
+            self._chunks = []
+            withdrawn = []
+            for subscriber in self._subscribers:
+                withdrawn.append((subscriber, ''.join(chunks[:subscriber.received])))
+                subscriber.received = 0
+        for subscriber, discarded in withdrawn:
+            # 等该订阅者正在送达的片段送完，撤回排在它们之后
+            with subscriber.lock:
+                if discarded and subscriber.on_reset is not None:
+                    _deliver(subscriber.on_reset, discarded)
+
+    def subscribe(self, callback: Callable[[str], None],
+                  on_reset: Optional[Callable[[str], None]] = None):
+        """订阅后续片段，并先补发已经收到的片段；on_reset 在发起者撤回片段时调用"""
+        subscriber = _Subscriber(callback, on_reset)
+        with self._lock:
+            self._subscribers.append(subscriber)
+        self._flush(subscriber)
+
+    def leave(self):
+        """等待者结束等待（拿到结果、被取消或出错）时调用"""
+        with self._lock:
+            self.waiters -= 1
+
+    def unsubscribe(self, callback: Callable[[str], None]):
+        with self._lock:
+            self._subscribers = [entry for entry in self._subscribers if entry.callback is not callback]
+
+    def _flush(self, subscriber: _Subscriber):
+        """把订阅者尚未收到的片段按顺序送达"""
+        with subscriber.lock:
+            with self._lock:
+                pending = self._chunks[subscriber.received:]
+                subscriber.received = len(self._chunks)
+            for chunk in pending:
+                _deliver(subscriber.callback, chunk)
+
+    def wait(self, cancel_event=None) -> bool:
+        """
+        等待请求结束
+
+        Returns:
+            False 表示 cancel_event 先被触发
+        """
+        while not self._done.wait(_WAIT_INTERVAL):
+            if cancel_event is not None and cancel_event.is_set():
+                return False
+        return True
+
+
+def _deliver(callback: Callable[[str], None], chunk: str):
+    """订阅者回调出错不影响发起者和其他订阅者"""
+    try:
+        callback(chunk)
+    except Exception as exc:
+        print(f"⚠️ 转发流式输出失败: {exc}", flush=True)
+
+
+class SingleFlight:
+    """按键合并并发的相同请求"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[Hashable, Flight] = {}
+        self.coalesced = 0  # 加入已有请求（省掉一次 LLM 调用）的次数
+
+    def join(self, key: Hashable) -> Tuple[Flight, bool]:
+        """
+        加入或发起一次请求
+
+        Returns:
+            (flight, is_leader)；is_leader 为 True 时调用方负责执行请求并调用 finish，
+            否则调用方等待结束后调用 ``flight.leave()``
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                with flight._lock:
+                    flight.waiters += 1
+                self.coalesced += 1
+                return flight, False
+            flight = Flight()
+            self._flights[key] = flight
+            return flight, True
+
+    def finish(self, key: Hashable, flight: Flight, result: Any = None,
+               error: Optional[BaseException] = None):
+        """发起者结束请求：移出进行中的表并唤醒全部等待者"""
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.result = result
+        flight.error = error
+        flight._done.set()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._flights)
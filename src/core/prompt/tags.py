@@ -0,0 +1,131 @@
+"""
+提示词标签的增量解析
+
+LLM 的回复以流式片段到达。``PromptTagParser`` 逐段扫描
+``<positive_prompt>`` / ``<negative_prompt>`` 标签，只保留尚未解析完的尾部，
+整体是线性复杂度；``<think>`` 中的内容被忽略。所需的提示词组全部闭合后
+``done`` 变为 True，调用方即可关闭连接，不必等模型输出剩余的 token。
+"""
+from typing import List, Tuple
+
+THINK_OPEN = '<think>'
+THINK_CLOSE = '</think>'
+POSITIVE = 'positive_prompt'
+NEGATIVE = 'negative_prompt'
+
+_OPEN_TAGS = {
+    THINK_OPEN: None,
+    f'<{POSITIVE}>': POSITIVE,
+    f'<{NEGATIVE}>': NEGATIVE,
+}
+# 可能被切断在片段末尾的最长标签
+_MAX_TAG = max(len(tag) for tag in list(_OPEN_TAGS) + [f'</{NEGATIVE}>', f'</{POSITIVE}>'])
+
+_OUTSIDE = 'outside'
+_THINK = 'think'
+
+
+class PromptTagParser:
+    """流式提示词标签解析器"""
+
+    def __init__(self, count: int = 1):
+        """
+        Args:
+            count: 需要的 (正面, 负面) 提示词组数，解析到这么多组后 done 为 True
+        """
+        self.count = max(1, count)
+        self.reset()
+
+    def reset(self):
+        """丢弃已解析的内容（切换端点重新生成时调用）"""
+        self.positives: List[str] = []
+        self.negatives: List[str] = []
+        self._state = _OUTSIDE
+        self._tail = ''
+        self._content: List[str] = []
+
+    @property
+    def done(self) -> bool:
+        """所需的提示词组是否都已闭合"""
+        return len(self.positives) >= self.count and len(self.negatives) >= self.count
+
+    def feed(self, chunk: str) -> bool:
+        """
+        解析一个流式片段
+
+        Returns:
+            done，可直接作为流式读取的停止条件
+        """
+        if self.done or not chunk:
+            return self.done
+        text = self._tail + chunk
+        self._tail = ''
+
+        while text and not self.done:
+            if self._state == _OUTSIDE:
+                text = self._scan_outside(text)
+            elif self._state == _THINK:
+                text = self._scan_until(text, THINK_CLOSE)
+            else:
+                text = self._scan_until(text, f'</{self._state}>')
+        return self.done
+
+    def _scan_outside(self, text: str) -> str:
+        """寻找下一个开始标签，返回其后的文本"""
+        best = -1
+        best_tag = ''
+        for tag in _OPEN_TAGS:
+            index = text.find(tag)
+            if index != -1 and (best == -1 or index < best):
+                best, best_tag = index, tag
+        if best == -1:
+            # 末尾可能是被切断的标签，留到下个片段
+            self._tail = text[-(_MAX_TAG - 1):]
+            return ''
+        name = _OPEN_TAGS[best_tag]
+        self._state = _THINK if name is None else name
+        return text[best + len(best_tag):]
+
+    def _scan_until(self, text: str, close_tag: str) -> str:
+        """在标签内寻找结束标签，返回其后的文本"""
+        index = text.find(close_tag)
+        if index == -1:
+            keep = len(close_tag) - 1
+            if self._state != _THINK:
+                self._content.append(text[:-keep] if len(text) > keep else '')
+            self._tail = text[-keep:] if len(text) > keep else text
+            return ''
+
+        if self._state != _THINK:
+            self._content.append(text[:index])
+            value = ''.join(self._content)
+            (self.positives if self._state == POSITIVE else self.negatives).append(value)
+        self._content = []
+        self._state = _OUTSIDE
+        return text[index + len(close_tag):]
+
+    def variants(self) -> List[Tuple[str, str]]:
+        """
+        按顺序配对的 (正面, 负面) 提示词组
+
+        某组缺少负面提示词时沿用前一组的负面提示词。
+
+        Raises:
+            ValueError: 还没有解析到任何正面提示词
+        """
+        if not self.positives:
+            raise ValueError("AI 回复中没有找到 <positive_prompt>")
+        pairs = []
+        negative_prompt = ''
+        for index, positive_prompt in enumerate(self.positives[:self.count]):
+            if index < len(self.negatives):
+                negative_prompt = self.negatives[index]
+            pairs.append((positive_prompt, negative_prompt))
+        return pairs
+
+
+def parse_tags(response: str, count: int = 1) -> List[Tuple[str, str]]:
+    """解析完整回复中的前 count 组提示词"""
+    parser = PromptTagParser(count)
+    parser.feed(response)
+    return parser.variants()
@@ -0,0 +1,56 @@
+"""
+asyncio 与同步代码之间的桥接工具
+
+同步调用方（Flask 路由、生成线程）通过 ``run_sync`` 把协程提交到一个常驻的
+后台事件循环执行，这样异步客户端的连接池、websocket 监听任务可以在多次调用之间复用。
+"""
+import asyncio
+import threading
+from typing import Awaitable, Optional, TypeVar
+
+T = TypeVar("T")
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """获取（必要时启动）后台事件循环"""
+    global _loop
+    with _loop_lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            thread = threading.Thread(
+                target=_loop.run_forever,
+                name="async-io-loop",
+                daemon=True,
+            )
+            thread.start()
+        return _loop
+
+
+def run_sync(coro: Awaitable[T], timeout: Optional[float] = None) -> T:
+    """
+    在后台事件循环中执行协程并阻塞等待结果
+
+    Args:
+        coro: 要执行的协程
+        timeout: 最长等待秒数，None 表示一直等待
+
+    Returns:
+        协程的返回值
+    """
+    loop = get_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        raise RuntimeError("run_sync 不能在后台事件循环内部调用")
+
+    future = asyncio.run_coroutine_threadsafe(coro, loop)
+    try:
+        return future.result(timeout)
+    except BaseException:
+        future.cancel()
+        raise
@@ -0,0 +1,35 @@
+"""
+环境变量读取工具
+"""
+import os
+from typing import List
+
+
+def env_int(name: str, default: int) -> int:
+    """读取整数环境变量，缺失或非法时返回默认值"""
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def env_float(name: str, default: float) -> float:
+    """读取浮点数环境变量，缺失或非法时返回默认值"""
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def env_bool(name: str, default: bool = False) -> bool:
+    """读取布尔环境变量（true/1/yes/on 视为真）"""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def env_list(name: str, default: str = "") -> List[str]:
+    """读取逗号分隔的列表环境变量，忽略空项"""
+    value = os.getenv(name, default) or ""
+    return [item.strip() for item in value.split(",") if item.strip()]
@@ -14,6 +14,11 @@
         const imageContainer = document.getElementById('imageContainer');
         const currentImage = document.getElementById('currentImage');
         const deleteBtn = document.getElementById('deleteBtn');
+        const finalizeBtn = document.getElementById('finalizeBtn');
+        const draftMode = document.getElementById('draftMode');
+        const faceFixToggle = document.getElementById('faceFixToggle');
+        const upscaleToggle = document.getElementById('upscaleToggle');
+        const variantsToggle = document.getElementById('variantsToggle');
         const waitingState = document.getElementById('waitingState');
         const imageCounter = document.getElementById('imageCounter');
         const statusIndicator = document.getElementById('statusIndicator');
@@ -31,6 +36,8 @@
         const logContainer = document.getElementById('logContainer');
         const logContent = document.getElementById('logContent');
         const waitingText = document.getElementById('waitingText');
+        const waitingDetail = document.getElementById('waitingDetail');
+        const previewImage = document.getElementById('previewImage');
         const imageGallery = document.getElementById('imageGallery');
         const galleryToggle = document.getElementById('galleryToggle');
         const galleryScroll = document.getElementById('galleryScroll');
@@ -72,6 +79,7 @@
         let currentPromptId = null; // 当前提示词ID
         let historyRecords = []; // 历史记录列表
         let uploadedImagePath = null; // 上传的图片路径
+        const draftImages = new Set(); // 可精修的草稿图片
 
         // 初始化显示屏幕尺寸
         function updateScreenSizeDisplay() {
@@ -332,7 +340,11 @@
                 prompt,
                 count: 999999,
                 width: selectedWidth,
-                height: selectedHeight
+                height: selectedHeight,
+                draft: draftMode.checked,
+                face_fix: faceFixToggle.checked,
+                upscale: upscaleToggle.checked,
+                variants: variantsToggle.checked
             };
 
             // 如果有上传的图片，添加图片路径
@@ -453,6 +465,7 @@
             currentImage.style.display = 'block';
             waitingState.style.display = 'none';
             deleteBtn.style.display = 'flex'; // 显示删除按钮
+            finalizeBtn.style.display = draftImages.has(images[index]) ? 'flex' : 'none';
 
             updateUI();
         }
@@ -665,7 +678,11 @@
                 prompt: currentPrompt,
                 count: 999999,
                 width: selectedWidth,
-                height: selectedHeight
+                height: selectedHeight,
+                draft: draftMode.checked,
+                face_fix: faceFixToggle.checked,
+                upscale: upscaleToggle.checked,
+                variants: variantsToggle.checked
             };
 
             // 如果有上传的图片，添加图片路径
@@ -739,6 +756,36 @@
             }
         });
 
+        // 精修按钮：对当前草稿运行细化和放大
+        finalizeBtn.addEventListener('click', async () => {
+            const filename = images[currentIndex];
+            if (!filename) return;
+
+            try {
+                const response = await fetch('/api/finalize', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({
+                        filenames: [filename],
+                        face_fix: faceFixToggle.checked,
+                        upscale: upscaleToggle.checked
+                    })
+                });
+                const result = await response.json();
+
+                if (result.success) {
+                    draftImages.delete(filename);
+                    finalizeBtn.style.display = 'none';
+                    showToast('已开始精修');
+                } else {
+                    alert('精修失败: ' + result.message);
+                }
+            } catch (error) {
+                console.error('精修失败:', error);
+                alert('精修失败，请重试');
+            }
+        });
+
         // 历史记录按钮（顶部栏）
         historyBtn.addEventListener('click', async () => {
             historyPanel.classList.add('show');
@@ -976,6 +1023,36 @@
             }
         });
 
+        // Socket节点/采样步数进度
+        socket.on('sampler_progress', (data) => {
+            const name = data.title || data.class_type || data.node || '';
+            if (data.type === 'progress') {
+                waitingDetail.textContent = `${name} ${data.value}/${data.max}`;
+            } else if (data.type === 'executing') {
+                waitingDetail.textContent = name;
+            }
+        });
+
+        // Socket实时预览图
+        socket.on('preview', (data) => {
+            previewImage.src = data.image;
+            previewImage.style.display = 'block';
+        });
+
+        // 新图片到达后清空预览
+        socket.on('new_image', (data) => {
+            previewImage.style.display = 'none';
+            waitingDetail.textContent = '';
+            if (data && data.stage === 'draft') {
+                draftImages.add(data.filename);
+            }
+        });
+
+        // 精修完成（新图片由状态轮询加入列表）
+        socket.on('image_finalized', () => {
+            showToast('精修完成');
+        });
+
         // Socket日志处理
         socket.on('log', (data) => {
             console.log('收到日志:', data.message);
@@ -987,6 +1064,14 @@
             logContainer.scrollTop = logContainer.scrollHeight;
         });
 
+        // LLM 端点中途出错切换时，撤回该端点已输出的部分
+        socket.on('log_retract', (data) => {
+            const text = logContent.textContent;
+            if (data.message && text.endsWith(data.message)) {
+                logContent.textContent = text.slice(0, text.length - data.message.length);
+            }
+        });
+
         // Socket错误处理
         socket.on('error', (data) => {
             console.error('错误:', data);
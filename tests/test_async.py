@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试异步客户端层：等待不占线程、取消释放后端、LLM 流式与取消"""
+
+import asyncio
+import os
+import sys
+import threading
+import uuid
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.core.comfyui.async_client import AsyncComfyUIClient
+from src.core.comfyui.client import ComfyUIClient
+from src.core.comfyui.tracker import CompletionTracker, JobCancelledError
+from src.core.prompt import async_llm
+
+
+class FakeBackends:
+    """代替 ComfyUI 的 /prompt、/history 和 /queue"""
+
+    def __init__(self, client):
+        self.client = client
+        self.history = {}
+        self.queued = {}
+        self.lock = threading.Lock()
+
+    def queue_prompt(self, workflow, server_address=None, prompt_id=None):
+        prompt_id = prompt_id or uuid.uuid4().hex
+        with self.lock:
+            self.queued[prompt_id] = server_address
+        return {'prompt_id': prompt_id}
+
+    def get_history(self, prompt_id, server_address=None):
+        with self.lock:
+            return {prompt_id: self.history[prompt_id]} if prompt_id in self.history else {}
+
+    def finish(self, job):
+        outputs = {node: {'images': [{'filename': f'{job.prompt_id}.png', 'subfolder': '', 'type': 'output'}]}
+                   for node in job.output_nodes}
+        with self.lock:
+            self.history[job.prompt_id] = {'outputs': outputs}
+        self.client.tracker(job.server_address)._mark_finished(job.prompt_id, 'success')
+
+
+@pytest.fixture
+def backends(monkeypatch):
+    monkeypatch.setattr(CompletionTracker, 'start', lambda self: None)
+    client = ComfyUIClient(servers=['a:1', 'b:2'])
+    monkeypatch.setattr(client.pool, '_probe', lambda address: 0)
+    fake = FakeBackends(client)
+    monkeypatch.setattr(client, 'queue_prompt', fake.queue_prompt)
+    monkeypatch.setattr(client, 'get_history', fake.get_history)
+    monkeypatch.setattr(client, 'get_queue', lambda server_address=None: {})
+    yield fake
+    client.pool.close()
+
+
+def in_flight(client):
+    return sum(backend['in_flight'] for backend in client.pool.snapshot())
+
+
+def test_waiting_jobs_hold_no_threads(backends):
+    """两个工作线程驱动 20 个并发任务：等待期间不能占用线程"""
+    aclient = AsyncComfyUIClient(backends.client, max_workers=2)
+
+    async def run():
+        jobs = await aclient.submit_many([{'positive_prompt': f'p{i}', 'negative_prompt': 'n'}
+                                          for i in range(20)])
+        waiters = [asyncio.ensure_future(aclient.collect_outputs(job, timeout=10)) for job in jobs]
+        await asyncio.sleep(0.1)
+        assert not any(waiter.done() for waiter in waiters)
+        for job in jobs:
+            backends.finish(job)
+        return jobs, await asyncio.gather(*waiters)
+
+    jobs, outputs = asyncio.run(run())
+    aclient.close()
+
+    assert [refs[0]['filename'] for refs in outputs] == [f'{job.prompt_id}.png' for job in jobs]
+    assert {job.server_address for job in jobs} == {'a:1', 'b:2'}
+    assert in_flight(backends.client) == 0
+
+
+def test_cancelled_wait_releases_backend(backends):
+    aclient = AsyncComfyUIClient(backends.client, max_workers=2)
+
+    async def run():
+        job = await aclient.submit_image('p', 'n')
+        assert in_flight(backends.client) == 1
+        waiter = asyncio.ensure_future(aclient.collect_outputs(job, timeout=10))
+        await asyncio.sleep(0.05)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+    asyncio.run(run())
+    aclient.close()
+    assert in_flight(backends.client) == 0
+
+
+def test_cancel_wakes_waiter(backends):
+    aclient = AsyncComfyUIClient(backends.client, max_workers=2)
+
+    async def run():
+        job = await aclient.submit_image('p', 'n')
+        waiter = asyncio.ensure_future(aclient.collect_outputs(job, timeout=10))
+        await asyncio.sleep(0.05)
+        await aclient.cancel([job])
+        with pytest.raises(JobCancelledError):
+            await asyncio.wait_for(waiter, 1)
+
+    asyncio.run(run())
+    aclient.close()
+    assert in_flight(backends.client) == 0
+
+
+class FakeRouter:
+    """流式输出 a，切换端点后输出 b、c；block=True 时等待取消"""
+
+    def __init__(self, block=False):
+        self.block = block
+        self.cancelled = threading.Event()
+
+    def chat(self, messages, stream=False, callback=None, cancel_event=None, stop_when=None, on_failover=None):
+        if self.block:
+            cancel_event.on_cancel(self.cancelled.set)
+            self.cancelled.wait(5)
+            raise ConnectionError('closed')
+        callback('a')
+        on_failover()
+        for chunk in ('b', 'c'):
+            callback(chunk)
+        return 'bc'
+
+
+def test_astream_yields_chunks_and_failover(monkeypatch):
+    monkeypatch.setattr(async_llm, 'get_router', FakeRouter)
+    events = []
+
+    async def run():
+        async for chunk in async_llm.astream([], on_failover=lambda: events.append('failover')):
+            events.append(chunk)
+
+    asyncio.run(run())
+    assert events == ['a', 'failover', 'b', 'c']
+
+
+def test_cancelling_coroutine_aborts_request(monkeypatch):
+    router = FakeRouter(block=True)
+    monkeypatch.setattr(async_llm, 'get_router', lambda: router)
+
+    async def run():
+        task = asyncio.ensure_future(async_llm.achat([], stream=True))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    assert router.cancelled.wait(1)
+
+
+def fake_variants(user_req, count, stream=False, log_callback=None, cancel_event=None, reset_callback=None):
+    if log_callback:
+        log_callback(f'log {user_req}')
+    return [(f'P-{user_req}', 'N')]
+
+
+def test_generate_prompts_keeps_order(monkeypatch):
+    monkeypatch.setattr(async_llm.generator, 'generate_prompt_variants', fake_variants)
+    assert async_llm.generate_prompts(['x', 'y', 'z']) == [('P-x', 'N'), ('P-y', 'N'), ('P-z', 'N')]
+
+
+def test_log_callback_runs_on_loop_thread(monkeypatch):
+    monkeypatch.setattr(async_llm.generator, 'generate_prompt_variants', fake_variants)
+    logs = []
+
+    async def run():
+        result = await async_llm.agenerate_prompt('x', log_callback=lambda msg: logs.append(
+            (msg, threading.get_ident())))
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(run()) == ('P-x', 'N')
+    assert logs == [('log x', threading.get_ident())]
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试工作流图的裁剪、功能跳过与校验"""
+
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.core.comfyui.graph import (
+    WorkflowValidationError,
+    bypass_features,
+    prune,
+    validate,
+)
+
+WORKFLOW_FILE = os.path.join(os.path.dirname(__file__), '..', 'config', 'workflows', 'flowv_normal.json')
+
+
+@pytest.fixture
+def workflow():
+    with open(WORKFLOW_FILE, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def test_prune_keeps_only_save_image_dependencies(workflow):
+    pruned = prune(workflow)
+    # 预览对比节点不是输出，裁剪后不再提交
+    assert '35' not in pruned
+    assert '37' in pruned and '75:2' in pruned
+    validate(pruned)
+
+
+def test_bypass_face_fix_and_upscale(workflow):
+    pruned = prune(bypass_features(workflow, {'face_fix': False, 'upscale': False}))
+
+    assert pruned['37']['inputs']['images'] == ['7', 0]
+    assert set(pruned) == {'1', '3', '4', '5', '6', '7', '37', '45', '46', '65', '120', '121', '131'}
+    # 原工作流不被修改
+    assert workflow['37']['inputs']['images'] == ['75:2', 0]
+    validate(pruned)
+
+
+def test_bypass_face_fix_only_rewires_upscale(workflow):
+    pruned = prune(bypass_features(workflow, {'face_fix': False}))
+
+    assert pruned['75:2']['inputs']['image'] == ['7', 0]
+    assert not any(node_id.startswith(('84:', '113:')) for node_id in pruned)
+
+
+def test_unknown_feature_is_rejected(workflow):
+    with pytest.raises(WorkflowValidationError):
+        bypass_features(workflow, {'denoise': False})
+
+
+def test_validate_detects_cycle():
+    workflow = {
+        '1': {'class_type': 'A', 'inputs': {'x': ['2', 0]}},
+        '2': {'class_type': 'B', 'inputs': {'x': ['1', 0]}},
+        '3': {'class_type': 'SaveImage', 'inputs': {'images': ['2', 0]}},
+    }
+    with pytest.raises(WorkflowValidationError, match='环'):
+        validate(workflow)
+
+
+def test_validate_detects_dangling_link():
+    workflow = {
+        '1': {'class_type': 'SaveImage', 'inputs': {'images': ['9', 0]}},
+    }
+    with pytest.raises(WorkflowValidationError, match='不存在'):
+        validate(workflow)
+
+
+def test_validate_requires_output_node():
+    with pytest.raises(WorkflowValidationError):
+        validate({'1': {'class_type': 'VAEDecode', 'inputs': {}}})
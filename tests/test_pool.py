@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试 BackendPool 的负载选择、熔断移出、冷却、排空与亲和性"""
+
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.core.comfyui.pool import BackendPool, NoBackendAvailableError
+
+
+@pytest.fixture
+def depths():
+    """各后端 /queue 探测结果；None 表示不可达"""
+    return {'a': 0, 'b': 0, 'c': 0}
+
+
+@pytest.fixture
+def make_pool(monkeypatch, depths):
+    pools = []
+
+    def make(**kwargs):
+        kwargs.setdefault('check_interval', 60.0)
+        kwargs.setdefault('idle_interval', 60.0)
+        pool = BackendPool(list(depths), **kwargs)
+        monkeypatch.setattr(pool, '_probe', lambda address: depths[address])
+        pools.append(pool)
+        return pool
+
+    yield make
+    for pool in pools:
+        pool.close()
+
+
+def state(pool, address):
+    return next(b for b in pool.snapshot() if b['address'] == address)
+
+
+def test_least_loaded_selection(make_pool, depths):
+    depths.update(a=3, b=1, c=2)
+    pool = make_pool()
+
+    assert pool.acquire() == 'b'
+    # b 的负载变为 2，与 c 持平时按配置顺序选择
+    assert pool.acquire() == 'b'
+    assert pool.acquire() == 'c'
+    assert state(pool, 'b')['in_flight'] == 2
+
+
+def test_release_frees_slot(make_pool):
+    pool = make_pool()
+    address = pool.acquire()
+    pool.release(address)
+    assert state(pool, address)['in_flight'] == 0
+
+
+def test_probe_failures_evict_after_max_failures(make_pool, depths):
+    pool = make_pool(max_failures=3)
+    pool.refresh(force=True)
+    depths['a'] = None
+
+    pool.refresh(force=True)
+    pool.refresh(force=True)
+    assert state(pool, 'a')['healthy']
+    assert state(pool, 'a')['failures'] == 2
+
+    pool.refresh(force=True)
+    assert not state(pool, 'a')['healthy']
+    assert 'a' not in {pool.acquire() for _ in range(4)}
+
+
+def test_successful_job_resets_probe_failures(make_pool, depths):
+    pool = make_pool(max_failures=3)
+    address = pool.acquire()
+    depths['a'] = None
+    pool.refresh(force=True)
+    pool.refresh(force=True)
+    pool.release(address)
+
+    assert state(pool, 'a')['failures'] == 0
+
+
+def test_job_failures_evict(make_pool):
+    pool = make_pool(max_failures=2)
+    for _ in range(2):
+        pool.acquire()
+        pool.release('a', success=False)
+
+    assert not state(pool, 'a')['healthy']
+
+
+def test_cooldown_skips_then_recovers(make_pool, depths):
+    pool = make_pool(max_failures=1, cooldown=0.2, check_interval=0.0)
+    pool.refresh(force=True)
+    depths['a'] = None
+    pool.refresh(force=True)
+    depths['a'] = 0
+
+    # 冷却期内不探测，仍被移出
+    pool.refresh()
+    assert not state(pool, 'a')['healthy']
+
+    time.sleep(0.25)
+    pool.refresh()
+    assert state(pool, 'a')['healthy']
+
+
+def test_all_evicted_raises(make_pool, depths):
+    depths.update(a=None, b=None, c=None)
+    pool = make_pool(max_failures=1)
+
+    with pytest.raises(NoBackendAvailableError):
+        pool.acquire()
+
+
+def test_drain(make_pool):
+    pool = make_pool()
+    pool.drain('a')
+    assert 'a' not in {pool.acquire() for _ in range(4)}
+
+    pool.drain('b')
+    pool.drain('c')
+    with pytest.raises(NoBackendAvailableError):
+        pool.acquire()
+
+    pool.drain('a', draining=False)
+    assert pool.acquire() == 'a'
+
+
+def test_affinity_tie_break(make_pool, depths):
+    depths.update(a=0, b=1, c=5)
+    pool = make_pool(affinity_slack=1)
+    prefer_b = {'a': 0, 'b': 1, 'c': 2}.get
+
+    # b 负载只多 1，在允许范围内，按亲和性胜出；c 负载过高不参与
+    assert pool.acquire(affinity=prefer_b) == 'b'
+    assert state(pool, 'b')['affinity_picks'] == 1
+
+    # b 的负载变为 2，超出 a 的负载加 slack
+    assert pool.acquire(affinity=prefer_b) == 'a'
+
+
+def test_affinity_equal_scores_keep_least_loaded(make_pool, depths):
+    depths.update(a=1, b=0, c=0)
+    pool = make_pool()
+
+    assert pool.acquire(affinity=lambda address: 0) == 'b'
+    assert state(pool, 'b')['affinity_picks'] == 0
+
+
+def test_refresh_interval_backs_off_when_idle(make_pool):
+    pool = make_pool(check_interval=1.0, idle_interval=30.0)
+    pool.refresh(force=True)
+    assert pool._refresh_interval() == 30.0
+
+    address = pool.acquire()
+    assert pool._refresh_interval() == 1.0
+
+    pool.release(address)
+    pool.refresh(force=True)
+    assert pool._refresh_interval() == 30.0
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试空闲预取的任务列表：多变体结果只在用过多变体模式或显式开启时预取"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.app.services import prefetch
+from src.app.services.prefetch import PromptPrefetcher
+
+
+@pytest.fixture
+def prefetcher(monkeypatch):
+    monkeypatch.setenv('PROMPT_VARIANTS', '4')
+    monkeypatch.setenv('PROMPT_PREFETCH_HISTORY', '0')
+    monkeypatch.delenv('PROMPT_PREFETCH_VARIANTS', raising=False)
+    monkeypatch.setattr(prefetch, 'is_prompt_cached', lambda prompt, count=1: prompt == 'cached')
+    prefetcher = PromptPrefetcher()
+    prefetcher._presets = lambda: ['cat', 'cached', 'Cat!']
+    return prefetcher
+
+
+def test_single_expansions_only_by_default(prefetcher, monkeypatch):
+    monkeypatch.setattr(prefetch, 'has_cached_variants', lambda count: False)
+    assert prefetcher._todo() == [('cat', 1)]
+
+
+def test_variants_after_variant_mode_was_used(prefetcher, monkeypatch):
+    checked = []
+    monkeypatch.setattr(prefetch, 'has_cached_variants', lambda count: checked.append(count) or True)
+    assert prefetcher._todo() == [('cat', 1), ('cat', 4)]
+    assert checked == [4]
+
+
+def test_variants_opt_in(prefetcher, monkeypatch):
+    monkeypatch.setattr(prefetch, 'has_cached_variants', lambda count: False)
+    monkeypatch.setenv('PROMPT_PREFETCH_VARIANTS', 'true')
+    assert prefetcher._todo() == [('cat', 1), ('cat', 4)]
+
+
+def test_no_variant_set_when_variants_disabled(prefetcher, monkeypatch):
+    monkeypatch.setattr(prefetch, 'has_cached_variants', lambda count: True)
+    monkeypatch.setenv('PROMPT_VARIANTS', '1')
+    assert prefetcher._todo() == [('cat', 1)]
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试提示词缓存的 LRU、TTL 与命名空间失效"""
+
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.core.prompt import cache as cache_module
+from src.core.prompt.cache import PromptCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """可手动推进的 time.time"""
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, 'time', lambda: now[0])
+    return now
+
+
+def disk_requests(cache):
+    with sqlite3.connect(cache.db_path) as conn:
+        return sorted(row[0] for row in conn.execute('SELECT user_req FROM prompt_cache'))
+
+
+def test_memory_lru_eviction():
+    cache = PromptCache(db_path=None, max_entries=2)
+    cache.put('a', ('A', 'n'))
+    cache.put('b', ('B', 'n'))
+    cache.get('a')
+    cache.put('c', ('C', 'n'))
+
+    assert cache.get('b') is None
+    assert cache.get('a') == ('A', 'n')
+    assert cache.stats()['evictions'] == 1
+
+
+def test_normalized_key_hits():
+    cache = PromptCache(db_path=None)
+    cache.put('一只猫，在星空下', ('P', 'N'))
+    assert cache.lookup('一只猫 在星空下!') == ([('P', 'N')], 1.0)
+
+
+def test_ttl_expiry(tmp_path, clock):
+    cache = PromptCache(db_path=str(tmp_path / 'cache.db'), ttl=60)
+    cache.put('a', ('A', 'n'))
+    clock[0] += 61
+
+    assert cache.get('a') is None
+    assert cache.stats()['expired'] >= 1
+    assert disk_requests(cache) == []
+
+
+def test_disk_hit_after_restart(tmp_path):
+    db_path = str(tmp_path / 'cache.db')
+    PromptCache(db_path=db_path).put_variants('a', [('A1', 'n'), ('A2', 'n')])
+
+    cache = PromptCache(db_path=db_path)
+    assert cache.get_variants('a') == [('A1', 'n'), ('A2', 'n')]
+    assert cache.stats()['disk_hits'] == 1
+
+
+def test_namespace_invalidation(tmp_path):
+    cache = PromptCache(db_path=str(tmp_path / 'cache.db'))
+    cache.put('a', ('A', 'n'), namespace='old')
+    cache.put('b', ('B', 'n'), namespace='new')
+
+    cache.invalidate(namespace='old')
+
+    assert cache.get('a', 'old') is None
+    assert cache.get('b', 'new') == ('B', 'n')
+    assert disk_requests(cache) == ['b']
+    # 命名空间不同的相同需求互不命中
+    assert cache.get('b', 'old') is None
+
+
+def test_memory_hits_protect_rows_from_eviction(tmp_path, clock):
+    cache = PromptCache(db_path=str(tmp_path / 'cache.db'), max_rows=2)
+    cache.put('a', ('A', 'n'))
+    clock[0] += 1
+    cache.put('b', ('B', 'n'))
+    clock[0] += 1
+    # 只在内存中命中，淘汰前会写回 SQLite
+    assert cache.get('a') == ('A', 'n')
+    clock[0] += 1
+    cache.put('c', ('C', 'n'))
+
+    assert disk_requests(cache) == ['a', 'c']
+
+
+def test_non_counting_probes():
+    cache = PromptCache(db_path=None)
+    cache.put('a', ('A', 'n'))
+
+    assert cache.contains('a')
+    assert cache.lookup('b', record_stats=False) is None
+    stats = cache.stats()
+    assert stats['misses'] == 0 and stats['memory_hits'] == 0
+
+
+def test_similar_request_hit():
+    cache = PromptCache(db_path=None, similarity=0.6)
+    cache.put('一只可爱的猫咪在星空下散步，梦幻的色彩，柔和的光线', ('P', 'N'))
+
+    found = cache.lookup('一只可爱的猫咪在星空下散步，梦幻的色彩，柔和的灯光')
+    assert found is not None and 0.6 <= found[1] < 1.0
+    assert cache.stats()['similar_hits'] == 1
+
+
+def test_has_namespace(tmp_path, clock):
+    db_path = str(tmp_path / 'cache.db')
+    cache = PromptCache(db_path=db_path, ttl=60)
+    assert not cache.has_namespace('ns:x4')
+    cache.put_variants('a', [('A1', 'n'), ('A2', 'n')], namespace='ns:x4')
+    assert cache.has_namespace('ns:x4') and not cache.has_namespace('ns')
+
+    # 重启后从 SQLite 判断，过期条目不算
+    assert PromptCache(db_path=db_path, ttl=60).has_namespace('ns:x4')
+    clock[0] += 61
+    assert not PromptCache(db_path=db_path, ttl=60).has_namespace('ns:x4')
+
+    cache.invalidate(namespace='ns:x4')
+    assert not cache.has_namespace('ns:x4')
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试 LLM provider 的取消与熔断（打开、半开试探、恢复）"""
+
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.core.prompt import providers
+from src.core.prompt.providers import (
+    CancelEvent,
+    CircuitBreaker,
+    LLMProvider,
+    PromptCancelledError,
+    ProviderUnavailableError,
+)
+
+
+class StalledProvider(LLMProvider):
+    """模拟迟迟不返回第一个片段的请求；关闭连接后请求结束"""
+
+    name = 'stalled'
+
+    def __init__(self):
+        super().__init__('model', CircuitBreaker('stalled', max_failures=1, cooldown=60))
+        self.closed = threading.Event()
+
+    def _chat(self, messages, stream, callback, cancel_event, stop_when):
+        unregister = cancel_event.on_cancel(self.closed.set)
+        try:
+            if not self.closed.wait(5):
+                return 'too late'
+            raise ConnectionError('connection closed')
+        finally:
+            unregister()
+
+
+def test_on_cancel_runs_callbacks_once():
+    event = CancelEvent()
+    calls = []
+    event.on_cancel(lambda: calls.append('a'))
+    unregister = event.on_cancel(lambda: calls.append('b'))
+    unregister()
+
+    event.set()
+    event.set()
+    assert calls == ['a']
+
+    # 已取消时注册立即调用
+    event.on_cancel(lambda: calls.append('c'))
+    assert calls == ['a', 'c']
+
+
+def test_cancel_before_first_chunk_returns_immediately():
+    provider = StalledProvider()
+    event = CancelEvent()
+    threading.Timer(0.1, event.set).start()
+
+    started = time.monotonic()
+    with pytest.raises(PromptCancelledError):
+        provider.chat([{'role': 'user', 'content': 'hi'}], stream=True, cancel_event=event)
+
+    assert time.monotonic() - started < 1.0
+    assert provider.closed.wait(1)
+    # 取消不算 provider 故障
+    assert provider.breaker.snapshot()['failures'] == 0
+
+
+def test_plain_event_still_supported():
+    class EchoProvider(LLMProvider):
+        name = 'echo'
+
+        def _chat(self, messages, stream, callback, cancel_event, stop_when):
+            return messages[-1]['content']
+
+    assert EchoProvider('model').chat([{'role': 'user', 'content': 'hi'}],
+                                      cancel_event=threading.Event()) == 'hi'
+
+
+def test_generate_goes_through_chat_and_breaker():
+    class EchoProvider(LLMProvider):
+        name = 'echo'
+
+        def _chat(self, messages, stream, callback, cancel_event, stop_when):
+            return messages[-1]['content']
+
+    provider = EchoProvider('model', CircuitBreaker('echo', max_failures=1, cooldown=60))
+    assert provider.generate('hi') == 'hi'
+
+    provider.breaker.record_failure()
+    with pytest.raises(ProviderUnavailableError):
+        provider.generate('hi')
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(providers.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker('b', max_failures=2, cooldown=30)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_success()  # 成功清零，失败必须连续
+    breaker.record_failure()
+    assert breaker.allow() and breaker.available
+
+    breaker.record_failure()
+    assert not breaker.allow() and not breaker.available
+    assert breaker.snapshot() == {'name': 'b', 'failures': 2, 'open': True}
+
+
+def test_breaker_half_open_lets_one_probe_through(clock):
+    breaker = CircuitBreaker('b', max_failures=1, cooldown=30)
+    breaker.record_failure()
+    clock[0] = 30.0
+
+    assert breaker.available
+    assert breaker.allow()
+    # 试探请求结束前其余请求继续被拒绝
+    assert not breaker.allow()
+
+    # 试探失败：重新打开一个冷却期
+    breaker.record_failure()
+    clock[0] = 59.0
+    assert not breaker.allow()
+    clock[0] = 60.0
+    assert breaker.allow()
+
+    # 试探成功：关闭熔断
+    breaker.record_success()
+    assert breaker.allow() and breaker.allow()
+    assert breaker.snapshot()['failures'] == 0
+
+
+def test_provider_failures_open_breaker(clock):
+    class FailingProvider(LLMProvider):
+        name = 'failing'
+        calls = 0
+
+        def _chat(self, messages, stream, callback, cancel_event, stop_when):
+            self.calls += 1
+            raise ConnectionError('refused')
+
+    provider = FailingProvider('model', CircuitBreaker('failing', max_failures=2, cooldown=30))
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            provider.chat([{'role': 'user', 'content': 'hi'}])
+    with pytest.raises(ProviderUnavailableError):
+        provider.chat([{'role': 'user', 'content': 'hi'}])
+    assert provider.calls == 2
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试任务日志与重启后的任务接管（逐个任务处理、部分失败后重试不重复记录）"""
+
+import os
+import sys
+
+import pytest
+import requests
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.app.services import recovery
+from src.core.comfyui.client import ComfyUIClient
+from src.core.comfyui.tracker import CompletionTracker
+from src.core.history.journal import CANCELLED, DONE, LOST, QUEUED, JobJournal
+from src.core.history.manager import HistoryManager
+
+
+class FakeComfy:
+    """代替 ComfyUI 的 /queue、/history 和 /view"""
+
+    def __init__(self):
+        self.history = {}
+        self.queued = set()
+        self.broken = set()  # 下载失败的图片文件名
+        self.downloads = []
+
+    def get_queue(self, server_address=None):
+        return {'queue_running': [[0, job_id] for job_id in self.queued], 'queue_pending': []}
+
+    def get_history(self, prompt_id, server_address=None):
+        return {prompt_id: self.history[prompt_id]} if prompt_id in self.history else {}
+
+    def download_image(self, image_ref, dest_path, server_address=None):
+        self.downloads.append(image_ref['filename'])
+        if image_ref['filename'] in self.broken:
+            raise requests.ConnectionError('reset')
+        dest_path.parent.mkdir(parents=True, exist_ok=True)
+        dest_path.write_bytes(b'png')
+        return dest_path
+
+    def finish(self, job_id, count=1):
+        images = [{'filename': f'{job_id}_{i}.png', 'subfolder': '', 'type': 'output'}
+                  for i in range(count)]
+        self.history[job_id] = {'outputs': {'9': {'images': images}}}
+
+
+@pytest.fixture
+def env(tmp_path, monkeypatch):
+    journal = JobJournal(str(tmp_path / 'jobs.db'))
+    history = HistoryManager(str(tmp_path / 'history.db'))
+    comfy = FakeComfy()
+    monkeypatch.setattr(recovery, 'job_journal', journal)
+    monkeypatch.setattr(recovery, 'history_manager', history)
+    monkeypatch.setattr(recovery, 'comfyui_client', comfy)
+    monkeypatch.setattr(recovery, 'GENERATED_DIR', tmp_path / 'generated')
+    prompt_id = history.add_record('cat', 'a cat', 'bad', 800, 1200)
+    return journal, history, comfy, prompt_id
+
+
+def record(journal, job_id, prompt_id, server='a:1'):
+    journal.record(job_id, server, prompt_id, output_nodes=['9'], seed=7,
+                   cache_key=f'key-{job_id}', positive_prompt='a cat', negative_prompt='bad')
+    return next(job for job in journal.unfinished() if job['job_id'] == job_id)
+
+
+def test_journal_lifecycle(tmp_path):
+    journal = JobJournal(str(tmp_path / 'jobs.db'))
+    journal.record('j1', 'a:1', 'p1', output_nodes=['9'], seed=3)
+    journal.record('j2', 'a:1', 'p1')
+
+    assert journal.status('j1') == QUEUED
+    assert journal.status('missing') is None
+    [first, second] = journal.unfinished()
+    assert first['output_nodes'] == ('9',) and first['seed'] == 3
+
+    journal.finish(['j1'], DONE)
+    journal.finish(['j1'], LOST)  # 已结束的任务不会被改写
+    assert journal.status('j1') == DONE
+    assert [job['job_id'] for job in journal.unfinished()] == ['j2']
+    assert journal.unfinished(max_age_hours=0) == []
+    assert journal.status('j2') == LOST
+
+
+def test_recovery_after_partial_failure(env):
+    journal, history, comfy, prompt_id = env
+    jobs = [record(journal, 'j1', prompt_id), record(journal, 'j2', prompt_id)]
+    comfy.finish('j1', count=2)
+    comfy.finish('j2', count=2)
+    comfy.broken.add('j2_1.png')
+
+    waiting = recovery._check_server('a:1', jobs)
+
+    # 只有下载失败的任务留待下一轮，且它的图片一张都没有记录
+    assert [job['job_id'] for job in waiting] == ['j2']
+    assert journal.status('j1') == DONE
+    assert journal.status('j2') == QUEUED
+    assert sorted(history.get_images_by_prompt_id(prompt_id)) == ['j1-0.png', 'j1-1.png']
+
+    comfy.broken.clear()
+    comfy.downloads.clear()
+    assert recovery._check_server('a:1', waiting) == []
+
+    # 已下载的图片不再下载，也不会重复记录
+    assert comfy.downloads == ['j2_1.png']
+    assert journal.status('j2') == DONE
+    assert sorted(history.get_images_by_prompt_id(prompt_id)) == [
+        'j1-0.png', 'j1-1.png', 'j2-0.png', 'j2-1.png']
+    assert history.get_cached_result('key-j2')['filenames'] == ['j2-0.png', 'j2-1.png']
+
+
+def test_collect_twice_is_idempotent(env):
+    journal, history, comfy, prompt_id = env
+    job = record(journal, 'j1', prompt_id)
+    comfy.finish('j1')
+
+    recovery._collect(job, comfy.history['j1'])
+    recovery._collect(job, comfy.history['j1'])
+
+    assert comfy.downloads == ['j1_0.png']
+    assert history.get_images_by_prompt_id(prompt_id) == ['j1-0.png']
+
+
+def test_skips_jobs_no_longer_queued(env):
+    journal, history, comfy, prompt_id = env
+    job = record(journal, 'j1', prompt_id)
+    comfy.finish('j1')
+    journal.finish(['j1'], CANCELLED)
+
+    assert recovery._check_server('a:1', [job]) == []
+    assert comfy.downloads == []
+    assert history.get_images_by_prompt_id(prompt_id) == []
+
+
+def test_waiting_lost_and_deleted_records(env):
+    journal, history, comfy, prompt_id = env
+    running = record(journal, 'running', prompt_id)
+    lost = record(journal, 'lost', prompt_id)
+    orphan = record(journal, 'orphan', 'deleted-record')
+    comfy.queued.add('running')
+    comfy.finish('orphan')
+
+    assert recovery._check_server('a:1', [running, lost, orphan]) == [running]
+    assert journal.status('running') == QUEUED
+    assert journal.status('lost') == LOST
+    assert journal.status('orphan') == CANCELLED
+
+
+def test_history_error_keeps_only_that_job(env, monkeypatch):
+    journal, history, comfy, prompt_id = env
+    jobs = [record(journal, 'j1', prompt_id), record(journal, 'j2', prompt_id)]
+    comfy.finish('j1')
+    comfy.finish('j2')
+    get_history = comfy.get_history
+
+    def flaky(job_id, server_address=None):
+        if job_id == 'j1':
+            raise requests.Timeout('slow')
+        return get_history(job_id, server_address)
+
+    monkeypatch.setattr(comfy, 'get_history', flaky)
+    assert recovery._check_server('a:1', jobs) == [jobs[0]]
+    assert journal.status('j2') == DONE
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(CompletionTracker, 'start', lambda self: None)
+    client = ComfyUIClient(servers=['a:1'])
+    monkeypatch.setattr(client.pool, '_probe', lambda address: 0)
+    monkeypatch.setattr(client, 'build_workflow', lambda *args, **kwargs: {
+        '9': {'class_type': 'SaveImage', 'inputs': {}}})
+    yield client
+    client.pool.close()
+
+
+def test_submit_journals_before_post(client, monkeypatch):
+    events = []
+
+    def queue_prompt(workflow, server_address=None, prompt_id=None):
+        events.append(('post', prompt_id))
+        return {'prompt_id': prompt_id}
+
+    monkeypatch.setattr(client, 'queue_prompt', queue_prompt)
+    job = client.submit_image('p', 'n', on_queue=lambda job: events.append(('journal', job.prompt_id)))
+
+    assert events == [('journal', job.prompt_id), ('post', job.prompt_id)]
+    assert job.output_nodes == ('9',)
+    client.discard(job)
+
+
+def test_submit_reports_server_assigned_id(client, monkeypatch):
+    """ComfyUI 忽略客户端 ID 时，以新 ID 再次调用 on_queue"""
+    events = []
+    monkeypatch.setattr(client, 'queue_prompt',
+                        lambda workflow, server_address=None, prompt_id=None: {'prompt_id': 'server-id'})
+    job = client.submit_image('p', 'n', on_queue=lambda job: events.append(job.prompt_id))
+
+    assert job.prompt_id == 'server-id'
+    assert len(events) == 2 and events[0] != 'server-id' and events[1] == 'server-id'
+    client.discard(job)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试 API 请求中布尔字段的解析（"false" 不能被当作真）"""
+
+import os
+import sys
+
+import pytest
+from flask import Flask
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.app.routes import api
+
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+    app.register_blueprint(api.bp)
+    return app.test_client()
+
+
+@pytest.mark.parametrize('value, expected', [
+    (True, True), (False, False), (1, True), (0, False),
+    ('true', True), ('false', False), ('1', True), ('0', False), (' No ', False), ('on', True),
+])
+def test_parse_bool(value, expected):
+    assert api._parse_bool('draft', value) is expected
+
+
+@pytest.mark.parametrize('value', ['maybe', '', 2, 0.5, [], {}])
+def test_parse_bool_rejects(value):
+    with pytest.raises(ValueError):
+        api._parse_bool('draft', value)
+
+
+def test_start_rejects_invalid_draft(client, monkeypatch):
+    monkeypatch.setattr(api, 'start_generation_request', lambda *args: pytest.fail('不应启动生成'))
+    response = client.post('/api/start', json={'prompt': 'p', 'draft': 'maybe'})
+
+    assert response.status_code == 400
+    assert 'draft' in response.get_json()['message']
+
+
+def test_start_parses_string_false(client, monkeypatch):
+    calls = []
+
+    def start(prompt, count, width, height, image_path, seed, draft, features, variants):
+        calls.append((draft, features))
+        return {'current_prompt': prompt, 'total_count': count, 'draft': draft,
+                'features': features, 'variants': variants}
+
+    monkeypatch.setattr(api, 'start_generation_request', start)
+    response = client.post('/api/start', json={'prompt': 'p', 'draft': 'false', 'face_fix': '0'})
+
+    assert response.status_code == 200
+    assert calls == [(False, {'face_fix': False})]
+
+
+def test_finalize_rejects_invalid_feature(client, monkeypatch):
+    monkeypatch.setattr(api, 'finalize_images_request', lambda *args: pytest.fail('不应开始精修'))
+    response = client.post('/api/finalize', json={'filenames': ['a.png'], 'upscale': 'sometimes'})
+
+    assert response.status_code == 400
+    assert 'upscale' in response.get_json()['message']
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试多端点 LLM 路由：按 EMA 预计耗时选路、出错切换端点、熔断端点排在最后"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.core.prompt import router as router_module
+from src.core.prompt.providers import CancelEvent, CircuitBreaker, LLMProvider, PromptCancelledError
+from src.core.prompt.router import LLMRouter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(router_module.time, 'monotonic', clock)
+    return clock
+
+
+class FakeProvider(LLMProvider):
+    """按设定的首片段延迟和片段间隔（推进假时钟）输出片段；fail_after 个片段后断开"""
+
+    name = 'fake'
+
+    def __init__(self, label, clock, ttft=1.0, gap=0.1, chunks=('a', 'b', 'c'), fail_after=None):
+        super().__init__(label, CircuitBreaker(label, max_failures=2, cooldown=60))
+        self.clock = clock
+        self.ttft = ttft
+        self.gap = gap
+        self.chunks = chunks
+        self.fail_after = fail_after
+        self.calls = 0
+
+    def _chat(self, messages, stream, callback, cancel_event, stop_when):
+        self.calls += 1
+        self.clock.now += self.ttft
+        for index, chunk in enumerate(self.chunks):
+            if self.fail_after is not None and index == self.fail_after:
+                raise ConnectionError(f'{self.model} reset')
+            if index:
+                self.clock.now += self.gap
+            if callback:
+                callback(chunk)
+        return ''.join(self.chunks)
+
+
+def names(providers):
+    return [provider.model for provider in providers]
+
+
+def test_untried_endpoints_first_then_fastest(clock):
+    slow = FakeProvider('slow', clock, ttft=3.0)
+    fast = FakeProvider('fast', clock, ttft=0.5)
+    router = LLMRouter([slow, fast], alpha=0.5, expected_tokens=10)
+
+    # 没有数据时按配置顺序
+    assert names(router.candidates()) == ['slow', 'fast']
+    router.chat([], stream=True, callback=lambda chunk: None)
+    # fast 还没有数据，先被试用
+    assert names(router.candidates()) == ['fast', 'slow']
+    router.chat([], stream=True, callback=lambda chunk: None)
+    assert names(router.candidates()) == ['fast', 'slow']
+
+    [slow_stats, fast_stats] = router.snapshot()
+    assert slow_stats['ttft'] == 3.0 and fast_stats['ttft'] == 0.5
+    assert fast_stats['tokens_per_second'] == pytest.approx(10.0)
+
+
+def test_ema_follows_slowdown(clock):
+    first = FakeProvider('first', clock, ttft=1.0)
+    second = FakeProvider('second', clock, ttft=2.0)
+    router = LLMRouter([first, second], alpha=0.5, expected_tokens=10)
+    router.chat([], stream=True, callback=lambda chunk: None)
+    router.chat([], stream=True, callback=lambda chunk: None)
+    assert names(router.candidates()) == ['first', 'second']
+
+    # first 变慢：EMA 1.0 -> 3.0，超过 second 后不再优先
+    first.ttft = 5.0
+    router.chat([], stream=True, callback=lambda chunk: None)
+    assert router.snapshot()[0]['ttft'] == 3.0
+    assert names(router.candidates()) == ['second', 'first']
+
+
+def test_failover_retracts_partial_output(clock):
+    broken = FakeProvider('broken', clock, chunks=('x', 'y', 'z'), fail_after=2)
+    backup = FakeProvider('backup', clock)
+    router = LLMRouter([broken, backup])
+    received = []
+
+    result = router.chat([], stream=True, callback=received.append,
+                         on_failover=lambda: received.append('|'))
+
+    assert result == 'abc'
+    assert received == ['x', 'y', '|', 'a', 'b', 'c']
+    [broken_stats, backup_stats] = router.snapshot()
+    assert (broken_stats['errors'], broken_stats['failovers'], broken_stats['failures']) == (1, 1, 1)
+    assert backup_stats['requests'] == 1
+
+
+def test_all_endpoints_fail_raises_last_error(clock):
+    router = LLMRouter([FakeProvider('a', clock, fail_after=0), FakeProvider('b', clock, fail_after=0)])
+
+    with pytest.raises(ConnectionError, match='b reset'):
+        router.chat([])
+    # 最后一个端点之后没有可切换的端点
+    assert [entry['failovers'] for entry in router.snapshot()] == [1, 0]
+
+
+def test_open_breaker_sorts_last_and_is_skipped(clock):
+    fast = FakeProvider('fast', clock, ttft=0.1, fail_after=0)
+    slow = FakeProvider('slow', clock, ttft=2.0)
+    router = LLMRouter([fast, slow])
+    fast.breaker.record_failure()
+    fast.breaker.record_failure()
+
+    assert names(router.candidates()) == ['slow', 'fast']
+    assert router.chat([]) == 'abc'
+    assert fast.calls == 0
+
+
+def test_cancel_does_not_fail_over(clock):
+    class Cancelled(FakeProvider):
+        def _chat(self, messages, stream, callback, cancel_event, stop_when):
+            self.calls += 1
+            cancel_event.set()
+            raise ConnectionError('closed')
+
+    first = Cancelled('first', clock)
+    second = FakeProvider('second', clock)
+    router = LLMRouter([first, second])
+
+    with pytest.raises(PromptCancelledError):
+        router.chat([], cancel_event=CancelEvent())
+    assert second.calls == 0
+    assert router.snapshot()[0]['errors'] == 0
+
+
+def test_get_router_reads_endpoints(monkeypatch):
+    monkeypatch.setenv('LLM_ENDPOINTS', 'ollama=http://gpu1:11434, gemini')
+    assert router_module.endpoint_specs() == [('ollama', 'http://gpu1:11434'), ('gemini', None)]
+    monkeypatch.setenv('LLM_ENDPOINTS', '')
+    monkeypatch.setenv('AI_PROVIDER', 'gemini')
+    assert router_module.endpoint_specs() == [('gemini', None)]
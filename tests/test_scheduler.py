@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试缓存感知调度：签名、后端亲和性打分与批次排序"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.core.comfyui.scheduler import CacheAwareScheduler, JobSignature
+
+WORKFLOWS = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'config', 'workflows'))
+NORMAL = os.path.join(WORKFLOWS, 'flowv_normal.json')
+FACE = os.path.join(WORKFLOWS, 'flow_face.json')
+
+
+def sig(models, text):
+    return JobSignature('wf', models, text)
+
+
+def test_signature_separates_models_and_text():
+    scheduler = CacheAwareScheduler()
+    base = scheduler.signature(NORMAL, 'a cat', 'bad')
+
+    assert scheduler.signature(NORMAL, 'a cat', 'bad') == base
+    other_text = scheduler.signature(NORMAL, 'a dog', 'bad')
+    assert other_text.models == base.models and other_text.text != base.text
+    # 人脸参考图属于模型侧
+    face = scheduler.signature(FACE, 'a cat', 'bad', image_digest='abc')
+    assert face.models != base.models and face.text == base.text
+    assert scheduler.signature(FACE, 'a cat', 'bad', image_digest='xyz').models != face.models
+
+
+def test_affinity_scores_last_job():
+    scheduler = CacheAwareScheduler()
+    score = scheduler.affinity(sig('m1', 't1'))
+    assert score('a') == 0
+
+    scheduler.record('a', sig('m1', 't2'))
+    scheduler.record('b', sig('m1', 't1'))
+    # 模型不同时提示词编码无法复用
+    scheduler.record('c', sig('m2', 't1'))
+    assert (score('a'), score('b'), score('c')) == (2, 3, 0)
+
+    scheduler.forget('b')
+    assert score('b') == 0
+
+
+def test_order_groups_models_then_text():
+    scheduler = CacheAwareScheduler()
+    signatures = [sig('m1', 't1'), sig('m2', 't1'), sig('m1', 't2'), sig('m1', 't1'), sig('m2', 't1')]
+
+    assert scheduler.order(signatures) == [0, 3, 2, 1, 4]
+    metrics = scheduler.metrics()
+    assert metrics['reordered_batches'] == 1
+    # 原顺序 4 次加载模型，排序后 2 次
+    assert metrics['reorder_avoided_reloads'] == 2
+
+
+def test_order_starts_with_what_backend_ran_last():
+    scheduler = CacheAwareScheduler()
+    scheduler.record('a', sig('m2', 't9'))
+    signatures = [sig('m1', 't1'), sig('m2', 't1'), sig('m1', 't1')]
+
+    assert scheduler.order(signatures, 'a') == [1, 0, 2]
+    assert scheduler.order(signatures, 'b') == [0, 2, 1]
+
+
+def test_order_keeps_sorted_batch():
+    scheduler = CacheAwareScheduler()
+    signatures = [sig('m1', 't1'), sig('m1', 't1'), sig('m2', 't1')]
+
+    assert scheduler.order(signatures) == [0, 1, 2]
+    assert scheduler.metrics()['reordered_batches'] == 0
+
+
+def test_record_counts_model_and_text_reuse():
+    scheduler = CacheAwareScheduler()
+    scheduler.record('a', sig('m1', 't1'))
+    scheduler.record('a', sig('m1', 't1'))
+    scheduler.record('a', sig('m1', 't2'))
+    scheduler.record('a', sig('m2', 't2'))
+
+    metrics = scheduler.metrics()
+    assert (metrics['jobs'], metrics['model_loads'], metrics['model_reuse'], metrics['text_reuse']) == (4, 2, 2, 1)
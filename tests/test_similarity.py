@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试用户需求归一化与 MinHash 近似重复查找"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.core.prompt.similarity import (
+    MinHashIndex,
+    minhash,
+    normalize_request,
+    signature_from_bytes,
+    signature_to_bytes,
+    similarity,
+)
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('ＡＢＣ　１２３', 'abc 123'),          # 全角转半角（NFKC）
+    ('  A   Cat\n\tIn  Space ', 'a cat in space'),
+    ('a cat, in space!', 'a cat in space'),  # 标点视为空白
+    ('红色 的 猫', '红色的猫'),              # 中文两侧的空白去掉
+    ('红色的猫，在星空下。', '红色的猫在星空下'),
+    ('cyberpunk 城市', 'cyberpunk城市'),
+])
+def test_normalize_request(text, expected):
+    assert normalize_request(text) == expected
+
+
+def test_minhash_ignores_normalized_differences():
+    assert minhash('一只猫，在星空下') == minhash('一只猫 在星空下')
+    assert similarity(minhash('A Cat'), minhash('a cat')) == 1.0
+
+
+def test_signature_roundtrip():
+    signature = minhash('一只可爱的猫咪在星空下散步')
+    assert signature_from_bytes(signature_to_bytes(signature)) == signature
+    assert signature_from_bytes(b'\x00' * 8) is None
+
+
+def test_index_threshold():
+    index = MinHashIndex()
+    index.add('cat', 'ns', minhash('一只可爱的猫咪在星空下散步，梦幻的色彩，柔和的光线'))
+
+    near = minhash('一只可爱的猫咪在星空下散步，梦幻的色彩，柔和的灯光')
+    far = minhash('赛博朋克风格的未来城市，霓虹灯光，雨夜街道')
+
+    match = index.query('ns', near, 0.6)
+    assert match is not None and match[0] == 'cat'
+    assert index.query('ns', near, 1.0) is None
+    assert index.query('ns', far, 0.5) is None
+
+
+def test_index_is_per_namespace():
+    index = MinHashIndex()
+    signature = minhash('preset one')
+    index.add('a', 'ns1', signature)
+
+    assert index.query('ns2', signature, 0.5) is None
+    index.remove_namespace('ns1')
+    assert index.query('ns1', signature, 0.5) is None
+    assert len(index) == 0
+
+
+def test_index_drops_oldest_entries():
+    index = MinHashIndex(max_entries=2)
+    for key in ('a', 'b', 'c'):
+        index.add(key, 'ns', minhash(f'prompt {key} ' * 3))
+
+    assert len(index) == 2
+    assert index.query('ns', minhash('prompt a ' * 3), 1.0) is None
+    assert index.query('ns', minhash('prompt c ' * 3), 1.0)[0] == 'c'
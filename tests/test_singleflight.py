@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试相同请求的合并：只发起一次请求、订阅者补发与撤回、等待者计数"""
+
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.core.prompt import generator
+from src.core.prompt.providers import CancelEvent, PromptCancelledError
+from src.core.prompt.singleflight import Flight, SingleFlight
+
+
+def test_join_coalesces_same_key():
+    flights = SingleFlight()
+    flight, leader = flights.join('k')
+    other, other_leader = flights.join('k')
+    _, third_leader = flights.join('other')
+
+    assert leader and not other_leader and third_leader
+    assert other is flight
+    assert flight.waiters == 1 and flights.coalesced == 1
+    assert len(flights) == 2
+
+    flights.finish('k', flight, result='done')
+    assert flight.wait() and flight.result == 'done'
+    # 结束后同一个键重新发起
+    assert flights.join('k')[1]
+
+
+def test_subscriber_replay_and_order():
+    flight = Flight()
+    flight.publish('a')
+    flight.publish('b')
+    received = []
+    callback = received.append
+    flight.subscribe(callback)
+    flight.publish('c')
+    flight.unsubscribe(callback)
+    flight.publish('d')
+
+    assert received == ['a', 'b', 'c']
+
+
+def test_reset_withdraws_what_each_subscriber_received():
+    flight = Flight()
+    early, late, withdrawn = [], [], []
+    flight.subscribe(early.append, on_reset=lambda text: withdrawn.append(('early', text)))
+    flight.publish('a')
+    flight.subscribe(late.append, on_reset=lambda text: withdrawn.append(('late', text)))
+    flight.publish('b')
+    flight.reset()
+    flight.publish('x')
+
+    assert early == ['a', 'b', 'x'] and late == ['a', 'b', 'x']
+    assert withdrawn == [('early', 'ab'), ('late', 'ab')]
+
+    # 撤回之后订阅的调用方只收到新片段
+    fresh = []
+    flight.subscribe(fresh.append)
+    assert fresh == ['x']
+
+
+def test_failing_subscriber_does_not_stop_others():
+    flight = Flight()
+    received = []
+
+    def broken(chunk):
+        raise RuntimeError('socket closed')
+
+    flight.subscribe(broken)
+    flight.subscribe(received.append)
+    flight.publish('a')
+    assert received == ['a']
+
+
+def test_wait_returns_false_on_cancel():
+    flight = Flight()
+    cancel_event = CancelEvent()
+    cancel_event.set()
+    assert flight.wait(cancel_event) is False
+
+
+@pytest.fixture
+def flights(monkeypatch):
+    flights = SingleFlight()
+    monkeypatch.setattr(generator, '_inflight', flights)
+    return flights
+
+
+def await_in_thread(flight, cancel_event=None, stream=False):
+    """在线程中以等待者身份调用 _await_flight，返回 (线程, 结果列表)"""
+    outcome = []
+
+    def run():
+        try:
+            outcome.append(generator._await_flight(
+                flight, stream, lambda chunk: None, None, lambda msg: None, cancel_event))
+        except BaseException as exc:
+            outcome.append(exc)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, outcome
+
+
+def test_waiters_leave_after_result(flights):
+    flight, _ = flights.join('k')
+    threads = []
+    for _ in range(3):
+        joined, leader = flights.join('k')
+        assert not leader
+        threads.append(await_in_thread(joined, stream=True))
+    assert flight.waiters == 3
+
+    flight.publish('P')
+    flights.finish('k', flight, result=[('P', 'N')])
+    for thread, outcome in threads:
+        thread.join(2)
+        assert outcome == [[('P', 'N')]]
+    assert flight.waiters == 0
+
+
+def test_cancelled_waiter_leaves_without_affecting_leader(flights):
+    flight, _ = flights.join('k')
+    flights.join('k')
+    cancel_event = CancelEvent()
+    thread, outcome = await_in_thread(flight, cancel_event)
+    cancel_event.set()
+    thread.join(2)
+
+    assert isinstance(outcome[0], PromptCancelledError)
+    assert flight.waiters == 0
+    assert len(flights) == 1
+
+
+def test_waiter_retries_when_leader_cancelled(flights):
+    flight, _ = flights.join('k')
+    flights.join('k')
+    thread, outcome = await_in_thread(flight)
+    flights.finish('k', flight, error=PromptCancelledError('stopped'))
+    thread.join(2)
+
+    assert outcome == [None]
+    assert flight.waiters == 0
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试提示词标签的增量解析"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.core.prompt.tags import PromptTagParser, parse_tags
+
+RESPONSE = (
+    '<think>先想想 <positive_prompt>不是这个</positive_prompt></think>\n'
+    '<positive_prompt>a cat, starry sky</positive_prompt>\n'
+    '<negative_prompt>blurry</negative_prompt>'
+)
+
+
+def feed_all(parser, chunks):
+    for chunk in chunks:
+        parser.feed(chunk)
+    return parser
+
+
+def test_whole_response():
+    assert parse_tags(RESPONSE) == [('a cat, starry sky', 'blurry')]
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 5, 7, 16])
+def test_chunk_boundaries_inside_tags(size):
+    """标签、<think> 块被切断在任意位置时结果不变"""
+    chunks = [RESPONSE[i:i + size] for i in range(0, len(RESPONSE), size)]
+    parser = feed_all(PromptTagParser(), chunks)
+
+    assert parser.done
+    assert parser.variants() == [('a cat, starry sky', 'blurry')]
+
+
+def test_done_stops_at_required_count():
+    parser = PromptTagParser(2)
+    assert not parser.feed('<positive_prompt>p1</positive_prompt><negative_prompt>n1</negative_prompt>')
+    assert parser.feed('<positive_prompt>p2</positive_prompt><negative_prompt>n2</negative_prompt>')
+    # 已完成后的输出被忽略
+    parser.feed('<positive_prompt>p3</positive_prompt>')
+    assert parser.variants() == [('p1', 'n1'), ('p2', 'n2')]
+
+
+def test_missing_negative_reuses_previous():
+    parser = feed_all(PromptTagParser(2), [
+        '<positive_prompt>p1</positive_prompt><negative_prompt>n1</negative_prompt>',
+        '<positive_prompt>p2</positive_prompt>',
+    ])
+    assert parser.variants() == [('p1', 'n1'), ('p2', 'n1')]
+
+
+def test_unclosed_think_hides_tags():
+    parser = feed_all(PromptTagParser(), ['<think>', '<positive_prompt>x</positive_prompt>'])
+    assert not parser.done
+    with pytest.raises(ValueError):
+        parser.variants()
+
+
+def test_reset_discards_partial_output():
+    parser = PromptTagParser()
+    parser.feed('<positive_prompt>from the failed endpo')
+    parser.reset()
+    parser.feed('<positive_prompt>ok</positive_prompt><negative_prompt>n</negative_prompt>')
+    assert parser.variants() == [('ok', 'n')]
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试 CompletionTracker 的唤醒、取消与重新布防"""
+
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.core.comfyui.tracker import CompletionTracker, JobCancelledError
+
+
+@pytest.fixture
+def tracker(monkeypatch):
+    """不连接 websocket 的 tracker；安全网轮询间隔足够长，测试只能靠事件唤醒"""
+    tracker = CompletionTracker('127.0.0.1:1', check_interval=30.0, poll_interval=30.0,
+                                settle_interval=0.0)
+    monkeypatch.setattr(tracker, 'start', lambda: None)
+    return tracker
+
+
+def wait_in_thread(tracker, prompt_id, history, timeout=5.0):
+    result = {}
+
+    def run():
+        try:
+            result['history'] = tracker.wait_for_completion(prompt_id, lambda pid: dict(history),
+                                                            timeout=timeout)
+        except Exception as exc:
+            result['error'] = exc
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread, result
+
+
+def test_completion_wakes_waiter(tracker):
+    history = {}
+    thread, result = wait_in_thread(tracker, 'p1', history)
+    time.sleep(0.05)
+
+    history['p1'] = {'outputs': {}}
+    started = time.monotonic()
+    tracker._mark_finished('p1', 'success')
+    thread.join(2)
+
+    assert result == {'history': {'p1': {'outputs': {}}}}
+    assert time.monotonic() - started < 1.0
+
+
+def test_cancel_raises(tracker):
+    thread, result = wait_in_thread(tracker, 'p1', {})
+    time.sleep(0.05)
+    tracker.cancel('p1')
+    thread.join(2)
+
+    assert isinstance(result.get('error'), JobCancelledError)
+
+
+def test_reconnect_wake_rearms(tracker):
+    event = tracker._watch('p1', threading.Event())
+    tracker._wake_all()
+    assert event.is_set()
+
+    assert tracker._rearm('p1', event) is None
+    assert not event.is_set()
+
+
+def test_completion_between_wake_and_rearm_is_kept(tracker):
+    """重连唤醒后、清除事件前到达的完成通知不能被清掉"""
+    event = tracker._watch('p1', threading.Event())
+    tracker._wake_all()
+    tracker._mark_finished('p1', 'success')
+
+    assert tracker._rearm('p1', event) == 'success'
+    assert event.is_set()
+
+
+def test_late_waiter_sees_earlier_completion(tracker):
+    tracker._mark_finished('p1', 'success')
+    history = {'p1': {'outputs': {}}}
+
+    assert tracker.wait_for_completion('p1', lambda pid: history, timeout=1) == history